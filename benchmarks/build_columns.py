@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+    Times the calculated columns of a chunk of trials (processor.build_columns)
+    and the mapping of its rows to trial objects (processor.build_trial),
+    against the row-wise implementation they replaced: a `strptime` per
+    date of every row and a Python regex per phase.
+
+    Usage:
+        python benchmarks/build_columns.py --rows 10000 --repeat 5
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "visual.settings")
+
+parser = argparse.ArgumentParser(description='Times build_columns and build_trial on a chunk of trials.')
+parser.add_argument('--rows', '-n', type=int, default=10000, help='Number of trials in the chunk.')
+parser.add_argument('--repeat', '-r', type=int, default=5, help='Number of runs of each step (the best is kept).')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic trials.')
+args = parser.parse_args()
+
+import django
+django.setup()
+
+import pandas as pd
+import corpus
+from datetime import datetime
+from panels.utils import processor, tools
+from panels.models import Trial
+from panels.utils.record import *
+
+
+def records(rows: int) -> list:
+    rng = random.Random(args.seed)
+    date = lambda: corpus.a_date(rng, rng.random() < 0.5) if rng.random() < 0.9 else None
+    return [TrialRecord(nct_id='NCT%08d' % n, status=rng.choice(corpus.STATUSES),
+                        phase=' / '.join(rng.choice(corpus.PHASES)) if rng.random() < 0.9 else None,
+                        primary_purpose=rng.choice(corpus.PURPOSES), lead_sponsor_type=rng.choice(corpus.SPONSOR_CLASSES)[0],
+                        first_posted=corpus.a_date(rng), last_update=corpus.a_date(rng), start_date=date(),
+                        primary_completion=date(), completion_date=date(), min_age='{} Years'.format(rng.randint(18, 65)),
+                        enrollment=rng.randint(0, 2000) if rng.random() < 0.95 else None, arms_number=rng.randint(0, 4),
+                        locations=[LocationRecord('Site', 'City', None, rng.choice(corpus.COUNTRIES), None)
+                                    for _ in range(corpus.tail(rng, 1.1, 100))]).finish()
+            for n in range(rows)]
+
+
+def strptime(date_str: str) -> datetime:
+    # tools.read_date without its cache
+    if not date_str:
+        return None
+    return datetime.strptime(date_str, '%B %d, %Y' if ',' in date_str else '%B %Y')
+
+
+def rowwise_columns(data: pd.DataFrame):
+    """
+        The calculated columns of build_columns computed row by row
+    """
+    data = data.astype(object).where(data.notna(), None)
+    data['study_duration'] = data.apply(lambda x: (strptime(x['completion_date']) - strptime(x['start_date'])).days
+                                        if x['completion_date'] and x['start_date'] else None, axis=1)
+    data['per_arm'] = data.apply(lambda x: x['enrollment'] / x['arms_number']
+                                 if x['enrollment'] is not None and x['arms_number'] else 0, axis=1)
+    data['phase'] = data['phase'].fillna('N').apply(lambda x: re.sub(r'\s|\||Phase|/', '', x.replace('N/A', 'N')))
+    return data
+
+
+def record_columns(chunk: list):
+    """
+        The columns build_columns reads from the child lists of records,
+        computed the same way before and after
+    """
+    locations = [Trial.location_of(r.countries) for r in chunk]
+    outcomes = [processor.outcome_text(r.outcomes_of(kind)) for kind in (PRIMARY, SECONDARY, OTHER) for r in chunk]
+    return locations, outcomes
+
+
+def best(func) -> float:
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_trials(rows: list, cached: bool):
+    read_date = tools.read_date
+    if not cached:
+        tools.read_date = strptime
+    try:
+        for r in rows:
+            processor.build_trial(r)
+    finally:
+        tools.read_date = read_date
+
+
+if __name__ == '__main__':
+    chunk = records(args.rows)
+    frame = RecordBatch(chunk).frame
+    dates = pd.concat([frame[c] for c in ('first_posted', 'start_date', 'primary_completion', 'completion_date', 'last_update')])
+
+    rows = processor.build_columns(RecordBatch(chunk)).rows()
+    new = processor.build_columns(RecordBatch(chunk, frame.copy())).frame
+    old = rowwise_columns(frame.copy())
+    for column in ('study_duration', 'per_arm', 'phase'):
+        a, b = new[column].astype(object).where(new[column].notna(), None), old[column]
+        assert (a.fillna(-1) == b.fillna(-1)).all(), column
+
+    tools.read_date.cache_clear()
+    cold = best(lambda: (tools.read_date.cache_clear(), build_trials(rows, True)))
+    warm = best(lambda: build_trials(rows, True))
+
+    rowwise = best(lambda: rowwise_columns(frame.copy()))
+    children = best(lambda: record_columns(chunk))
+    steps = [
+        ('duration, per arm, phase, row-wise', rowwise),
+        ('location and outcome columns', children),
+        ('build_columns before (sum of the above)', rowwise + children),
+        ('build_columns', best(lambda: processor.build_columns(RecordBatch(chunk, frame.copy())))),
+        ('date column, strptime per row', best(lambda: dates.map(strptime, na_action='ignore'))),
+        ('date column, to_dates', best(lambda: tools.to_dates(dates))),
+        ('build_trial, strptime per date', best(lambda: build_trials(rows, False))),
+        ('build_trial, cached read_date (cold)', cold),
+        ('build_trial, cached read_date (warm)', warm),
+    ]
+
+    print('{:,} trials, {:,} distinct date strings\n'.format(args.rows, dates.nunique()))
+    print('{:<40} {:>10} {:>12}'.format('step', 'ms', 'us per row'))
+    for name, seconds in steps:
+        print('{:<40} {:>10.1f} {:>12.2f}'.format(name, seconds * 1000, seconds / args.rows * 1e6))
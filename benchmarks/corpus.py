@@ -0,0 +1,821 @@
+#!/usr/bin/env python
+"""
+    Builds a reproducible local corpus of studies for the parser benchmark
+    (benchmarks/parsers.py). Synthetic studies are generated from a seed
+    with the shape of clinicaltrials.gov records (long tails of locations,
+    outcomes and text) and written both as XML downloads and as responses
+    of the FullStudy API, so all the parsers can be checked against each
+    other on the same trials. Huge documents with posted results are
+    generated up to a target size. A deterministic sample of real studies
+    is copied from an AllPublicXML.zip archive or a directory of extracted
+    files when a source is given.
+
+    The same arguments always build the same files, `digest` fingerprints
+    a corpus to check it.
+
+    Usage:
+        python benchmarks/corpus.py /tmp/corpus --studies 500 --huge 4 --source AllPublicXML.zip
+"""
+import os
+import random
+import hashlib
+import zipfile
+import argparse
+from xml.sax.saxutils import escape, quoteattr
+
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+            'September', 'October', 'November', 'December']
+
+WORDS = ('the of and to in patients with disease study treatment alzheimer dementia cognitive '
+            'placebo dose mild moderate participants trial weeks efficacy safety clinical '
+            'memory amyloid tau biomarker mmse adas-cog score baseline change randomized '
+            'double-blind oral daily visit assessment onset progression group').split()
+
+STATUSES = ['Recruiting', 'Completed', 'Active, not recruiting', 'Not yet recruiting',
+            'Terminated', 'Withdrawn', 'Enrolling by invitation', 'Suspended', 'Unknown status']
+PHASES = [['Phase 1'], ['Phase 2'], ['Phase 3'], ['Phase 4'], ['Early Phase 1'],
+            ['Phase 1', 'Phase 2'], ['Phase 2', 'Phase 3'], ['N/A']]
+PURPOSES = ['Treatment', 'Prevention', 'Diagnostic', 'Supportive Care', 'Basic Science', 'Other']
+ALLOCATIONS = ['Randomized', 'Non-Randomized', 'N/A']
+INTERVENTIONS = ['Drug', 'Biological', 'Behavioral', 'Device', 'Dietary Supplement', 'Procedure', 'Other']
+ARM_TYPES = ['Experimental', 'Placebo Comparator', 'Active Comparator', 'No Intervention']
+COUNTRIES = ['United States'] * 6 + ['Canada', 'France', 'Germany', 'Japan', 'Spain', 'United Kingdom',
+            'China', 'Australia', 'Italy']
+CITIES = ['Boston', 'Las Vegas', 'Toronto', 'Paris', 'Berlin', 'Tokyo', 'Madrid', 'London', 'Shanghai']
+STATES = ['Massachusetts', 'Nevada', 'California', 'New York', 'Ontario']
+GENDERS = ['All', 'All', 'All', 'Female', 'Male']
+
+# lead sponsor classes: (XML download, FullStudy API)
+SPONSOR_CLASSES = [('Industry', 'INDUSTRY'), ('Other', 'OTHER'), ('NIH', 'NIH'), ('U.S. Fed', 'FED')]
+
+# corpus directories: synthetic XML downloads, the same trials as FullStudy
+# responses, huge XML downloads with results, huge FullStudy responses and
+# the sample of real studies
+SETS = ('xml', 'full', 'huge', 'huge-full', 'sample')
+
+
+class Writer:
+    """
+        Writes indented XML elements into a list of lines
+    """
+    def __init__(self, indent='  '):
+        self.lines = []
+        self.depth = 0
+        self.indent = indent
+
+
+    def leaf(self, tag: str, text, **attrs):
+        if text is None:
+            return
+        attrs = ''.join(' {}={}'.format(k, quoteattr(str(v))) for k, v in attrs.items())
+        self.lines.append('{}<{}{}>{}</{}>'.format(self.indent * self.depth, tag, attrs, escape(str(text)), tag))
+
+
+    def empty(self, tag: str, **attrs):
+        attrs = ''.join(' {}={}'.format(k, quoteattr(str(v))) for k, v in attrs.items())
+        self.lines.append('{}<{}{}/>'.format(self.indent * self.depth, tag, attrs))
+
+
+    def open(self, tag: str, **attrs):
+        attrs = ''.join(' {}={}'.format(k, quoteattr(str(v))) for k, v in attrs.items())
+        self.lines.append('{}<{}{}>'.format(self.indent * self.depth, tag, attrs))
+        self.depth += 1
+
+
+    def close(self, tag: str):
+        self.depth -= 1
+        self.lines.append('{}</{}>'.format(self.indent * self.depth, tag))
+
+
+    def size(self) -> int:
+        return sum(len(l) + 1 for l in self.lines)
+
+
+    def text(self) -> str:
+        return '<?xml version="1.0" encoding="UTF-8"?>\n' + '\n'.join(self.lines) + '\n'
+
+
+
+class FullWriter(Writer):
+    """
+        Writes the Field, Struct and List elements of FullStudy responses
+    """
+    def __init__(self):
+        super().__init__(indent=' ')
+
+
+    def field(self, name: str, value):
+        self.leaf('Field', value, Name=name)
+
+
+    def struct(self, name: str):
+        self.open('Struct', Name=name)
+
+
+    def list(self, name: str):
+        self.open('List', Name=name)
+
+
+    def end(self, tag='Struct'):
+        self.close(tag)
+
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def paragraph(rng: random.Random, sentences: int) -> str:
+    return ' '.join(sentence(rng, rng.randint(6, 20)) for _ in range(sentences))
+
+
+def textblock(rng: random.Random, paragraphs: int) -> str:
+    """
+        Returns a text laid out like the textblocks of clinicaltrials.gov
+    """
+    return '\n\n' + '\n\n'.join('        ' + paragraph(rng, rng.randint(1, 5)) for _ in range(paragraphs)) + '\n      '
+
+
+def criteria(rng: random.Random) -> str:
+    lines = ['        Inclusion Criteria:', '']
+    lines += ['          -  ' + sentence(rng, rng.randint(4, 18)) for _ in range(rng.randint(2, 15))]
+    lines += ['', '        Exclusion Criteria:', '']
+    lines += ['          -  ' + sentence(rng, rng.randint(4, 18)) for _ in range(rng.randint(1, 25))]
+    return '\n\n' + '\n'.join(lines) + '\n      '
+
+
+def a_date(rng: random.Random, full: bool = True) -> str:
+    if full:
+        return '{} {}, {}'.format(rng.choice(MONTHS), rng.randint(1, 28), rng.randint(1999, 2023))
+    return '{} {}'.format(rng.choice(MONTHS), rng.randint(1999, 2023))
+
+
+def tail(rng: random.Random, alpha: float, limit: int) -> int:
+    """
+        Returns a count from a long tailed distribution (most trials have
+        a few sites or outcomes, a few have hundreds)
+    """
+    return min(int(rng.paretovariate(alpha)), limit)
+
+
+def study(rng: random.Random, n: int, results: str = None) -> dict:
+    """
+        Generates the content of a synthetic study
+
+        - Parameters
+        ============================
+        + rng:      The random generator of the corpus
+        + n:        Number of the study (its NCT ID)
+        + results:  None, 'small' or 'huge' posted results
+
+        - Return
+        ============================
+        + dict : Fields of the study, rendered by `to_xml` and `to_full`
+    """
+    arms = [('Arm {}'.format(i), rng.choice(ARM_TYPES)) for i in range(rng.randint(1, 4))]
+    outcome = lambda: (sentence(rng, rng.randint(3, 12)), '{} {}'.format(rng.randint(1, 104), rng.choice(['weeks', 'months', 'days'])),
+                        paragraph(rng, rng.randint(1, 3)) if rng.random() < 0.7 else None)
+    location = lambda: ('Site {}'.format(rng.randint(1, 5000)), rng.choice(CITIES),
+                        rng.choice(STATES) if rng.random() < 0.5 else None,
+                        rng.choice(COUNTRIES), str(rng.randint(10000, 99999)) if rng.random() < 0.6 else None)
+    return {
+        'nct_id' : 'NCT%08d' % n,
+        'org_id' : 'ORG-{}-{}'.format(rng.randint(100, 999), n),
+        'brief_title' : sentence(rng, rng.randint(4, 12)),
+        'official_title' : sentence(rng, rng.randint(8, 30)) if rng.random() < 0.9 else None,
+        'sponsor' : ('Sponsor {}'.format(rng.randint(1, 300)), rng.choice(SPONSOR_CLASSES)),
+        'collaborators' : ['Collaborator {}'.format(rng.randint(1, 300)) for _ in range(tail(rng, 2.5, 10) - 1)],
+        'brief_summary' : textblock(rng, rng.randint(1, 2)),
+        'description' : textblock(rng, rng.randint(1, 8)) if rng.random() < 0.7 else None,
+        'status' : rng.choice(STATUSES),
+        'start' : a_date(rng, rng.random() < 0.5),
+        'primary_completion' : a_date(rng, rng.random() < 0.5) if rng.random() < 0.9 else None,
+        'completion' : a_date(rng, rng.random() < 0.5) if rng.random() < 0.9 else None,
+        'first_posted' : a_date(rng),
+        'last_update' : a_date(rng),
+        'phase' : rng.choice(PHASES),
+        'allocation' : rng.choice(ALLOCATIONS),
+        'purpose' : rng.choice(PURPOSES),
+        'enrollment' : rng.randint(0, 2000),
+        'conditions' : ['Alzheimer Disease'] + ['Condition {}'.format(rng.randint(1, 50)) for _ in range(rng.randint(0, 3))],
+        'keywords' : [rng.choice(WORDS) for _ in range(rng.randint(0, 6))],
+        'arms' : arms,
+        'interventions' : [(rng.choice(INTERVENTIONS), 'Intervention {}'.format(rng.randint(1, 500)),
+                            paragraph(rng, 1) if rng.random() < 0.8 else None, rng.choice(arms)[0])
+                            for _ in range(rng.randint(1, 4))],
+        'primary' : [outcome() for _ in range(rng.randint(1, 3))],
+        'secondary' : [outcome() for _ in range(tail(rng, 1.2, 40) - 1)],
+        'other' : [outcome() for _ in range(rng.randint(0, 2) if rng.random() < 0.1 else 0)],
+        'criteria' : criteria(rng),
+        'gender' : rng.choice(GENDERS),
+        'min_age' : '{} Years'.format(rng.randint(18, 65)) if rng.random() < 0.9 else 'N/A',
+        'max_age' : '{} Years'.format(rng.randint(66, 90)) if rng.random() < 0.5 else 'N/A',
+        'locations' : [location() for _ in range(tail(rng, 1.1, 600))],
+        'condition_mesh' : ['Alzheimer Disease', 'Dementia'][:rng.randint(1, 2)],
+        'intervention_mesh' : [rng.choice(WORDS).capitalize() for _ in range(rng.randint(0, 3))],
+        'results' : results,
+    }
+
+
+def results_shape(rng: random.Random, huge: bool) -> dict:
+    """
+        Returns the number of groups, periods and measures of posted results
+    """
+    if huge:
+        return {'groups' : rng.randint(8, 20), 'periods' : rng.randint(2, 4), 'milestones' : rng.randint(3, 8),
+                'measures' : rng.randint(20, 60), 'categories' : rng.randint(2, 12), 'outcomes' : rng.randint(20, 80)}
+    return {'groups' : rng.randint(1, 3), 'periods' : 1, 'milestones' : rng.randint(2, 3),
+            'measures' : rng.randint(1, 4), 'categories' : rng.randint(1, 3), 'outcomes' : rng.randint(1, 3)}
+
+
+def to_xml(s: dict, rng: random.Random, target: int = 0) -> str:
+    """
+        Renders a study in the format of the XML downloads of
+        clinicaltrials.gov. Adverse events are added to the results
+        until the document reaches `target` bytes.
+    """
+    w = Writer()
+    w.open('clinical_study', rank='1')
+    w.open('required_header')
+    w.leaf('download_date', 'ClinicalTrials.gov processed this data on March 1, 2023')
+    w.leaf('link_text', 'Link to the current ClinicalTrials.gov record.')
+    w.leaf('url', 'https://clinicaltrials.gov/show/' + s['nct_id'])
+    w.close('required_header')
+    w.open('id_info')
+    w.leaf('org_study_id', s['org_id'])
+    w.leaf('nct_id', s['nct_id'])
+    w.close('id_info')
+    w.leaf('brief_title', s['brief_title'])
+    w.leaf('official_title', s['official_title'])
+    w.open('sponsors')
+    w.open('lead_sponsor')
+    w.leaf('agency', s['sponsor'][0])
+    w.leaf('agency_class', s['sponsor'][1][0])
+    w.close('lead_sponsor')
+    for c in s['collaborators']:
+        w.open('collaborator')
+        w.leaf('agency', c)
+        w.leaf('agency_class', 'Other')
+        w.close('collaborator')
+    w.close('sponsors')
+    w.leaf('source', s['sponsor'][0])
+    w.open('brief_summary')
+    w.leaf('textblock', s['brief_summary'])
+    w.close('brief_summary')
+    if s['description']:
+        w.open('detailed_description')
+        w.leaf('textblock', s['description'])
+        w.close('detailed_description')
+    w.leaf('overall_status', s['status'])
+    w.leaf('start_date', s['start'], type='Actual')
+    w.leaf('completion_date', s['completion'], type='Anticipated')
+    w.leaf('primary_completion_date', s['primary_completion'], type='Actual')
+    w.leaf('phase', '/'.join(s['phase']))
+    w.leaf('study_type', 'Interventional')
+    w.leaf('has_expanded_access', 'No')
+    w.open('study_design_info')
+    w.leaf('allocation', s['allocation'])
+    w.leaf('intervention_model', 'Parallel Assignment')
+    w.leaf('primary_purpose', s['purpose'])
+    w.leaf('masking', 'Double')
+    w.close('study_design_info')
+    for tag, kind in (('primary_outcome', 'primary'), ('secondary_outcome', 'secondary'), ('other_outcome', 'other')):
+        for measure, time_frame, description in s[kind]:
+            w.open(tag)
+            w.leaf('measure', measure)
+            w.leaf('time_frame', time_frame)
+            w.leaf('description', description)
+            w.close(tag)
+    w.leaf('number_of_arms', len(s['arms']))
+    w.leaf('enrollment', s['enrollment'], type='Actual')
+    for c in s['conditions']:
+        w.leaf('condition', c)
+    for label, arm_type in s['arms']:
+        w.open('arm_group')
+        w.leaf('arm_group_label', label)
+        w.leaf('arm_group_type', arm_type)
+        w.close('arm_group')
+    for kind, name, description, arm in s['interventions']:
+        w.open('intervention')
+        w.leaf('intervention_type', kind)
+        w.leaf('intervention_name', name)
+        w.leaf('description', description)
+        w.leaf('arm_group_label', arm)
+        w.close('intervention')
+    w.open('eligibility')
+    w.open('criteria')
+    w.leaf('textblock', s['criteria'])
+    w.close('criteria')
+    w.leaf('gender', s['gender'])
+    w.leaf('minimum_age', s['min_age'])
+    w.leaf('maximum_age', s['max_age'])
+    w.leaf('healthy_volunteers', 'No')
+    w.close('eligibility')
+    for name, city, state, country, zip_code in s['locations']:
+        w.open('location')
+        w.open('facility')
+        w.leaf('name', name)
+        w.open('address')
+        w.leaf('city', city)
+        w.leaf('state', state)
+        w.leaf('zip', zip_code)
+        w.leaf('country', country)
+        w.close('address')
+        w.close('facility')
+        w.leaf('status', 'Recruiting')
+        w.close('location')
+    w.open('location_countries')
+    for country in dict.fromkeys(l[3] for l in s['locations']):
+        w.leaf('country', country)
+    w.close('location_countries')
+    w.leaf('verification_date', s['last_update'])
+    w.leaf('study_first_submitted', s['first_posted'])
+    w.leaf('study_first_posted', s['first_posted'], type='Actual')
+    w.leaf('last_update_submitted', s['last_update'])
+    w.leaf('last_update_posted', s['last_update'], type='Actual')
+    for k in s['keywords']:
+        w.leaf('keyword', k)
+    for tag, key in (('condition_browse', 'condition_mesh'), ('intervention_browse', 'intervention_mesh')):
+        if s[key]:
+            w.open(tag)
+            for m in s[key]:
+                w.leaf('mesh_term', m)
+            w.close(tag)
+    if s['results']:
+        xml_results(w, rng, results_shape(rng, s['results'] == 'huge'), target)
+    w.close('clinical_study')
+    return w.text()
+
+
+def xml_results(w: Writer, rng: random.Random, shape: dict, target: int):
+    groups = ['{}'.format(i + 1) for i in range(shape['groups'])]
+    count = lambda: rng.randint(0, 500)
+
+    w.open('clinical_results')
+    w.open('participant_flow')
+    w.open('group_list')
+    for g in groups:
+        w.open('group', group_id='P' + g)
+        w.leaf('title', 'Group ' + g)
+        w.leaf('description', paragraph(rng, 1))
+        w.close('group')
+    w.close('group_list')
+    w.open('period_list')
+    for p in range(shape['periods']):
+        w.open('period')
+        w.leaf('title', 'Period {}'.format(p + 1))
+        w.open('milestone_list')
+        for m in ['STARTED', 'COMPLETED', 'NOT COMPLETED'] + ['Milestone {}'.format(i) for i in range(shape['milestones'] - 3)]:
+            w.open('milestone')
+            w.leaf('title', m)
+            w.open('participants_list')
+            for g in groups:
+                w.empty('participants', group_id='P' + g, count=count())
+            w.close('participants_list')
+            w.close('milestone')
+        w.close('milestone_list')
+        w.close('period')
+    w.close('period_list')
+    w.close('participant_flow')
+
+    w.open('baseline')
+    w.open('group_list')
+    for g in groups:
+        w.open('group', group_id='B' + g)
+        w.leaf('title', 'Group ' + g)
+        w.leaf('description', paragraph(rng, 1))
+        w.close('group')
+    w.close('group_list')
+    w.open('analyzed_list')
+    w.open('analyzed')
+    w.leaf('units', 'Participants')
+    w.leaf('scope', 'Overall')
+    w.open('count_list')
+    for g in groups:
+        w.empty('count', group_id='B' + g, value=count())
+    w.close('count_list')
+    w.close('analyzed')
+    w.close('analyzed_list')
+    w.open('measure_list')
+    for m in range(shape['measures']):
+        w.open('measure')
+        w.leaf('title', 'Measure {}'.format(m))
+        w.leaf('units', rng.choice(['years', 'Participants', 'units on a scale']))
+        w.leaf('param', rng.choice(['Mean', 'Count of Participants', 'Median']))
+        w.leaf('dispersion', 'Standard Deviation' if rng.random() < 0.5 else None)
+        w.open('class_list')
+        w.open('class')
+        w.open('category_list')
+        for c in range(rng.randint(1, shape['categories'])):
+            w.open('category')
+            w.leaf('title', 'Category {}'.format(c) if c else None)
+            w.open('measurement_list')
+            for g in groups:
+                w.empty('measurement', group_id='B' + g, value=count(), spread=rng.randint(1, 20))
+            w.close('measurement_list')
+            w.close('category')
+        w.close('category_list')
+        w.close('class')
+        w.close('class_list')
+        w.close('measure')
+    w.close('measure_list')
+    w.close('baseline')
+
+    w.open('outcome_list')
+    for o in range(shape['outcomes']):
+        w.open('outcome')
+        w.leaf('type', rng.choice(['Primary', 'Secondary']))
+        w.leaf('title', sentence(rng, rng.randint(3, 12)))
+        w.leaf('description', paragraph(rng, rng.randint(1, 3)))
+        w.leaf('time_frame', '{} weeks'.format(rng.randint(1, 104)))
+        w.open('measure')
+        w.leaf('units', 'units on a scale')
+        w.leaf('param', 'Mean')
+        w.open('class_list')
+        w.open('class')
+        w.open('category_list')
+        w.open('category')
+        w.open('measurement_list')
+        for g in groups:
+            w.empty('measurement', group_id='O' + g, value=count(), spread=rng.randint(1, 20))
+        w.close('measurement_list')
+        w.close('category')
+        w.close('category_list')
+        w.close('class')
+        w.close('class_list')
+        w.close('measure')
+        w.close('outcome')
+    w.close('outcome_list')
+
+    w.open('reported_events')
+    w.open('serious_events')
+    w.open('category_list')
+    e = 0
+    while e < 5 or w.size() < target:
+        w.open('category')
+        w.leaf('title', 'Organ system {}'.format(e))
+        w.open('event_list')
+        for _ in range(10):
+            w.open('event')
+            w.leaf('sub_title', sentence(rng, rng.randint(1, 4)), vocab='MedDRA 23.0')
+            for g in groups:
+                w.empty('counts', group_id='E' + g, subjects_affected=count(), subjects_at_risk=count())
+            w.close('event')
+        w.close('event_list')
+        w.close('category')
+        e += 1
+    w.close('category_list')
+    w.close('serious_events')
+    w.close('reported_events')
+    w.close('clinical_results')
+
+
+def to_full(s: dict, rng: random.Random, target: int = 0) -> str:
+    """
+        Renders a study as a response of the FullStudy API
+    """
+    w = FullWriter()
+    w.open('FullStudiesResponse')
+    w.leaf('NStudiesFound', 1)
+    w.open('FullStudyList')
+    w.open('FullStudy', Rank='1')
+    w.struct('Study')
+    w.struct('ProtocolSection')
+
+    w.struct('IdentificationModule')
+    w.field('NCTId', s['nct_id'])
+    w.struct('OrgStudyIdInfo')
+    w.field('OrgStudyId', s['org_id'])
+    w.end()
+    w.field('BriefTitle', s['brief_title'])
+    w.field('OfficialTitle', s['official_title'])
+    w.end()
+
+    w.struct('StatusModule')
+    w.field('OverallStatus', s['status'])
+    for name, key in (('StartDate', 'start'), ('PrimaryCompletionDate', 'primary_completion'),
+                        ('CompletionDate', 'completion'), ('StudyFirstPostDate', 'first_posted'),
+                        ('LastUpdatePostDate', 'last_update')):
+        if s[key]:
+            w.struct(name + 'Struct')
+            w.field(name, s[key])
+            w.end()
+    w.end()
+
+    w.struct('SponsorCollaboratorsModule')
+    w.struct('LeadSponsor')
+    w.field('LeadSponsorName', s['sponsor'][0])
+    w.field('LeadSponsorClass', s['sponsor'][1][1])
+    w.end()
+    if s['collaborators']:
+        w.list('CollaboratorList')
+        for c in s['collaborators']:
+            w.struct('Collaborator')
+            w.field('CollaboratorName', c)
+            w.field('CollaboratorClass', 'OTHER')
+            w.end()
+        w.end('List')
+    w.end()
+
+    w.struct('DescriptionModule')
+    w.field('BriefSummary', s['brief_summary'])
+    w.field('DetailedDescription', s['description'])
+    w.end()
+
+    w.struct('ConditionsModule')
+    w.list('ConditionList')
+    for c in s['conditions']:
+        w.field('Condition', c)
+    w.end('List')
+    if s['keywords']:
+        w.list('KeywordList')
+        for k in s['keywords']:
+            w.field('Keyword', k)
+        w.end('List')
+    w.end()
+
+    w.struct('DesignModule')
+    w.field('StudyType', 'Interventional')
+    w.list('PhaseList')
+    for p in s['phase']:
+        w.field('Phase', p)
+    w.end('List')
+    w.struct('DesignInfo')
+    w.field('DesignAllocation', s['allocation'])
+    w.field('DesignPrimaryPurpose', s['purpose'])
+    w.end()
+    w.struct('EnrollmentInfo')
+    w.field('EnrollmentCount', s['enrollment'])
+    w.end()
+    w.end()
+
+    w.struct('ArmsInterventionsModule')
+    w.list('ArmGroupList')
+    for label, arm_type in s['arms']:
+        w.struct('ArmGroup')
+        w.field('ArmGroupLabel', label)
+        w.field('ArmGroupType', arm_type)
+        w.end()
+    w.end('List')
+    w.list('InterventionList')
+    for kind, name, description, arm in s['interventions']:
+        w.struct('Intervention')
+        w.field('InterventionType', kind)
+        w.field('InterventionName', name)
+        w.field('InterventionDescription', description)
+        w.list('InterventionArmGroupLabelList')
+        w.field('InterventionArmGroupLabel', arm)
+        w.end('List')
+        w.end()
+    w.end('List')
+    w.end()
+
+    w.struct('OutcomesModule')
+    for name, kind in (('PrimaryOutcome', 'primary'), ('SecondaryOutcome', 'secondary'), ('OtherOutcome', 'other')):
+        if s[kind]:
+            w.list(name + 'List')
+            for measure, time_frame, description in s[kind]:
+                w.struct(name)
+                w.field(name + 'Measure', measure)
+                w.field(name + 'Description', description)
+                w.field(name + 'TimeFrame', time_frame)
+                w.end()
+            w.end('List')
+    w.end()
+
+    w.struct('EligibilityModule')
+    w.field('EligibilityCriteria', s['criteria'])
+    w.field('HealthyVolunteers', 'No')
+    w.field('Gender', s['gender'])
+    w.field('MinimumAge', s['min_age'])
+    w.field('MaximumAge', s['max_age'])
+    w.end()
+
+    w.struct('ContactsLocationsModule')
+    w.list('LocationList')
+    for name, city, state, country, zip_code in s['locations']:
+        w.struct('Location')
+        w.field('LocationFacility', name)
+        w.field('LocationStatus', 'Recruiting')
+        w.field('LocationCity', city)
+        w.field('LocationState', state)
+        w.field('LocationZip', zip_code)
+        w.field('LocationCountry', country)
+        w.end()
+    w.end('List')
+    w.end()
+    w.end()                 # ProtocolSection
+
+    if s['results']:
+        full_results(w, rng, results_shape(rng, s['results'] == 'huge'), target)
+
+    w.struct('DerivedSection')
+    for name, key in (('ConditionBrowseModule', 'condition_mesh'), ('InterventionBrowseModule', 'intervention_mesh')):
+        w.struct(name)
+        w.list('MeshList')
+        for m in s[key]:
+            w.struct('Mesh')
+            w.field('MeshTerm', m)
+            w.end()
+        w.end('List')
+        w.end()
+    w.end()
+
+    w.end()                 # Study
+    w.close('FullStudy')
+    w.close('FullStudyList')
+    w.close('FullStudiesResponse')
+    return w.text()
+
+
+def full_results(w: FullWriter, rng: random.Random, shape: dict, target: int):
+    groups = ['%03d' % i for i in range(shape['groups'])]
+    count = lambda: rng.randint(0, 500)
+
+    w.struct('ResultsSection')
+    w.struct('ParticipantFlowModule')
+    w.list('FlowGroupList')
+    for g in groups:
+        w.struct('FlowGroup')
+        w.field('FlowGroupId', 'FG' + g)
+        w.field('FlowGroupTitle', 'Group ' + g)
+        w.field('FlowGroupDescription', paragraph(rng, 1))
+        w.end()
+    w.end('List')
+    w.list('FlowPeriodList')
+    for p in range(shape['periods']):
+        w.struct('FlowPeriod')
+        w.field('FlowPeriodTitle', 'Period {}'.format(p + 1))
+        w.list('FlowMilestoneList')
+        for m in range(shape['milestones']):
+            w.struct('FlowMilestone')
+            w.field('FlowMilestoneType', 'Milestone {}'.format(m))
+            w.list('FlowAchievementList')
+            for g in groups:
+                w.struct('FlowAchievement')
+                w.field('FlowAchievementGroupId', 'FG' + g)
+                w.field('FlowAchievementNumSubjects', count())
+                w.end()
+            w.end('List')
+            w.end()
+        w.end('List')
+        w.end()
+    w.end('List')
+    w.end()
+
+    w.struct('BaselineCharacteristicsModule')
+    w.list('BaselineMeasureList')
+    for m in range(shape['measures']):
+        w.struct('BaselineMeasure')
+        w.field('BaselineMeasureTitle', 'Measure {}'.format(m))
+        w.field('BaselineMeasureParamType', 'Mean')
+        w.list('BaselineClassList')
+        w.struct('BaselineClass')
+        w.list('BaselineCategoryList')
+        for c in range(rng.randint(1, shape['categories'])):
+            w.struct('BaselineCategory')
+            w.list('BaselineMeasurementList')
+            for g in groups:
+                w.struct('BaselineMeasurement')
+                w.field('BaselineMeasurementGroupId', 'BG' + g)
+                w.field('BaselineMeasurementValue', count())
+                w.end()
+            w.end('List')
+            w.end()
+        w.end('List')
+        w.end()
+        w.end('List')
+        w.end()
+    w.end('List')
+    w.end()
+
+    w.struct('AdverseEventsModule')
+    w.list('SeriousEventList')
+    e = 0
+    while e < 5 or w.size() < target:
+        w.struct('SeriousEvent')
+        w.field('SeriousEventTerm', sentence(rng, rng.randint(1, 4)))
+        w.field('SeriousEventOrganSystem', 'Organ system {}'.format(e))
+        w.list('SeriousEventStatsList')
+        for g in groups:
+            w.struct('SeriousEventStats')
+            w.field('SeriousEventStatsGroupId', 'EG' + g)
+            w.field('SeriousEventStatsNumAffected', count())
+            w.field('SeriousEventStatsNumAtRisk', count())
+            w.end()
+        w.end('List')
+        w.end()
+        e += 1
+    w.end('List')
+    w.end()
+    w.end()
+
+
+def sample(source: str, count: int, seed: int, directory: str) -> list:
+    """
+        Copies a deterministic sample of real studies out of an
+        AllPublicXML.zip archive or a directory of extracted files
+
+        - Return
+        ============================
+        + list : Paths of the sampled studies
+    """
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        names = sorted(n for n in archive.namelist() if n.endswith('.xml'))
+        read = archive.read
+    else:
+        names = sorted(os.path.relpath(os.path.join(root, f), source)
+                        for root, _, files in os.walk(source) for f in files if f.endswith('.xml'))
+        read = lambda name: open(os.path.join(source, name), 'rb').read()
+
+    paths = []
+    for name in sorted(random.Random(seed).sample(names, min(count, len(names)))):
+        path = os.path.join(directory, os.path.basename(name))
+        with open(path, 'wb') as f:
+            f.write(read(name))
+        paths.append(path)
+    return paths
+
+
+def build(directory: str, studies: int = 500, huge: int = 4, huge_mb: float = 4, results: float = 0.25,
+          seed: int = 0, source: str = None, sample_size: int = 1000) -> dict:
+    """
+        Builds the corpus in a directory, with a subdirectory per set
+
+        - Parameters
+        ============================
+        + directory:    Directory of the corpus
+        + studies:      Number of synthetic studies
+        + huge:         Number of huge studies with posted results
+        + huge_mb:      Size of the huge XML downloads in MB
+        + results:      Share of synthetic studies with (small) posted results
+        + seed:         Seed of the generator and the sample
+        + source:       AllPublicXML.zip or directory to sample real studies from
+        + sample_size:  Number of sampled real studies
+
+        - Return
+        ============================
+        + dict : Name of the set mapped to the paths of its files
+    """
+    for name in SETS:
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    rng = random.Random(seed)
+    files = {name : [] for name in SETS}
+
+    def write(name: str, nct_id: str, text: str):
+        path = os.path.join(directory, name, nct_id + '.xml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        files[name].append(path)
+
+    for n in range(studies):
+        s = study(rng, n + 1, 'small' if rng.random() < results else None)
+        # both renderings draw the same results from their own generators
+        write('xml', s['nct_id'], to_xml(s, random.Random(rng.random())))
+        write('full', s['nct_id'], to_full(s, random.Random(rng.random())))
+
+    for n in range(huge):
+        s = study(rng, 90000001 + n, 'huge')
+        write('huge', s['nct_id'], to_xml(s, random.Random(rng.random()), int(huge_mb * 2 ** 20)))
+        write('huge-full', s['nct_id'], to_full(s, random.Random(rng.random()), int(huge_mb * 2 ** 20)))
+
+    if source:
+        files['sample'] = sample(source, sample_size, seed, os.path.join(directory, 'sample'))
+
+    return files
+
+
+def digest(files: dict) -> str:
+    """
+        Returns a hash of the content of a corpus
+    """
+    h = hashlib.sha1()
+    for name in sorted(files):
+        for path in files[name]:
+            h.update(os.path.basename(path).encode())
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds a reproducible corpus of studies for the parser benchmark.')
+    parser.add_argument('directory', help='Directory to write the corpus into.')
+    parser.add_argument('--studies', '-n', type=int, default=500, help='Number of synthetic studies.')
+    parser.add_argument('--huge', type=int, default=4, help='Number of huge studies with posted results.')
+    parser.add_argument('--huge-mb', type=float, default=4, help='Size of the huge studies in MB.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generator and the sample.')
+    parser.add_argument('--source', help='AllPublicXML.zip or directory of real studies to sample.')
+    parser.add_argument('--sample', type=int, default=1000, help='Number of sampled real studies.')
+    args = parser.parse_args()
+
+    files = build(args.directory, args.studies, args.huge, args.huge_mb, seed=args.seed,
+                  source=args.source, sample_size=args.sample)
+    for name in SETS:
+        print('{:<10} {:>6} files {:>10.1f} MB'.format(name, len(files[name]),
+                sum(os.path.getsize(p) for p in files[name]) / 2 ** 20))
+    print('digest', digest(files))
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+    Benchmarks the study parsers (XMLFastParser and FullStudyParser) on
+    a reproducible local corpus (benchmarks/corpus.py) and checks that
+    they parse the same trials into the same fields.
+
+    Every parser runs on every set of the corpus in a separate process,
+    so peak RSS is measured per parser. The report has the throughput
+    (files/sec, MB/sec), peak RSS and its growth over the documents loaded
+    in memory, the time spent on each field of each parser and the fields
+    that differ from XMLFastParser. The exit status is 1 if a field
+    differs, so it can be used to catch regressions. It runs offline.
+
+    Usage:
+        python benchmarks/parsers.py --studies 500 --huge 4
+        python benchmarks/parsers.py --source AllPublicXML.zip --sample 2000
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+parser = argparse.ArgumentParser(description='Times the study parsers and checks their outputs are equivalent.')
+parser.add_argument('--corpus', help='Directory to build the corpus in (a temporary directory by default).')
+parser.add_argument('--studies', '-n', type=int, default=500, help='Number of synthetic studies.')
+parser.add_argument('--huge', type=int, default=4, help='Number of huge studies with posted results.')
+parser.add_argument('--huge-mb', type=float, default=4, help='Size of the huge studies in MB.')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus.')
+parser.add_argument('--source', help='AllPublicXML.zip or directory of real studies to sample.')
+parser.add_argument('--sample', type=int, default=1000, help='Number of sampled real studies.')
+parser.add_argument('--repeat', '-r', type=int, default=3, help='Number of runs over each set (the best is kept).')
+parser.add_argument('--run', nargs=2, metavar=('PARSER', 'SET'), help='Times a single parser on a set (used internally).')
+args = parser.parse_args()
+
+import corpus
+from panels.utils.parser import XMLFastParser, FullStudyParser
+
+
+# parser : sets of the corpus in its format
+PARSERS = {
+    'XMLFastParser' : ('xml', 'huge', 'sample'),
+    'FullStudyParser' : ('full', 'huge-full'),
+}
+
+# set : the set of the same studies in the format of XMLFastParser, the
+# reference parser the outputs are checked against
+REFERENCE = {
+    'xml' : 'xml',
+    'huge' : 'huge',
+    'sample' : 'sample',
+    'full' : 'xml',
+    'huge-full' : 'huge',
+}
+
+# lead sponsor classes of the FullStudy API in the terms of the XML downloads
+SPONSOR_CLASSES = {api : xml for xml, api in corpus.SPONSOR_CLASSES}
+
+# fields compared between parsers
+FIELDS = ('nct_id', 'title', 'status', 'phase', 'allocation', 'primary_purpose', 'protocol',
+            'first_posted', 'start_date', 'primary_completion', 'completion_date', 'last_update',
+            'brief_summary', 'description', 'criteria', 'enrollment', 'gender', 'min_age', 'max_age',
+            'lead_sponsor', 'lead_sponsor_type', 'arms_number', 'conditions', 'agents', 'outcomes',
+            'countries', 'locations')
+
+
+def timed(timings: dict, name: str, func):
+    """
+        Wraps a function to add the time spent in it to `timings[name]`
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[name] += time.perf_counter() - start
+    return wrapper
+
+
+def profiled(name: str, timings: dict):
+    """
+        Returns a subclass of a parser that adds the time spent on each
+        field to `timings`. XMLFastParser is timed by its tag handlers
+        and FullStudyParser by the fields it looks up in its index. The
+        rest of the parsing is timed as a whole.
+    """
+    if name == 'XMLFastParser':
+        handlers = {tag : timed(timings, tag, f) for tag, f in XMLFastParser.HANDLERS.items()}
+        return type('Profiled', (XMLFastParser,), {
+            'HANDLERS' : handlers,
+            '_parse' : timed(timings, '_parse', XMLFastParser._parse),
+        })
+    else:
+        text = FullStudyParser._text
+        return type('Profiled', (FullStudyParser,), {
+            '_index' : staticmethod(timed(timings, 'index', FullStudyParser._index)),
+            '_text' : staticmethod(lambda fields, field: timed(timings, field, text)(fields, field)),
+            '_parse' : timed(timings, '_parse', FullStudyParser._parse),
+        })
+
+
+def run(name: str, files: list) -> dict:
+    """
+        Times a parser on the files of a set, in the current process
+    """
+    cls = globals()[name]
+    documents = [open(f, 'rb').read() for f in files]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    best = float('inf')
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for d in documents:
+            cls(d)
+        best = min(best, time.perf_counter() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings = Counter()
+    Profiled = profiled(name, timings)
+    start = time.perf_counter()
+    for d in documents:
+        p = Profiled(d)
+        if name == 'XMLFastParser':
+            timed(timings, 'results (on demand)', lambda: p.results)()
+    total = time.perf_counter() - start
+
+    # time of the parser's own code outside of the timed fields
+    fields = {k : v for k, v in timings.items() if k != '_parse'}
+    fields['other fields'] = timings['_parse'] - sum(v for k, v in fields.items() if k != 'results (on demand)')
+    fields['document tree'] = total - timings['_parse'] - timings['results (on demand)']
+
+    return {
+        'files' : len(documents),
+        'bytes' : sum(len(d) for d in documents),
+        'seconds' : best,
+        'baseline' : baseline,
+        'peak' : peak,
+        'fields' : {k : v / len(documents) for k, v in fields.items()},
+    }
+
+
+def phase(value: str) -> str:
+    # normalized as in processor.build_columns
+    return re.sub(r'\s|\||Phase|/', '', value.replace('N/A', 'N')) if value else value
+
+
+def strip(value):
+    return value.strip() if isinstance(value, str) else value
+
+
+def view(p) -> dict:
+    """
+        Returns the compared fields of a parsed study
+    """
+    r = p.record
+    v = {f : getattr(r, f, None) for f in FIELDS}
+    v['agents'] = [tuple(a) for a in r.agents]
+    v['outcomes'] = [tuple(o) for o in r.outcomes]
+    v['locations'] = [tuple(l) for l in r.locations]
+
+    v['phase'] = phase(v['phase'])
+    v['countries'] = sorted(v['countries'] or [])
+    v['lead_sponsor_type'] = SPONSOR_CLASSES.get(v['lead_sponsor_type'], v['lead_sponsor_type'])
+    v['agents'] = [tuple(map(strip, a)) for a in v['agents']]
+    v['outcomes'] = [tuple(map(strip, o)) for o in v['outcomes']]
+    return {k : strip(x) for k, x in v.items()}
+
+
+def compare(files: dict) -> dict:
+    """
+        Parses every study with each parser and compares its fields with
+        the output of XMLFastParser on the same study
+
+        - Return
+        ============================
+        + dict : (parser, set) mapped to a Counter of the differing fields
+                    and an example of a difference per field
+    """
+    reference = {}
+    for name in set(REFERENCE.values()):
+        for f in files[name]:
+            reference[(name, os.path.basename(f))] = view(XMLFastParser(open(f, 'rb').read()))
+
+    differences = {}
+    for name, sets in PARSERS.items():
+        if name == 'XMLFastParser':
+            continue
+        cls = globals()[name]
+        for s in sets:
+            counts, examples = Counter(), {}
+            for f in files[s]:
+                ref = reference[(REFERENCE[s], os.path.basename(f))]
+                out = view(cls(open(f, 'rb').read()))
+                for field, value in out.items():
+                    if value != ref[field]:
+                        counts[field] += 1
+                        examples.setdefault(field, (os.path.basename(f), ref[field], value))
+            differences[(name, s)] = (counts, examples)
+    return differences
+
+
+def report(results: dict, differences: dict) -> bool:
+    print('{:<16} {:<10} {:>6} {:>9} {:>10} {:>9} {:>10} {:>10}'.format(
+            'parser', 'set', 'files', 'MB', 'files/sec', 'MB/sec', 'peak RSS', 'growth'))
+    for (name, s), r in results.items():
+        mb = r['bytes'] / 2 ** 20
+        print('{:<16} {:<10} {:>6} {:>9.1f} {:>10.1f} {:>9.2f} {:>8.0f}MB {:>8.0f}MB'.format(
+                name, s, r['files'], mb, r['files'] / r['seconds'], mb / r['seconds'],
+                r['peak'] / 1024, (r['peak'] - r['baseline']) / 1024))
+
+    print('\ntime per document on each field (us), slowest first')
+    for (name, s), r in results.items():
+        fields = sorted(r['fields'].items(), key=lambda x: -x[1])
+        total = sum(v for k, v in fields if k != 'results (on demand)')
+        print('\n{} on {} ({:.0f}us per document)'.format(name, s, total * 1e6))
+        for field, seconds in fields:
+            print('    {:<32} {:>10.1f} {:>6.1f}%'.format(field, seconds * 1e6, 100 * seconds / total if total else 0))
+
+    print('\nfields differing from XMLFastParser')
+    equivalent = True
+    for (name, s), (counts, examples) in differences.items():
+        if not counts:
+            print('{:<16} {:<10} none'.format(name, s))
+            continue
+        equivalent = False
+        for field, n in counts.most_common():
+            study, expected, found = examples[field]
+            print('{:<16} {:<10} {:<20} {:>5} studies, e.g. {}: {!r:.60} != {!r:.60}'.format(
+                    name, s, field, n, study, found, expected))
+    return equivalent
+
+
+if __name__ == '__main__':
+    if args.run:
+        name, s = args.run
+        print(json.dumps(run(name, json.loads(sys.stdin.read()))))
+        sys.exit()
+
+    directory = args.corpus or tempfile.mkdtemp()
+    files = corpus.build(directory, args.studies, args.huge, args.huge_mb, seed=args.seed,
+                         source=args.source, sample_size=args.sample)
+    print('corpus {} digest {}\n'.format(directory, corpus.digest(files)))
+
+    results = {}
+    for name, sets in PARSERS.items():
+        for s in sets:
+            if not files[s]:
+                continue
+            out = subprocess.run([sys.executable, __file__, '--run', name, s, '--repeat', str(args.repeat)],
+                                 input=json.dumps(files[s]), capture_output=True, text=True, check=True)
+            results[(name, s)] = json.loads(out.stdout)
+
+    equivalent = report(results, compare(files))
+    if not args.corpus:
+        shutil.rmtree(directory)
+    sys.exit(0 if equivalent else 1)
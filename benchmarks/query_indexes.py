@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+    Times the queries of the dashboard, filters and update pipeline on a
+    synthetic database, before and after the migration adding the indexes
+    of the trial table.
+
+    Usage:
+        python benchmarks/query_indexes.py --rows 450000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "visual.settings")
+
+parser = argparse.ArgumentParser(description='Times trial queries before and after adding the indexes.')
+parser.add_argument('--rows', '-n', type=int, default=450000, help='Number of synthetic trials.')
+parser.add_argument('--repeat', '-r', type=int, default=5, help='Number of runs of each query.')
+parser.add_argument('--db', help='SQLite file to build the database in (a temporary file by default).')
+args = parser.parse_args()
+
+from visual import settings
+settings.DATABASES['default']['NAME'] = args.db or os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db.models import Count, Max
+from panels.models import Trial
+
+
+BEFORE = '0003_change_journal'
+AFTER = '0004_sync_state_and_indexes'
+
+QUERIES = {
+    'watermark (latest last_update)' : lambda: Trial.objects.aggregate(Max('last_update')),
+    'recent updates (last 30 days)' : lambda: list(Trial.objects.filter(last_update__gt=date(2022, 1, 1)).values('last_update')),
+    'first posted in a year' : lambda: Trial.objects.filter(first_posted__range=(date(2015, 1, 1), date(2015, 12, 31))).count(),
+    'trials by status' : lambda: Trial.objects.filter(status='R').count(),
+    'trials by phase' : lambda: Trial.objects.filter(phase='3').count(),
+    'phase chart (group by phase)' : lambda: list(Trial.objects.values('phase').annotate(n=Count('pk'))),
+    'changelist page (order by last_update)' : lambda: list(Trial.objects.order_by('-last_update')[:25]),
+}
+
+
+def populate(rows: int, batch_size=10000):
+    statuses = [c for c, _ in Trial.STATUS_CHOICES]
+    phases = [c for c, _ in Trial.PHASE_CHOICES]
+    start = date(2000, 1, 1)
+    for i in range(0, rows, batch_size):
+        Trial.objects.bulk_create([Trial(nct_id='NCT%08d' % n,
+                                            status=random.choice(statuses),
+                                            phase=random.choice(phases),
+                                            first_posted=start + timedelta(days=random.randrange(8000)),
+                                            last_update=start + timedelta(days=random.randrange(8100)))
+                                    for n in range(i, min(rows, i + batch_size))])
+
+
+def measure() -> dict:
+    timings = {}
+    for name, query in QUERIES.items():
+        runs = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            query()
+            runs.append(time.perf_counter() - start)
+        timings[name] = statistics.median(runs)
+    return timings
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    call_command('migrate', 'panels', BEFORE, verbosity=0)
+    print('Populating {:,} trials into {}'.format(args.rows, settings.DATABASES['default']['NAME']))
+    populate(args.rows)
+
+    before = measure()
+    call_command('migrate', 'panels', AFTER, verbosity=0)
+    after = measure()
+
+    print('{:<40} {:>12} {:>12} {:>9}'.format('query', 'before (ms)', 'after (ms)', 'speedup'))
+    for name in QUERIES:
+        print('{:<40} {:>12.2f} {:>12.2f} {:>8.1f}x'.format(name, before[name] * 1000, after[name] * 1000,
+                                                            before[name] / after[name]))
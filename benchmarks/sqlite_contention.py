@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+    Measures the latency of dashboard reads on SQLite while the data
+    manager is writing, with the default SQLite settings and per-row
+    autocommit writes, and with the tuned pragmas (panels/utils/sqlite.py)
+    and batched transactions.
+
+    Usage:
+        python benchmarks/sqlite_contention.py --rows 50000 --duration 10
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "visual.settings")
+
+parser = argparse.ArgumentParser(description='Times SQLite reads with and without a concurrent writer.')
+parser.add_argument('--rows', '-n', type=int, default=50000, help='Number of trials in the database.')
+parser.add_argument('--duration', '-d', type=float, default=10, help='Seconds of reading with the writer running.')
+parser.add_argument('--batch', '-b', type=int, default=1000, help='Trials written in each transaction when tuned.')
+parser.add_argument('--mode', choices=('default', 'tuned'), help='Runs a single mode (used internally).')
+args = parser.parse_args()
+
+
+# SQLite defaults of Django: rollback journal, full sync and 5s timeout
+DEFAULT = {
+    'journal_mode' : 'delete',
+    'synchronous' : 'full',
+    'mmap_size' : 0,
+    'cache_size' : -2000,
+    'busy_timeout' : 5000,
+    'temp_store' : 'default',
+}
+
+
+def new_trials(start: int, count: int) -> list:
+    from panels.models import Trial
+    statuses = [c for c, _ in Trial.STATUS_CHOICES]
+    day = date(2000, 1, 1)
+    return [Trial(nct_id='NCT%08d' % n, status=random.choice(statuses), phase='2',
+                    last_update=day + timedelta(days=random.randrange(8000)))
+            for n in range(start, start + count)]
+
+
+def writer(tuned: bool, start: int, stop, written):
+    """
+        Inserts trials until stopped, in batched transactions when tuned
+        or one autocommitted row at a time like the old update path
+    """
+    from django.db import transaction
+    from panels.models import Trial
+
+    n = start
+    while not stop.is_set():
+        if tuned:
+            with transaction.atomic():
+                Trial.objects.bulk_create(new_trials(n, args.batch))
+            n += args.batch
+        else:
+            new_trials(n, 1)[0].save()
+            n += 1
+        written.value = n - start
+
+
+def read() -> float:
+    from panels.models import Trial
+    start = time.perf_counter()
+    Trial.objects.filter(status='R').count()
+    list(Trial.objects.order_by('-last_update')[:25])
+    return time.perf_counter() - start
+
+
+def measure(duration: float) -> tuple:
+    from django.db import OperationalError
+    latencies, errors = [], 0
+    end = time.time() + duration
+    while time.time() < end:
+        try:
+            latencies.append(read())
+        except OperationalError:            # database is locked
+            errors += 1
+        time.sleep(0.01)
+    return latencies, errors
+
+
+def run(mode: str):
+    from visual import settings
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    settings.SQLITE = DEFAULT if mode == 'default' else {}
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connections, transaction
+    from panels.models import Trial
+
+    random.seed(0)
+    call_command('migrate', verbosity=0)
+    for i in range(0, args.rows, 10000):
+        with transaction.atomic():
+            Trial.objects.bulk_create(new_trials(i, min(10000, args.rows - i)))
+
+    idle, _ = measure(2)
+
+    connections.close_all()
+    ctx = multiprocessing.get_context('fork')
+    stop, written = ctx.Event(), ctx.Value('i', 0)
+    process = ctx.Process(target=writer, args=(mode == 'tuned', args.rows, stop, written))
+    process.start()
+    time.sleep(0.5)
+    busy, errors = measure(args.duration)
+    stop.set()
+    process.join()
+
+    q = lambda l, p: sorted(l)[int(p * (len(l) - 1))] * 1000 if l else float('nan')
+    print('{:<8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>8} {:>8} {:>10,}'.format(
+            mode, q(idle, 0.5), q(busy, 0.5), q(busy, 0.95), max(busy, default=0) * 1000,
+            len(busy), errors, written.value))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    if args.mode:
+        run(args.mode)
+    else:
+        print('{:<8} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8} {:>10}'.format(
+                'mode', 'idle p50', 'busy p50', 'busy p95', 'busy max', 'reads', 'locked', 'written'))
+        for mode in ('default', 'tuned'):
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--rows', str(args.rows),
+                            '--duration', str(args.duration), '--batch', str(args.batch)], check=True)
+        print('latencies in ms')
@@ -3,11 +3,11 @@ from itertools import count
 import os
 import re
 from sqlalchemy import column
-from tqdm import tqdm
 import django
 from django.forms.models import model_to_dict
-from django.db.models import Count
+from django.db.models import Count, Max
 import argparse
+from collections import Counter
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "visual.settings")
 django.setup()
@@ -15,11 +15,9 @@ django.setup()
 import pandas as pd
 import numpy as np
 from IPython import embed
-from visual import settings
 from datetime import datetime, date
 from panels.models import *
-from panels.utils.parser import XMLFastParser
-from panels.utils import downloader, processor, tools
+from panels.utils import downloader, processor, tools, importer, journal
 from panels.utils.pipeline import export_pipeline
 from panels.utils.notification.notification import notify_update
 
@@ -27,8 +25,12 @@ from panels.utils.notification.notification import notify_update
 parser = argparse.ArgumentParser(description='Process and manages data into the database for further use.')
 actions = ('import', 'update', 'manual', 'terminal', 'export', 'cleardata')
 parser.add_argument('action', help='Actions to perform on database.', choices=actions)
-parser.add_argument('--input', '-i', help='Input file or directory.')
+parser.add_argument('--input', '-i', help='Input file, zip archive or directory.')
 parser.add_argument('--output', '-o', help='The name of output file.')
+parser.add_argument('--batch-size', '-b', type=int, default=importer.BATCH_SIZE, help='Number of trials written in each transaction while importing, or processed at once while updating.')
+parser.add_argument('--workers', '-w', type=int, default=1, help='Number of processes parsing XML files while importing.')
+parser.add_argument('--resume', action='store_true', help='Resume an interrupted import from its last checkpoint.')
+parser.add_argument('--results', action='store_true', help='Store the participant flow and baseline of posted results while importing.')
     
 
 
@@ -44,86 +46,87 @@ def clear_data():
     UpdatesLog.objects.all().delete()
 
 
-def download_update(f_name='update'):
+def download_update(f_name='update') -> date:
     """
-        Downloads the latest updates from the last updated trial and now
+        Downloads the latest updates from the watermark of the last update
+        (or the last updated trial) and now
+
+        - Return
+        ============================
+        + date : The date updates have been downloaded up to
     """
-    today = datetime.today().strftime('%m/%d/%Y')
-    if Trial.objects.all().count() > 0:
-        last_update = Trial.objects.order_by('-last_update')[0].last_update
+    today = date.today()
+    last_update = SyncState.get().watermark or Trial.objects.aggregate(last=Max('last_update'))['last']
+    if last_update:
         last_update = last_update.strftime('%m/%d/%Y')
-    else:
-        last_update = None
 
     downloader.download_trials(start_date=last_update, 
-                                end_date=today, 
+                                end_date=today.strftime('%m/%d/%Y'), 
                                 f_name=f_name)        
+    return today
 
 
-def update_data(csv_name: str) -> list:
+def update_data(csv_name: str, chunk_size: int = processor.CHUNK_SIZE, watermark: date = None) -> list:
     """
-        Updates the databaset using given csv file
+        Updates the databaset using given csv file. The file is processed
+        in chunks of `chunk_size` trials under a new update run, that the
+        changes are recorded under when the journal is enabled. The sync
+        state moves to the run and watermark once the update is done. The
+        watermark does not pass the trials that failed to be downloaded,
+        so the next update downloads them again.
 
         - Parameters
         ============================
         + csv_name :    String of downloaded csv file name (including .csv) 
+        + chunk_size :  Number of trials processed at once
+        + watermark :   The date the csv file covers updates up to
 
         - Return
         ============================
         + list : A list of primary keys of updated or created trials in the database
     """
-    if len(open(settings.BASE_DIR+'/data/'+csv_name, 'r').readlines()) == 1:       # no update posted
-        return [], []
-
-    data = processor.generate_data(csv_name)
-    new_pk, updated_pk = processor.build_objects(data)
-    
-
-    counts = Trial.objects.filter(pk__in=new_pk+updated_pk).values('last_update')   \
-        .order_by('last_update')                                                     \
-        .annotate(num=Count('last_update'))
-    
-    for c in counts:
-        log = UpdatesLog(udpate_date=c['last_update'], update_counts=c['num'])
-        log.save()
+    new_pk, updated_pk = [], []
+    counts = Counter()
+    run = journal.start_run()
+    processor.stats.failed.clear()
+
+    for data in processor.generate_data(csv_name, chunk_size):
+        new, updated = importer.build_objects(data, chunk_size, run if journal.enabled() else None)
+        new_pk += new
+        updated_pk += updated
+
+        for c in Trial.objects.filter(pk__in=new+updated).values('last_update')    \
+                .order_by('last_update')                                             \
+                .annotate(num=Count('last_update')):
+            counts[c['last_update']] += c['num']
+
+    UpdatesLog.objects.bulk_create([UpdatesLog(udpate_date=update_date, update_counts=num) 
+                                        for update_date, num in counts.items()])
+
+    journal.finish_run(run, len(new_pk), len(updated_pk))
+    if processor.stats.failed:
+        watermark = processor.stats.watermark(watermark)
+        print('{:,} trials failed to be downloaded, the watermark is moved up to {}'.format(
+                len(processor.stats.failed), watermark or SyncState.get().watermark))
+    SyncState.bump(run, watermark, changed=bool(new_pk or updated_pk))
 
     return new_pk, updated_pk
 
 
 
-def _import(input_dir: str):
+def _import(input_path: str, batch_size: int = importer.BATCH_SIZE, workers: int = 1, resume: bool = False,
+            results: bool = False):
     """
         Import XML trials downloaded from ClinicalTrials.gov and builds a
-        list of structured data.
+        list of structured data. The input can be the AllPublicXML.zip
+        archive itself or a directory of extracted files. Trials are
+        written into the database in batches of `batch_size` studies,
+        while `workers` processes parse the XML files. An interrupted
+        import continues from its last checkpoint when `resume` is set, and
+        the posted results are stored in their own tables when `results` is.
     """
-    total = 0
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.split('.')[-1] == 'xml':
-                total += 1
-
-    existing = set(Trial.objects.values_list('nct_id', flat=True))
-    with tqdm(total=total) as pbar:
-        for root, dirs, files in os.walk(input_dir):
-            for file in files:
-                if file.split('.')[-1] == 'xml':
-                    if file.split('.')[0] in existing:
-                        continue
-                    with open(os.path.join(root, file)) as xml:
-                        xml_parser = XMLFastParser(xml.read())
-                        data = xml_parser.data
-
-                        # TODO: Make it more efficient by having all 
-                        # trials as a single dataframe and write all 
-                        # at the same time (bulk update)
-
-                        row = pd.DataFrame.from_dict([data])
-                        row = processor.build_columns(row)
-                        t = processor.data_mapper(row.to_dict(orient='index')[0])
-
-                    pbar.update(1)
-
-
+    importer.import_studies(input_path, batch_size=batch_size, workers=workers, resume=resume,
+                            with_results=results)
 
 
 
@@ -165,10 +168,12 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.action == 'import':
-        _import(args.input)
+        _import(args.input, args.batch_size, args.workers, args.resume, args.results)
     elif args.action == 'update':
-        download_update()
-        new_pk, updated_pk = update_data('update.csv')
+        watermark = download_update()
+        new_pk, updated_pk = update_data('update.csv', args.batch_size, watermark)
+        print(downloader.stats.report())
+        print(processor.stats.report())
         notify_update(new_pk, updated_pk, datetime.now())
     elif args.action == 'manual':
         manual(args.input)
@@ -7,6 +7,9 @@ from django.contrib import admin
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
 from django.template.response import HttpResponse
+from django.http import Http404
+from django.core.exceptions import PermissionDenied
+from django.contrib.admin.utils import unquote
 from django.utils.html import mark_safe
 from django.urls import path
 from django.core.paginator import Paginator
@@ -20,6 +23,7 @@ from panels.models import *
 from panels.forms import AdvancedSearchForm, TrialForm
 from panels.utils.pipeline import Pipeline
 from panels.utils.notification import notification
+from panels.utils import journal
 from django.contrib.admin import widgets
 from panels.widgets import DateRangePicker, AutocompleteSelectMultiple
 
@@ -426,6 +430,42 @@ class TrialAdmin(SimpleHistoryAdmin):
         return obj.get_phase_display()
 
 
+    def history_view(self, request, object_id, extra_context=None):
+        """
+            Shows the changes recorded in the journal when it is enabled,
+            with the trial rebuilt as of the `date` query parameter
+        """
+        if not journal.enabled():
+            return super(TrialAdmin, self).history_view(request, object_id, extra_context)
+
+        obj = self.get_object(request, unquote(object_id))
+        if obj is None:
+            raise Http404
+        if not self.has_view_or_change_permission(request, obj):
+            raise PermissionDenied
+
+        as_of = None
+        date = request.GET.get('date')
+        try:
+            if date:
+                as_of = journal.trial_as_of(obj, datetime.strptime(date, '%Y-%m-%d') + relativedelta(days=1))
+        except ValueError:
+            date = None
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': self.history_view_title(obj),
+            'object': obj,
+            'opts': self.model._meta,
+            'module_name': self.model._meta.verbose_name_plural,
+            'changes': journal.changes_of(obj),
+            'date': date,
+            'as_of': [(self.model._meta.get_field(f).verbose_name, v) for f, v in as_of.items()] if as_of else None,
+            **(extra_context or {}),
+        }
+        return render(request, 'admin/panels/trial/journal_history.html', context)
+
+
     @admin.display(description='Agents')
     def agents(self, obj):
         txt = []
@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PanelsConfig(AppConfig):
     name = 'panels'
+
+    def ready(self):
+        from panels.utils import sqlite
+        connection_created.connect(sqlite.configure)
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.18 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panels', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicaltrial',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='trial',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.18 on 2026-10-18 10:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panels', '0002_trial_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpdateRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('created_count', models.IntegerField(default=0)),
+                ('updated_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrialChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=100)),
+                ('old', models.TextField(blank=True, null=True)),
+                ('new', models.TextField(blank=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='panels.updaterun')),
+                ('trial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='panels.trial')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trialchange',
+            index=models.Index(fields=['trial', 'run'], name='panels_tria_trial_i_720dac_idx'),
+        ),
+    ]
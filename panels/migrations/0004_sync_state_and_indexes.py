@@ -0,0 +1,44 @@
+# Generated by Django 3.2.18 on 2026-10-18 10:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panels', '0003_change_journal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watermark', models.DateField(blank=True, null=True)),
+                ('data_version', models.IntegerField(default=0)),
+                ('changed', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trial',
+            index=models.Index(fields=['last_update'], name='trial_last_update_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trial',
+            index=models.Index(fields=['first_posted'], name='trial_first_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trial',
+            index=models.Index(fields=['status'], name='trial_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trial',
+            index=models.Index(fields=['phase'], name='trial_phase_idx'),
+        ),
+        migrations.AddField(
+            model_name='syncstate',
+            name='last_run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='panels.updaterun'),
+        ),
+    ]
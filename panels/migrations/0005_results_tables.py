@@ -0,0 +1,63 @@
+# Generated by Django 3.2.18 on 2026-10-18 11:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panels', '0004_sync_state_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(choices=[('F', 'Participant Flow'), ('B', 'Baseline')], max_length=1)),
+                ('group_id', models.CharField(max_length=10, null=True)),
+                ('title', models.TextField(blank=True, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('trial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='result_groups', to='panels.trial')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FlowMilestone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.TextField(null=True)),
+                ('milestone', models.TextField(null=True)),
+                ('group_id', models.CharField(max_length=10, null=True)),
+                ('count', models.CharField(max_length=20, null=True)),
+                ('trial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flow_milestones', to='panels.trial')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BaselineMeasurement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('measure', models.TextField(null=True)),
+                ('units', models.TextField(null=True)),
+                ('param', models.CharField(max_length=50, null=True)),
+                ('dispersion', models.CharField(max_length=50, null=True)),
+                ('category', models.TextField(blank=True, null=True)),
+                ('group_id', models.CharField(max_length=10, null=True)),
+                ('value', models.CharField(max_length=50, null=True)),
+                ('lower_limit', models.CharField(max_length=50, null=True)),
+                ('upper_limit', models.CharField(max_length=50, null=True)),
+                ('trial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='baseline_measurements', to='panels.trial')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BaselineAnalyzed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units', models.TextField(null=True)),
+                ('scope', models.CharField(max_length=50, null=True)),
+                ('group_id', models.CharField(max_length=10, null=True)),
+                ('count', models.CharField(max_length=20, null=True)),
+                ('trial', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='baseline_analyzed', to='panels.trial')),
+            ],
+        ),
+    ]
@@ -1,5 +1,6 @@
 from simple_history.models import HistoricalRecords
 from django.db import models
+from django.utils import timezone
 from django.core.validators import MaxValueValidator, MinValueValidator
 from panels.utils import downloader, customize
 from visual import settings
@@ -225,12 +226,22 @@ class Trial(models.Model):
     
     # system variables
     reviewed = models.BooleanField(default=False)
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
     history = HistoricalRecords()
 
     # adding user defined columns
     vars().update(customize.Database.columns)
 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_update'], name='trial_last_update_idx'),
+            models.Index(fields=['first_posted'], name='trial_first_posted_idx'),
+            models.Index(fields=['status'], name='trial_status_idx'),
+            models.Index(fields=['phase'], name='trial_phase_idx'),
+        ]
+
+
 
     def __str__(self):
         return self.nct_id
@@ -288,6 +299,27 @@ class Trial(models.Model):
             return Trial.US if us else ''
                     
 
+    @staticmethod
+    def location_of(countries : list) -> str:
+        """
+        Returns the location symbol of a trial given the list
+        of countries of its sites.
+
+        - Parameters
+        ============================
+        + countries:    List of country names
+
+        - Return
+        ============================
+        + str: Related character for US, NON-US or BOTH in database
+        """
+        if len(countries) == 1 and 'United States' in countries:
+            return Trial.US
+        elif len(countries) > 1 and 'United States' in countries:
+            return Trial.BOTH
+        return Trial.NONUS
+
+
     @staticmethod
     def get_display(choices : list, ch : str) -> str:
         """
@@ -340,3 +372,140 @@ class Newsletter(models.Model):
 class UpdatesLog(models.Model):
     update_counts = models.SmallIntegerField()
     udpate_date = models.DateField()
+
+
+
+class UpdateRun(models.Model):
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return 'Update run #{} ({})'.format(self.pk, self.started)
+
+
+
+class TrialChange(models.Model):
+    run = models.ForeignKey(UpdateRun, on_delete=models.CASCADE, related_name='changes')
+    trial = models.ForeignKey(Trial, on_delete=models.CASCADE, related_name='changes')
+    field = models.CharField(max_length=100)
+    old = models.TextField(null=True, blank=True)
+    new = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trial', 'run']),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.trial_id, self.field)
+
+
+
+class SyncState(models.Model):
+    """
+        State of the synchronization with clinicaltrials.gov, stored in a
+        single row. The watermark is the date updates have been downloaded
+        up to, and the data version is increased whenever trials change.
+    """
+    watermark = models.DateField(null=True, blank=True)
+    last_run = models.ForeignKey(UpdateRun, on_delete=models.SET_NULL, null=True, blank=True)
+    data_version = models.IntegerField(default=0)
+    changed = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Synchronized up to {} (version {})'.format(self.watermark, self.data_version)
+
+
+    @staticmethod
+    def get():
+        state, _ = SyncState.objects.get_or_create(pk=1)
+        return state
+
+
+    @staticmethod
+    def bump(run=None, watermark=None, changed=True):
+        """
+            Increases the data version if trials have changed and moves
+            the watermark forward
+        """
+        state = SyncState.get()
+        if changed:
+            state.data_version += 1
+            state.changed = timezone.now()
+        if run:
+            state.last_run = run
+        if watermark and (state.watermark is None or watermark > state.watermark):
+            state.watermark = watermark
+        state.save()
+        return state
+
+
+
+class ResultGroup(models.Model):
+    """
+        A group of participants of the posted results of a trial, in the
+        participant flow or in the baseline
+    """
+    FLOW = 'F'
+    BASELINE = 'B'
+    SECTION_CHOICES = (
+        (FLOW, 'Participant Flow'),
+        (BASELINE, 'Baseline'),
+    )
+
+    trial = models.ForeignKey(Trial, on_delete=models.CASCADE, related_name='result_groups')
+    section = models.CharField(max_length=1, choices=SECTION_CHOICES)
+    group_id = models.CharField(max_length=10, null=True)
+    title = models.TextField(null=True, blank=True)
+    description = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.group_id, self.title)
+
+
+
+class FlowMilestone(models.Model):
+    """
+        Number of participants of a group at a milestone of a period of
+        the participant flow
+    """
+    trial = models.ForeignKey(Trial, on_delete=models.CASCADE, related_name='flow_milestones')
+    period = models.TextField(null=True)
+    milestone = models.TextField(null=True)
+    group_id = models.CharField(max_length=10, null=True)
+    count = models.CharField(max_length=20, null=True)
+
+    def __str__(self):
+        return '{} {}: {}'.format(self.milestone, self.group_id, self.count)
+
+
+
+class BaselineAnalyzed(models.Model):
+    trial = models.ForeignKey(Trial, on_delete=models.CASCADE, related_name='baseline_analyzed')
+    units = models.TextField(null=True)
+    scope = models.CharField(max_length=50, null=True)
+    group_id = models.CharField(max_length=10, null=True)
+    count = models.CharField(max_length=20, null=True)
+
+
+
+class BaselineMeasurement(models.Model):
+    """
+        A value of a baseline measure for a group of participants, in a
+        category of the measure (e.g. Female) if it has categories
+    """
+    trial = models.ForeignKey(Trial, on_delete=models.CASCADE, related_name='baseline_measurements')
+    measure = models.TextField(null=True)
+    units = models.TextField(null=True)
+    param = models.CharField(max_length=50, null=True)
+    dispersion = models.CharField(max_length=50, null=True)
+    category = models.TextField(null=True, blank=True)
+    group_id = models.CharField(max_length=10, null=True)
+    value = models.CharField(max_length=50, null=True)
+    lower_limit = models.CharField(max_length=50, null=True)
+    upper_limit = models.CharField(max_length=50, null=True)
+
+    def __str__(self):
+        return '{} {}: {}'.format(self.measure, self.group_id, self.value)
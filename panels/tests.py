@@ -1,3 +1,584 @@
-from django.test import TestCase
+import io
+import os
+import json
+import shutil
+import zipfile
+import time
+import threading
+import tempfile
+import csv
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from unittest import mock, skipUnless
+from contextlib import redirect_stdout, redirect_stderr
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+from visual import settings
+from panels.models import Trial, SyncState
+from panels.utils import processor, importer, lookup, downloader
+from panels.utils.parser import FullStudyParser, XMLFastParser
+from panels.utils.comparator import TrialComparator
+from panels.utils.rawcache import ResponseCache
+from panels.utils.stubserver import StubServer
+from panels.utils.plot.charts import Plotter
+from panels.utils.decorators import column, batch_column
+
+
+@batch_column('amyloid', inputs=['criteria'])
+def amyloid(trials):
+    return trials['criteria'].str.contains('amyloid')
+
+
+@batch_column('both', inputs=['amyloid', 'csf'])
+def both(trials):
+    return trials['amyloid'] & trials['csf']
+
+
+@column('csf')
+def csf(trial):
+    return 'csf' in trial['criteria']
+
+
+@column('length')
+def length(trial):
+    return len(trial['criteria'])
+
+
+class PluginLevelsTests(SimpleTestCase):
+
+    def position(self, levels):
+        return {f.column : i for i, level in enumerate(levels) for f in level}
+
+
+    def test_declared_inputs_order_plugins(self):
+        # `dir` order of customize.Functions
+        position = self.position(processor.plugin_levels([amyloid, both, csf]))
+        self.assertLess(position['amyloid'], position['both'])
+        self.assertLess(position['csf'], position['both'])
+
+
+    def test_undeclared_plugin_read_by_a_declared_one(self):
+        # csf is undeclared and listed after `both`, that reads its column
+        position = self.position(processor.plugin_levels([both, csf, amyloid]))
+        self.assertLess(position['csf'], position['both'])
+        self.assertLess(position['amyloid'], position['both'])
+
+
+    def test_undeclared_plugins_keep_their_order(self):
+        levels = processor.plugin_levels([csf, length])
+        self.assertEqual(levels, [[csf], [length]])
+
+
+    def test_cycle_of_declared_inputs(self):
+        first = batch_column('first', inputs=['second'])(lambda trials: trials['second'])
+        second = batch_column('second', inputs=['first'])(lambda trials: trials['first'])
+        with self.assertRaises(ValueError):
+            processor.plugin_levels([first, second])
+
+
+    def test_apply_plugins(self):
+        data = pd.DataFrame({'criteria' : pd.array(['csf and amyloid', 'amyloid', 'csf'], dtype='string')})
+        processor.apply_plugins(data, [both, csf, amyloid])
+        self.assertEqual(list(data['both']), [True, False, False])
+        self.assertEqual(list(data['csf']), [True, False, True])
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+STUDIES_ZIP = os.path.join(FIXTURES, 'studies.zip')
+STUB_DIR = os.path.join(FIXTURES, 'stub')
+GOLDEN = os.path.join(FIXTURES, 'studies.json')       # parsed fixture studies
+
+
+class ImportTestCase(TestCase):
+    """
+        Imports the fixture studies with the checkpoint in a temporary directory
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.addCleanup(lookup.cache.clear)         # the lookup values are rolled back after every test
+        patcher = mock.patch.object(importer, 'CHECKPOINT_FILE', os.path.join(self.tmp, 'checkpoint.json'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def import_studies(self, path, **kwargs):
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            return importer.import_studies(path, **kwargs)
+
+
+    def snapshot(self):
+        trials = Trial.objects.order_by('nct_id')
+        rows = [{k : v for k, v in row.items() if k != 'id'} for row in trials.values()]
+        sponsors = [sorted(t.sponsor.values_list('name', flat=True)) for t in trials]
+        return rows, sponsors
+
+
+    def extract(self):
+        path = os.path.join(self.tmp, 'studies')
+        with zipfile.ZipFile(STUDIES_ZIP) as archive:
+            archive.extractall(path)
+        return path
+
+
+
+
+class ImporterTests(ImportTestCase):
+
+    def test_directory_and_zip_sources_match(self):
+        directory, archive = importer.open_source(self.extract()), importer.open_source(STUDIES_ZIP)
+        self.assertIsInstance(directory, importer.DirectorySource)
+        self.assertIsInstance(archive, importer.ZipSource)
+        self.assertEqual(directory.names(), archive.names())
+
+        self.import_studies(STUDIES_ZIP, batch_size=2)
+        from_zip = self.snapshot()
+        Trial.objects.all().delete()
+        self.import_studies(directory.path, batch_size=2)
+        self.assertEqual(self.snapshot(), from_zip)
+
+
+    def test_import_is_idempotent(self):
+        self.assertEqual(self.import_studies(STUDIES_ZIP, batch_size=4), 6)
+        imported = self.snapshot()
+        self.assertEqual(self.import_studies(STUDIES_ZIP, batch_size=4), 0)
+        self.assertEqual(self.snapshot(), imported)
+
+
+    def test_resume_after_interrupted_import(self):
+        write = importer.BulkWriter.write
+        def interrupt(writer, rows):
+            if Trial.objects.count() >= 2:
+                raise KeyboardInterrupt
+            return write(writer, rows)
+
+        with mock.patch.object(importer.BulkWriter, 'write', interrupt), self.assertRaises(KeyboardInterrupt):
+            self.import_studies(STUDIES_ZIP, batch_size=2)
+        self.assertEqual(Trial.objects.count(), 2)
+
+        checkpoint = importer.Checkpoint(STUDIES_ZIP, 6)
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(checkpoint.offset, 2)
+
+        self.assertEqual(self.import_studies(STUDIES_ZIP, batch_size=2, resume=True), 4)
+        self.assertEqual(Trial.objects.count(), 6)
+
+
+    def test_checkpoint_writes_are_atomic(self):
+        checkpoint = importer.Checkpoint(STUDIES_ZIP, 6)
+        checkpoint.commit([(0, 2)], 2)
+
+        checkpoint.commit([(2, 2)], 2)
+        with mock.patch.object(importer.json, 'dump', side_effect=OSError), self.assertRaises(OSError):
+            checkpoint.commit([(4, 2)], 2)
+
+        stored = importer.Checkpoint(STUDIES_ZIP, 6)
+        self.assertTrue(stored.load())
+        self.assertEqual((stored.offset, stored.imported), (4, 4))
+
+
+
+@skipUnless(connection.vendor == 'postgresql', 'CopyWriter needs a PostgreSQL database')
+class CopyWriterTests(ImportTestCase):
+
+    def rows(self) -> list:
+        source = importer.ZipSource(STUDIES_ZIP)
+        rows, failures = importer._read_batch(source, source.names())
+        self.assertEqual(failures, [])
+        return rows
+
+
+    def counts(self) -> dict:
+        counts = {'trials' : Trial.objects.count(), 'history' : Trial.history.count()}
+        for name in lookup.RELATIONS:
+            counts[name] = getattr(Trial, name).through.objects.count()
+        return counts
+
+
+    def test_same_trials_as_bulk_writer(self):
+        self.assertEqual(importer.BulkWriter().write(self.rows()), 6)
+        expected, counts = self.snapshot(), self.counts()
+        Trial.objects.all().delete()
+        Trial.history.all().delete()
+
+        self.assertEqual(importer.CopyWriter().write(self.rows()), 6)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(self.counts(), counts)
+
+
+    def test_reimport_is_a_no_op(self):
+        self.assertIsInstance(importer.get_writer(), importer.CopyWriter)
+        self.assertEqual(self.import_studies(STUDIES_ZIP, batch_size=4), 6)
+        imported, counts = self.snapshot(), self.counts()
+
+        self.assertEqual(importer.CopyWriter().write(self.rows()), 0)
+        self.assertEqual(self.import_studies(STUDIES_ZIP, batch_size=4), 0)
+        self.assertEqual(self.snapshot(), imported)
+        self.assertEqual(self.counts(), counts)
+
+
+
+class SkipUnchangedTests(ImportTestCase):
+
+    def records(self) -> list:
+        source = importer.ZipSource(STUDIES_ZIP)
+        return [XMLFastParser(source.read(name)).record for name in source.names()]
+
+
+    def test_unchanged_trials_only_update_their_date(self):
+        self.import_studies(STUDIES_ZIP)
+        records = self.records()
+        for i, r in enumerate(records):
+            r.last_update = 'January {}, 2024'.format(i + 1)
+        records[0].title = 'Changed'
+
+        stats = processor.UpdateStats()
+        with mock.patch.object(processor, 'stats', stats), self.assertNumQueries(2):
+            changed = processor.skip_unchanged(records)
+
+        self.assertEqual(changed, [records[0]])
+        self.assertEqual((stats.downloaded, stats.skipped), (6, 5))
+        dates = dict(Trial.objects.values_list('nct_id', 'last_update'))
+        self.assertNotEqual(dates[records[0].nct_id], date(2024, 1, 1))
+        for i, r in enumerate(records[1:], 2):
+            self.assertEqual(dates[r.nct_id], date(2024, 1, i))
+
+
+
+class DownloaderTests(SimpleTestCase):
+
+
+    NCT_IDS = ['NCT00000001', 'NCT00000002', 'NCT00000003']
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.server = StubServer(self.tmp).start()
+        self.addCleanup(self.server.stop)
+        patcher = mock.patch.dict(settings.DOWNLOADER, backoff=0, max_backoff=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def downloader(self, **kwargs):
+        return downloader.TrialDownloader(api_url=self.server.api_url, cache=ResponseCache(self.tmp, 0), **kwargs)
+
+
+    def get_trials(self, trials, nct_ids):
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            return trials.get_trials(nct_ids)
+
+
+    def test_failed_requests_are_retried(self):
+        self.server.httpd.fail_rate = 1
+        trials = self.downloader(concurrency=2, rate=0, retries=2, retry_budget=100)
+        self.assertEqual(self.get_trials(trials, self.NCT_IDS), [])
+        self.assertEqual(self.server.requests, len(self.NCT_IDS) * 3)
+        self.assertEqual(sorted(trials.failed), self.NCT_IDS)
+        self.assertEqual(trials.retry_budget, 100 - len(self.NCT_IDS) * 2)
+
+
+    def test_retry_budget_of_the_run(self):
+        self.server.httpd.fail_rate = 1
+        trials = self.downloader(concurrency=1, rate=0, retries=5, retry_budget=2)
+        self.get_trials(trials, self.NCT_IDS)
+        self.assertEqual(self.server.requests, len(self.NCT_IDS) + 2)
+        self.assertEqual(sorted(trials.failed), self.NCT_IDS)
+
+
+    def test_missing_studies_are_not_failures(self):
+        requests = downloader.stats.requests
+        trials = self.downloader(concurrency=2, rate=0, retries=2)
+        self.assertEqual(self.get_trials(trials, self.NCT_IDS), [])
+        self.assertEqual(trials.failed, [])
+        self.assertEqual(self.server.requests, len(self.NCT_IDS))
+        self.assertEqual(downloader.stats.requests - requests, len(self.NCT_IDS))
+
+
+    def test_rate_limit(self):
+        rate, count = 20, 10
+        trials = self.downloader(concurrency=4, rate=rate, retries=0)
+        start = time.monotonic()
+        self.get_trials(trials, ['NCT{:08}'.format(i) for i in range(count)])
+        self.assertGreaterEqual(time.monotonic() - start, (count - 1) / rate)
+        self.assertEqual(self.server.requests, count)
+
+
+    def test_rate_limiter_spaces_out_threads(self):
+        limiter = downloader.RateLimiter(50)
+        times = []
+        def worker():
+            for _ in range(5):
+                limiter.wait()
+                times.append(time.monotonic())
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(times), 20)
+        self.assertGreaterEqual(max(times) - min(times), 19 / 50 * 0.95)
+
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    NCT_IDS = ['NCT00000004', 'NCT00000188']
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = ResponseCache(self.tmp, 10)
+
+
+    def download(self):
+        with StubServer(STUB_DIR) as server, redirect_stderr(io.StringIO()):
+            trials = downloader.TrialDownloader(rate=0, retries=0, api_url=server.api_url, cache=self.cache)
+            return {t.nct_id : t for t in trials.get_trials(self.NCT_IDS)}
+
+
+    def test_replay_offline(self):
+        downloaded = self.download()
+        self.assertEqual(sorted(downloaded), self.NCT_IDS)
+
+        with mock.patch.object(downloader, 'http_get', side_effect=AssertionError('network access')):
+            replayed = {p.record.nct_id : p.record for p in self.cache.replay()}
+            self.assertEqual(replayed, downloaded)
+
+            for nct_id, trial in downloaded.items():
+                self.assertEqual(FullStudyParser.from_cache(self.cache, nct_id, trial.last_update).record, trial)
+                fetched = downloader.TrialDownloader(cache=self.cache).fetch(nct_id, trial.last_update)
+                self.assertEqual(fetched, trial)
+
+        self.assertIsNone(FullStudyParser.from_cache(self.cache, 'NCT00000004', 'January 1, 2000'))
+
+
+    def test_rows_without_last_update_are_not_cached(self):
+        self.assertFalse(ResponseCache.cacheable('NCT00000004', float('nan')))
+        self.assertFalse(ResponseCache.cacheable('NCT00000004', ' '))
+        self.cache.put('NCT00000004', float('nan'), b'<xml/>')
+        self.assertIsNone(self.cache.get('NCT00000004', float('nan')))
+        self.assertEqual(list(self.cache.replay()), [])
+
+
+
+class TrialComparatorTests(SimpleTestCase):
+
+    FIELDS = {
+        'title' : 'title',
+        'enroll_number' : 'enrollment',
+        'start_date' : 'start_date',
+        'location_str' : 'location_str',
+    }
+
+    def setUp(self):
+        self.comparator = TrialComparator(self.FIELDS)
+
+
+    def diff(self, rows: list, trials: list) -> list:
+        new = self.comparator.incoming(pd.DataFrame(rows))
+        old = self.comparator.snapshot({t.nct_id : t for t in trials})
+        return self.comparator.diff(new, old)
+
+
+    def row(self, **values):
+        row = {'nct_id' : 'NCT00000001', 'title' : 'Title', 'enrollment' : 100,
+                'start_date' : 'January 5, 2020', 'location_str' : 'Paris\nBoston'}
+        row.update(values)
+        return row
+
+
+    def trial(self, **values):
+        fields = {'nct_id' : 'NCT00000001', 'title' : 'Title', 'enroll_number' : 100,
+                    'start_date' : date(2020, 1, 5), 'location_str' : 'Paris\nBoston'}
+        fields.update(values)
+        return Trial(**fields)
+
+
+    def test_unchanged(self):
+        self.assertEqual(self.diff([self.row()], [self.trial()]), [])
+
+
+    def test_missing_on_both_sides(self):
+        row = self.row(title=np.nan, enrollment=np.nan, start_date=None, location_str=None)
+        trial = self.trial(title=None, enroll_number=None, start_date=None, location_str=None)
+        self.assertEqual(self.diff([row], [trial]), [])
+        self.assertEqual(self.diff([row], [self.trial(title=None)]),
+                            [('NCT00000001', 'enroll_number', 100, None),
+                             ('NCT00000001', 'start_date', date(2020, 1, 5), None),
+                             ('NCT00000001', 'location_str', 'Paris\nBoston', None)])
+
+
+    def test_numbers_are_truncated_to_integers(self):
+        self.assertEqual(self.diff([self.row(enrollment=100.0)], [self.trial()]), [])
+        self.assertEqual(self.diff([self.row(enrollment=100.7)], [self.trial()]), [])
+        self.assertEqual(self.diff([self.row(enrollment='100')], [self.trial()]), [])
+
+        changes = self.diff([self.row(enrollment=101.0)], [self.trial()])
+        self.assertEqual(changes, [('NCT00000001', 'enroll_number', 100, 101)])
+        self.assertIsInstance(changes[0][3], int)
+
+
+    def test_dates_are_normalized(self):
+        self.assertEqual(self.diff([self.row(start_date='January 2020')], [self.trial(start_date=date(2020, 1, 1))]), [])
+        self.assertEqual(self.diff([self.row(start_date='invalid')], [self.trial(start_date=None)]), [])
+        self.assertEqual(self.diff([self.row(start_date='January 6, 2020')], [self.trial()]),
+                            [('NCT00000001', 'start_date', date(2020, 1, 5), date(2020, 1, 6))])
+
+
+    def test_line_sets_ignore_order(self):
+        self.assertEqual(self.diff([self.row(location_str='Boston \nParis')], [self.trial()]), [])
+        self.assertEqual(self.diff([self.row(location_str='Boston')], [self.trial()]),
+                            [('NCT00000001', 'location_str', 'Paris\nBoston', 'Boston')])
+        self.assertEqual(self.diff([self.row(title='B\nA')], [self.trial(title='A\nB')]),
+                            [('NCT00000001', 'title', 'A\nB', 'B\nA')])
+
+
+    def test_duplicate_trials_keep_the_last_row(self):
+        rows = [self.row(title='First'), self.row(title='Second')]
+        self.assertEqual(self.diff(rows, [self.trial()]), [('NCT00000001', 'title', 'Title', 'Second')])
+        self.assertEqual(self.diff(rows[::-1], [self.trial()]), [('NCT00000001', 'title', 'Title', 'First')])
+
+
+    def test_new_trials_are_compared_to_missing_values(self):
+        changes = self.diff([self.row(nct_id='NCT00000002')], [self.trial()])
+        self.assertEqual({(nct_id, attr, old) for nct_id, attr, old, new in changes},
+                            {('NCT00000002', attr, None) for attr in self.FIELDS})
+
+
+
+class WindowTests(SimpleTestCase):
+
+    START = datetime(2020, 1, 1)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.server = StubServer(self.tmp).start()
+        self.addCleanup(self.server.stop)
+        self.write_csv({'NCT{:08}'.format(i) : self.START + timedelta(days=i) for i in range(40)})
+
+
+    def write_csv(self, updates: dict):
+        with open(os.path.join(self.tmp, 'studies.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['NCT Number', 'Last Update Posted', 'Status'])
+            for nct_id, updated in updates.items():
+                writer.writerow([nct_id, updated.strftime('%B %d, %Y').replace(' 0', ' '), 'Recruiting'])
+
+
+    def download(self, start, end, cap=downloader.DOWNLOAD_CAP, window_days=60):
+        url = self.server.csv_url.replace('down_count=10000', 'down_count={}'.format(cap))     # truncated like the real endpoint
+        return downloader.download_windows(start, end, cap=cap, window_days=window_days, concurrency=4, url=url)
+
+
+    def test_oversized_window_is_split(self):
+        data = self.download(self.START, self.START + timedelta(days=59), cap=10)
+        self.assertEqual(len(data), 40)
+        self.assertTrue(data['NCT Number'].is_unique)
+        self.assertGreater(self.server.requests, 1)
+
+
+    def test_window_of_a_single_day_over_the_cap(self):
+        self.write_csv({'NCT{:08}'.format(i) : self.START for i in range(15)})
+        with redirect_stdout(io.StringIO()) as out:
+            data = self.download(self.START, self.START + timedelta(days=7), cap=10)
+        self.assertEqual(len(data), 10)
+        self.assertIn('may be truncated', out.getvalue())
+
+
+    def test_merge_overlapping_windows(self):
+        first = pd.DataFrame({'NCT Number' : ['NCT1', 'NCT2'], 'Last Update Posted' : ['January 5, 2020', 'January 6, 2020']})
+        second = pd.DataFrame({'NCT Number' : ['NCT1', 'NCT3'], 'Last Update Posted' : ['February 1, 2020', 'January 7, 2020']})
+
+        merged = downloader.merge_windows([first, second])
+        self.assertEqual(list(merged['NCT Number']), ['NCT1', 'NCT2', 'NCT3'])
+        self.assertEqual(merged.set_index('NCT Number').loc['NCT1', 'Last Update Posted'], 'February 1, 2020')
+
+        pd.testing.assert_frame_equal(downloader.merge_windows([second, first]), merged)
+        pd.testing.assert_frame_equal(downloader.merge_windows([first, second, first, pd.DataFrame()]), merged)
+        self.assertTrue(downloader.merge_windows([pd.DataFrame()]).empty)
+
+
+    def test_rerun_does_not_duplicate_trials(self):
+        first = self.download(self.START, self.START + timedelta(days=30), window_days=7)
+        pd.testing.assert_frame_equal(self.download(self.START, self.START + timedelta(days=30), window_days=7), first)
+
+        updates = {'NCT{:08}'.format(i) : self.START + timedelta(days=i) for i in range(40)}
+        updates['NCT00000005'] = self.START + timedelta(days=50)
+        self.write_csv(updates)
+        second = self.download(self.START + timedelta(days=15), self.START + timedelta(days=59), window_days=7)
+
+        merged = downloader.merge_windows([first, second])
+        self.assertEqual(len(merged), 40)
+        self.assertTrue(merged['NCT Number'].is_unique)
+        self.assertEqual(merged.set_index('NCT Number').loc['NCT00000005', 'Last Update Posted'], 'February 20, 2020')
+
+
+
+class PlotterTests(TestCase):
+
+    def test_outdated_does_not_create_the_sync_state(self):
+        plotter = Plotter()
+        with self.assertNumQueries(1):
+            self.assertFalse(plotter._outdated(datetime.now()))
+        self.assertFalse(SyncState.objects.exists())
+
+        SyncState.bump()
+        self.assertTrue(plotter._outdated(datetime.now() - timedelta(hours=1)))
+        self.assertFalse(plotter._outdated(datetime.now() + timedelta(hours=1)))
+
+
+
+class FullTreeParser(XMLFastParser):
+    """
+        Parses the results section from the tree of the whole document
+    """
+    RESULTS_TAGS = ('<no_results>', '</no_results>')
+
+
+
+class XMLFastParserTests(SimpleTestCase):
+
+    def setUp(self):
+        with zipfile.ZipFile(STUDIES_ZIP) as archive:
+            self.documents = {name : archive.read(name) for name in archive.namelist()}
+        with open(GOLDEN) as f:
+            self.golden = json.load(f)
+
+
+    def parsed(self, parser) -> dict:
+        return json.loads(json.dumps({'record' : parser.record.as_dict(), 'results' : parser.results}))
+
+
+    def test_golden_corpus(self):
+        self.assertEqual(sorted(self.golden), sorted(self.documents))
+        self.assertGreaterEqual(sum(g['record']['has_results'] for g in self.golden.values()), 2)
+
+        for name, document in self.documents.items():
+            fast, full = XMLFastParser(document), FullTreeParser(document)
+            self.assertEqual(fast._results_xml is not None, self.golden[name]['record']['has_results'])
+            self.assertEqual(self.parsed(fast), self.golden[name], name)
+            self.assertEqual(self.parsed(full), self.golden[name], name)
+
+
+    def test_results_tags_not_matched_exactly(self):
+        name = 'NCT0000xxxx/NCT00000001.xml'
+        document = self.documents[name]
+        variants = [
+            document.replace(b'<clinical_results>', b'<clinical_results >'),
+            document.replace(b'<clinical_study rank="1">', b'<clinical_study rank="1"><!-- <clinical_results> -->'),
+            document.replace(b'</clinical_study>', b'<!-- </clinical_results> --></clinical_study>'),
+            document.replace(b'</clinical_results>', b'</clinical_results>\n<keyword><![CDATA[<clinical_results>]]></keyword>'),
+        ]
+        for variant in variants:
+            self.assertNotEqual(variant, document)
+            parsed = self.parsed(XMLFastParser(variant))
+            if b'CDATA' in variant:
+                parsed['record']['keywords'].remove('<clinical_results>')
+            self.assertEqual(parsed, self.golden[name])
@@ -1,8 +1,21 @@
-from datetime import datetime
+import pandas as pd
+import numpy as np
+from django.db import transaction
+from simple_history.utils import bulk_update_with_history
 from panels.models import *
-from panels.utils import tools
+from panels.utils import tools, journal
+
+# fields compared as a set of lines regardless of their ordering
+LINE_SET_FIELDS = ('location_str',)
+
 
 class TrialComparator:
+    """
+        Finds the changes between downloaded trials and the trials in the
+        database. Both sides are loaded into dataframes with a column per
+        trial attribute, so the changed cells of a whole chunk are found
+        by vectorized comparisons.
+    """
     
     def __init__(self, updatable_fields=None):
 
@@ -10,112 +23,209 @@ class TrialComparator:
             self.updatable_fields = updatable_fields
         else:
             self.updatable_fields = {
-                'phase' : 'Phase',
-                'status' : 'Status',
-                'protocol' : 'Protocol',
-                'title' : 'Title',
-                'first_posted' : ('Date', 'FirstPosted'),
-                'start_date' : ('Date', 'Start'),
-                'primary_completion' : ('Date', 'PrimaryCompletion'),
-                'end_date' : ('Date', 'Completion'),
-                'last_update' : ('Date', 'LastUpdate'),
-                'study_duration' : 'StudyDuration',
+                'phase' : 'phase',
+                'status' : 'status',
+                'protocol' : 'protocol',
+                'title' : 'title',
+                'first_posted' : 'first_posted',
+                'start_date' : 'start_date',
+                'primary_completion' : 'primary_completion',
+                'end_date' : 'completion_date',
+                'last_update' : 'last_update',
+                'study_duration' : 'study_duration',
                 # 'treatment_duration' : 'Treatment Duration',
                 # 'treatment_weeks' : 'in Weeks',
                 # 'treatment_days' : 'in Days',
-                'enroll_number' : 'Enrollment',
-                'arms_number' : 'ArmsNumber',
-                'per_arm' : 'PerArm',
-                'location' : 'Locations',
-                'location_str' : 'LocationsString',
-                'num_sites' :   'NumSites',
-                'primary_outcome' : ('Outcome', 'Primary'),
-                'secondary_outcome' : ('Outcome', 'Secondary'),
-                'other_outcome' : ('Outcome', 'Other'),
-                'eligibility_criteria' : 'Criteria',
+                'enroll_number' : 'enrollment',
+                'arms_number' : 'arms_number',
+                'per_arm' : 'per_arm',
+                'location' : 'location',
+                'location_str' : 'location_str',
+                'num_sites' :   'num_sites',
+                'primary_outcome' : 'primary_outcome',
+                'secondary_outcome' : 'secondary_outcome',
+                'other_outcome' : 'other_outcome',
+                'eligibility_criteria' : 'criteria',
+                'fingerprint' : 'fingerprint',
             }
     
 
-    def _str_list_check(self, l1, l2, sep):
+    def _column(self, df: pd.DataFrame, attr: str) -> pd.Series:
         """
-            Check whether two str lists are same or not given 
-            lists items separator regardless of their element 
-            ordering.
+            Extracts the column of a trial attribute from an incoming
+            dataframe and converts it the same way as `build_trial`
         """
-        if l1 and isinstance(l1, str):
-            l1 = set([x.strip() for x in l1.split(sep)])
-        elif l1 and isinstance(l1, list):
-            l1 = set(l1)
-        else:
-            l1 = set()
+        values = df[self.updatable_fields[attr]]
+
+        if attr == 'status':
+            values = values.str[0]
+        elif Trial._meta.get_field(attr).get_internal_type() == 'DateField':
+            values = tools.to_dates(values)
+
+        return values
+
 
-        if l2 and isinstance(l2, str):
-            l2 = set([x.strip() for x in l2.split(sep)])
-        elif l2 and isinstance(l2, list):
-            l2 = set(l2)
+    def _normalize(self, attr: str, values: pd.Series) -> pd.Series:
+        """
+            Converts a column to the python type of its model field, with
+            None for missing values
+        """
+        field = Trial._meta.get_field(attr).get_internal_type()
+        if field == 'DateField':
+            values = pd.to_datetime(values, errors='coerce').dt.date
+        elif field == 'IntegerField':
+            values = np.trunc(pd.to_numeric(values, errors='coerce')).astype('Int64')
+        elif field == 'FloatField':
+            values = pd.to_numeric(values, errors='coerce')
         else:
-            l2 = set()
+            values = values.astype(object)
+            values = values.where(values.isna(), values.astype(str))
 
-        return l1 != l2
+        values = values.astype(object)
+        return values.where(values.notna(), None)
 
 
-    def update_database(self, row):
+    def incoming(self, df: pd.DataFrame) -> pd.DataFrame:
         """
-            Compares two trial objects as a dictionary or a Pandas 
-            row to find the changes of two objects and update the
-            differences.
+            Builds a dataframe of the trial attributes of downloaded rows
 
-        - Parameters
-        ============================
-        + new:     A single row of a dataframe
+            - Parameters
+            ============================
+            + df:      A dataframe of generated data
 
-        - Return
-        ============================
-        + dict :   A dict (object attribute : pandas column) of fields 
-                    that need to be updates
+            - Return
+            ============================
+            + pd.DataFrame : Trial attributes indexed by nct_id
         """
-        t = Trial.objects.get(nct_id=row['NCTID'])
+        data = {attr : self._normalize(attr, self._column(df, attr)).to_numpy() for attr in self.updatable_fields}
+        return pd.DataFrame(data, index=pd.Index(df['nct_id'], name='nct_id'))
 
-        # TODO: updating calculations
 
-        for attr, column in self.updatable_fields.items():
-            if isinstance(column, str):
-                new, old = row[column], getattr(t, attr)
-            elif isinstance(column, tuple):
-                new, old = row[column[0]][column[1]], getattr(t, attr)
-                if column[0] == 'Date':
-                    new = tools.read_date(new)
+    def snapshot(self, trials: dict) -> pd.DataFrame:
+        """
+            Builds a dataframe of the trial attributes of database objects
+
+            - Parameters
+            ============================
+            + trials:  Trial objects (nct_id : Trial)
 
-            if isinstance(new, datetime):
-                if new.date() != old:
-                    setattr(t, attr, new)
+            - Return
+            ============================
+            + pd.DataFrame : Trial attributes indexed by nct_id
+        """
+        data = pd.DataFrame([[getattr(t, attr) for attr in self.updatable_fields] for t in trials.values()],
+                            index=pd.Index(list(trials), name='nct_id'), 
+                            columns=list(self.updatable_fields), dtype=object)
+        return pd.DataFrame({attr : self._normalize(attr, data[attr]) for attr in data.columns})
 
-            elif isinstance(new, int) or isinstance(new, float):       
-                if old is None:
-                    old = 0
 
-                if float(new) != float(old):
-                    setattr(t, attr, new)
+    def diff(self, new: pd.DataFrame, old: pd.DataFrame) -> list:
+        """
+            Compares the cells of two dataframes of trial attributes
 
-            elif attr == 'treatment_duration' or attr == 'location_str':
-                if self._str_list_check(new, old, '\n'):
-                    setattr(t, attr, new)
+            - Parameters
+            ============================
+            + new:     Incoming trial attributes (see `incoming`)
+            + old:     Trial attributes in the database (see `snapshot`)
 
-            # compare the rest normally
+            - Return
+            ============================
+            + list :   Change set of (nct_id, attribute, old value, new value)
+        """
+        new = new[~new.index.duplicated(keep='last')]
+        old = old.reindex(new.index).astype(object)
+        old = old.where(old.notna(), None)         # trials missing from the database
+
+        changes = []
+        for attr in self.updatable_fields:
+            a, b = new[attr], old[attr]
+            if attr in LINE_SET_FIELDS:
+                a = a.apply(lambda x: frozenset(l.strip() for l in x.split('\n')) if x else frozenset())
+                b = b.apply(lambda x: frozenset(l.strip() for l in x.split('\n')) if x else frozenset())
+                equal = a == b
             else:
-                if new != old:
-                    setattr(t, attr, new)
+                equal = (a == b) | (a.isna() & b.isna())
+
+            changed = ~equal.to_numpy(dtype=bool)
+            changes += zip(new.index[changed], [attr] * changed.sum(),
+                            old[attr][changed].tolist(), new[attr][changed].tolist())
+
+        return changes
+
+
+    def apply(self, changes: list, trials: dict) -> dict:
+        """
+            Sets the new values of a change set on the trial objects
+
+            - Return
+            ============================
+            + dict :   Tuple of changed attributes mapped to the list of
+                        trials that have changed on them
+        """
+        changed = {}
+        for nct_id, attr, old, new in changes:
+            setattr(trials[nct_id], attr, new)
+            changed.setdefault(nct_id, []).append(attr)
+
+        groups = {}
+        for nct_id, attrs in changed.items():
+            groups.setdefault(tuple(attrs), []).append(trials[nct_id])
+        return groups
+
+
+    def compare(self, t, row) -> list:
+        """
+            Compares a trial object with a dictionary or a Pandas row
+            and sets the differences on the trial object without saving
+            it.
+
+        - Parameters
+        ============================
+        + t:       A trial object from the database
+        + row:     A single row of a dataframe
+
+        - Return
+        ============================
+        + list :   Names of the trial attributes that have been changed
+        """
+        changes = self.diff(self.incoming(pd.DataFrame([row])), self.snapshot({t.nct_id : t}))
+        self.apply(changes, {t.nct_id : t})
+        return [attr for nct_id, attr, old, new in changes]
+
+
+    def update_trials(self, df: pd.DataFrame, trials: dict, batch_size=1000, run=None) -> list:
+        """
+            Applies the changes of a chunk of rows on their existing trials.
+            The change set of the chunk is computed by `diff` and trials are
+            written by `bulk_update` on their changed fields only, grouped by
+            the set of changed fields. The change set is recorded in the
+            journal instead of the history table when a run is given.
+
+        - Parameters
+        ============================
+        + df:          A dataframe of rows of existing trials
+        + trials:      Existing trials (nct_id : Trial)
+        + batch_size:  Number of trials written in each query
+        + run:         The journal's update run (see `journal.start_run`)
+
+        - Return
+        ============================
+        + list :   The updated trial objects
+        """
+        if df.empty:
+            return []
 
+        changes = self.diff(self.incoming(df), self.snapshot({n : trials[n] for n in df['nct_id']}))
+        groups = self.apply(changes, trials)
 
-            for s in row['Sponsors']['All']:
-                try:
-                    sponsor = Sponsor.objects.get(name=s['Name'])
-                    if sponsor not in t.sponsor.all():
-                        t.sponsor.add(sponsor)
-                except Sponsor.DoesNotExist:
-                    sponsor = Sponsor(name=s['Name'])
-                    sponsor.save()
-                    t.sponsor.add(sponsor)
+        with transaction.atomic():
+            for fields, objs in groups.items():
+                if run:
+                    Trial.objects.bulk_update(objs, list(fields), batch_size=batch_size)
+                else:
+                    bulk_update_with_history(objs, Trial, list(fields), batch_size=batch_size)
 
+            if run:
+                journal.record_changes(run, changes, trials, batch_size)
 
-        return t
+        return [trials[n] for n in df['nct_id']]
@@ -1,4 +1,4 @@
-from panels.utils.decorators import column
+from panels.utils.decorators import column, batch_column
 from django.db import models
 
 
@@ -39,6 +39,13 @@ class Functions:
     #     return 'csf' in trial['criteria'].lower()
 
 
+    # batch plugins get the declared columns of a whole chunk at once
+    # @batch_column('amyloid', inputs=['criteria', 'description'])
+    # def amyloid(trials: pd.DataFrame) -> pd.Series:
+    #     text = trials['criteria'].fillna('') + ' ' + trials['description'].fillna('')
+    #     return text.str.contains('amyloid', case=False)
+
+
 
 class Database:
     columns = {
@@ -1,9 +1,46 @@
+from functools import wraps
 
 
-def column(name):
+def column(name, inputs=None):
+    """
+        Declares a row-wise plugin of a derived column. The function gets
+        a single row of a trial and returns its value of the column.
+
+        - Parameters
+        ============================
+        + name:     Name of the derived column
+        + inputs:   Columns the function reads (the whole row by default).
+                    Only these columns are passed when they are declared.
+    """
+    def inner(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return func(*args, **kwargs)
+        wrapper.column = name
+        wrapper.inputs = tuple(inputs) if inputs is not None else None
+        wrapper.batch = False
+        return wrapper
+    return inner
+
+
+def batch_column(name, inputs):
+    """
+        Declares a batch plugin of a derived column. The function gets a
+        DataFrame of the input columns of a whole chunk of trials and
+        returns a Series (or an array) of the column, one value per row.
+
+        - Parameters
+        ============================
+        + name:     Name of the derived column
+        + inputs:   Columns the function reads, other plugins' columns
+                    included
+    """
     def inner(func):
+        @wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
         wrapper.column = name
+        wrapper.inputs = tuple(inputs)
+        wrapper.batch = True
         return wrapper
     return inner
@@ -1,11 +1,19 @@
+import io
+import os
+import time
+import random
 import argparse
+import threading
 import requests
-from datetime import datetime
-from pytrials.client import ClinicalTrials
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from datetime import datetime, timedelta
 import pandas as pd
-import json
 from visual import settings
 from panels.utils.parser import FullStudyParser
+from panels.utils.record import TrialRecord
+from panels.utils.rawcache import ResponseCache
 
 
 # Defining constants in our code
@@ -13,6 +21,120 @@ BASE_URL = 'https://clinicaltrials.gov/ct2/results/download_fields?down_count=10
 START_KEY = 'lupd_s'             # First Posted Starting Date Key
 END_KEY = 'lupd_e'               # First Posted Ending Date Key
 SLASH_CODE = '%2F'          # The encoded characters for backslash (\) in url
+API_URL = 'https://clinicaltrials.gov/api/query/full_studies?expr={}&max_rnk=1&fmt=xml'
+
+# maximum number of trials returned by a single CSV download (down_count)
+DOWNLOAD_CAP = 10000
+
+# first date that is downloaded when there is no trial in the database
+FIRST_UPDATE = datetime(1999, 1, 1)
+
+# HTTP status codes that are worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# upper bounds (in seconds) of the buckets of request latency histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+
+
+class SessionStats:
+    """
+        Statistics of the requests sent through the shared session:
+        number of requests, connections opened and reused, bytes
+        transferred over the wire and a histogram of latencies
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        self.requests = 0
+        self.bytes = 0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self._pools = []
+
+
+    def record(self, response: requests.Response, elapsed: float):
+        try:
+            size = response.raw.tell()          # compressed size read from the socket
+        except Exception:
+            size = len(response.content)
+
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    self.histogram[i] += 1
+                    break
+
+
+    @property
+    def connections(self) -> int:
+        """
+            Number of TCP connections opened by the session
+        """
+        if _session is None:
+            return 0
+        total = 0
+        for adapter in set(_session.adapters.values()):
+            for key in adapter.poolmanager.pools.keys():
+                total += adapter.poolmanager.pools[key].num_connections
+        return total
+
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+
+    def report(self) -> str:
+        lines = ['Requests: {:,} | Connections: {:,} opened, {:,} reused | Transferred: {:,.1f} KB'.format(
+                    self.requests, self.connections, self.reused, self.bytes / 1024)]
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            if count:
+                label = '<= {}s'.format(bound) if bound != float('inf') else '>  {}s'.format(LATENCY_BUCKETS[-2])
+                lines.append('  {:>8} : {:,}'.format(label, count))
+        return '\n'.join(lines)
+
+
+
+_session = None
+_session_lock = threading.Lock()
+stats = SessionStats()
+
+
+def get_session() -> requests.Session:
+    """
+        Returns the HTTP session shared by every downloader of the process.
+        Connections are kept alive in a pool with the size of `pool_size`
+        in the `downloader` section of the config file.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = settings.DOWNLOADER.get('pool_size', 20)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            _session = session
+        return _session
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """
+        Sends a GET request through the shared session with the configured
+        timeouts and records its statistics
+    """
+    kwargs.setdefault('timeout', (settings.DOWNLOADER.get('connect_timeout', 10),
+                                    settings.DOWNLOADER.get('timeout', 30)))
+    start = time.monotonic()
+    r = get_session().get(url, **kwargs)
+    stats.record(r, time.monotonic() - start)
+    return r
 
 
 def validate_date(date: str) -> datetime:
@@ -60,100 +182,301 @@ def download_file(url, save_name='SearchResults'):
         + save_name:   Name of the file to save after downloading 
         
     """
-    r = requests.get(url, allow_redirects=True)
+    r = http_get(url, allow_redirects=True)
     open(settings.BASE_DIR+'/data/'+save_name+'.csv', 'wb').write(r.content)
 
 
-def get_trial(nct_id: str, columns=None) -> dict:
+def get_trial(nct_id: str, last_update=None) -> TrialRecord:
     """
-        Download a trials using pytrials API
+        Downloads a trial from the FullStudy XML endpoint of clinicaltrials.gov
 
         - Parameters
         ============================
-        + nct_ids:        Trials nct_id
-        + columns:        Keys of column that need to retrieve
+        + nct_id:         Trials nct_id
+        + last_update:    Last update date of the trial to look up the cached response
 
         - Return
         ============================
-        + dict: Downloaded columns as a dictionary
-    """
-    if not columns:
-        columns = [
-            "NCTId", 
-            "OfficialTitle",
-            "Phase",
-            "OverallStatus",
-            "DesignPrimaryPurpose",
-            "EligibilityCriteria",
-            "LeadSponsorClass",
-            "OrgStudyId", 
-            "PrimaryOutcomeMeasure", 
-            "PrimaryOutcomeTimeFrame", 
-            "PrimaryOutcomeDescription",
-            "SecondaryOutcomeMeasure",
-            "SecondaryOutcomeTimeFrame",
-            "SecondaryOutcomeDescription",
-            "OtherOutcomeMeasure",
-            "OtherOutcomeTimeFrame",
-            "OtherOutcomeDescription",
-            "EnrollmentCount",
-            "ArmGroupDescription",
-            "ArmGroupInterventionName",
-            "ArmGroupLabel",
-            "ArmGroupType",
-            "Condition",
-            "CompletionDate",
-            "PrimaryCompletionDate",
-            "StartDate",
-            "StudyFirstPostDate",
-            "LastUpdatePostDate",
-            "MaximumAge",
-            "MinimumAge",
-            "LocationCountry",            
-        ]
-
-
-    r = requests.get('https://clinicaltrials.gov/api/query/full_studies?expr={}&max_rnk=1&fmt=xml'
-            .format(nct_id))
-
-    _parser = FullStudyParser(r.content)
-    data = _parser.data
-
-    return data if data['NCTID'] else None
+        + TrialRecord: Parsed study or None if the study is not found
+    """
+    return default_downloader().fetch(nct_id, last_update)
 
 
-def download_trials(start_date=None, end_date=None, f_name=None):
+
+class RateLimiter:
+    """
+        Spaces out the requests of all threads to a maximum number of
+        requests per second
+    """
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+
+class TrialDownloader:
+    """
+        Downloads full studies from the clinicaltrials.gov API concurrently
+        over the shared HTTP session. The number of concurrent requests and
+        requests per second are capped, and failed requests are retried
+        with exponential backoff as long as the retry budget of the run
+        is not spent. Defaults are read from the `downloader` section of
+        the config file.
+
+        - Parameters
+        ============================
+        + concurrency:   Maximum number of requests in flight
+        + rate:          Maximum number of requests per second (0 for no limit)
+        + retries:       Maximum number of retries of a single trial
+        + retry_budget:  Maximum number of retries of the whole run
+        + api_url:       Full study URL template, e.g. of a local stub server
+        + cache:         Cache of raw responses checked before the network
     """
-        Download all trials that are updated in the given period 
+    def __init__(self, concurrency=None, rate=None, retries=None, retry_budget=None, api_url=None, cache=None):
+        conf = settings.DOWNLOADER
+        self.concurrency = concurrency or conf.get('concurrency', 8)
+        self.rate = rate if rate is not None else conf.get('rate', 10)
+        self.retries = retries if retries is not None else conf.get('retries', 5)
+        self.retry_budget = retry_budget if retry_budget is not None else conf.get('retry_budget', 500)
+        self.backoff = conf.get('backoff', 0.5)
+        self.max_backoff = conf.get('max_backoff', 30)
+        self.api_url = api_url or conf.get('api_url', API_URL)
+        self.cache = cache or ResponseCache()
+
+        self.limiter = RateLimiter(self.rate)
+        self.failed = []
+        self._lock = threading.Lock()
+
+
+    def _spend_retry(self) -> bool:
+        with self._lock:
+            if self.retry_budget <= 0:
+                return False
+            self.retry_budget -= 1
+            return True
+
+
+    def fetch(self, nct_id: str, last_update: str = None) -> TrialRecord:
+        """
+            Downloads and parses a single full study. The cached response
+            is used if the study has not been updated since it was cached.
 
             - Parameters
             ============================
-            + start_date:     String of start date of period in format MM/DD/YYYY
-            + end_date:       String of end date of period in format MM/DD/YYYY
-            + f_name:         Name of file to save the result into without .csv postfix
+            + nct_id:      Trials nct_id
+            + last_update: Last update date of the trial (e.g. from the CSV)
+
+            - Return
+            ============================
+            + TrialRecord: Parsed study or None if the study is not found
+        """
+        content = self.cache.get(nct_id, last_update)
+        if content:
+            return FullStudyParser(content).record
+
+        attempt = 0
+        while True:
+            self.limiter.wait()
+            try:
+                r = http_get(self.api_url.format(nct_id))
+                if r.status_code in RETRY_STATUS:
+                    raise requests.HTTPError('HTTP {} for {}'.format(r.status_code, nct_id), response=r)
+                r.raise_for_status()
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in RETRY_STATUS
+                attempt += 1
+                if not retryable or attempt > self.retries or not self._spend_retry():
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                time.sleep(delay * random.uniform(0.5, 1))      # jitter to avoid synchronized retries
+
+        record = FullStudyParser(r.content).record
+        if not record.nct_id:
+            return None
+
+        self.cache.put(nct_id, record.last_update, r.content)
+        return record
+
+
+    def get_trials(self, nct_ids, last_updates=None) -> list:
+        """
+            Downloads a list of trials concurrently. Trials that could not
+            be downloaded are reported and kept in `failed`.
+
+            - Parameters
+            ============================
+            + nct_ids:      List of trials nct_id
+            + last_updates: Optional list of last update dates of the trials
+
+            - Return
+            ============================
+            + list: Parsed studies that are downloaded successfully
+        """
+        if last_updates is None:
+            last_updates = [None] * len(nct_ids)
+
+        trials = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(self.fetch, nct_id, last) : nct_id for nct_id, last in zip(nct_ids, last_updates)}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    t = future.result()
+                    if t:
+                        trials.append(t)
+                except Exception as e:
+                    print('Failed to retrieve:', futures[future], e)
+                    self.failed.append(futures[future])
+
+        return trials
+
+
+
+_downloader = None
+
+def default_downloader() -> TrialDownloader:
+    """
+        Returns the downloader shared by the module
+    """
+    global _downloader
+    if _downloader is None:
+        _downloader = TrialDownloader()
+    return _downloader
+
+
+def download_window(start: datetime, end: datetime, url=None) -> pd.DataFrame:
+    """
+        Downloads the CSV of trials updated in a window of dates
+
+        - Parameters
+        ============================
+        + start:       First day of the window
+        + end:         Last day of the window (inclusive)
+        + url:         CSV download URL, e.g. of a local stub server
+
+        - Return
+        ============================
+        + pd.DataFrame : Downloaded trials of the window
     """
-    url = BASE_URL
-    file_name = ''
+    url = url or settings.DOWNLOADER.get('csv_url', BASE_URL)
+    url = url + encode_url('&' + START_KEY + '=' + start.strftime('%m/%d/%Y'))      \
+              + encode_url('&' + END_KEY + '=' + end.strftime('%m/%d/%Y'))
 
-    if start_date:
-        file_name = start_date + '-'
-        start_date = start_date
-        url = url + encode_url('&' + START_KEY + '=' + start_date)
-    else:
-        file_name = 'NODATE-'
+    r = http_get(url, allow_redirects=True)
+    r.raise_for_status()
+    if not r.content.strip():
+        return pd.DataFrame()
+    return pd.read_csv(io.BytesIO(r.content))
 
 
-    if end_date:
-        file_name = file_name + end_date
-        url = url + encode_url('&' + END_KEY + '=' + end_date)
-    else:
-        file_name = 'NODATE'
+def merge_windows(frames: list) -> pd.DataFrame:
+    """
+        Merges the CSV of windows into a single table with one row per
+        trial, keeping the latest update of a trial. The result does not
+        depend on the order or repetition of the windows.
+    """
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
 
+    data = pd.concat(frames, ignore_index=True)
+    updated = pd.to_datetime(data['Last Update Posted'], errors='coerce')
+    data = data.assign(_updated=updated)                                \
+                .sort_values(['NCT Number', '_updated'], kind='mergesort') \
+                .drop_duplicates(subset='NCT Number', keep='last')        \
+                .drop(columns='_updated')
+    return data.reset_index(drop=True)
+
+
+def download_windows(start: datetime, end: datetime, cap=DOWNLOAD_CAP, window_days=None,
+                        concurrency=None, url=None) -> pd.DataFrame:
+    """
+        Downloads all trials updated in a period, which may be more than
+        the cap of a single CSV download. The period is split into windows
+        that are downloaded concurrently, and a window hitting the cap is
+        split in half again until every window is under the cap.
+
+        - Parameters
+        ============================
+        + start:        First day of the period
+        + end:          Last day of the period (inclusive)
+        + cap:          Number of rows of a download that means it is truncated
+        + window_days:  Length of the first windows in days
+        + concurrency:  Number of windows downloaded at once
+        + url:          CSV download URL, e.g. of a local stub server
+
+        - Return
+        ============================
+        + pd.DataFrame : Merged trials of all windows
+    """
+    conf = settings.DOWNLOADER
+    window_days = window_days or conf.get('window_days', 30)
+    concurrency = concurrency or conf.get('concurrency', 8)
+
+    windows = []
+    while start <= end:
+        windows.append((start, min(end, start + timedelta(days=window_days - 1))))
+        start = windows[-1][1] + timedelta(days=1)
+
+    frames = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = {pool.submit(download_window, s, e, url) : (s, e) for s, e in windows}
+        while pending:
+            future = next(as_completed(pending))
+            s, e = pending.pop(future)
+            data = future.result()
+
+            if len(data) >= cap and s < e:              # truncated window
+                middle = s + (e - s) // 2
+                for w in ((s, middle), (middle + timedelta(days=1), e)):
+                    pending[pool.submit(download_window, w[0], w[1], url)] = w
+                continue
+
+            if len(data) >= cap:
+                print('Trials updated on {} may be truncated at {} rows'.format(s.strftime('%m/%d/%Y'), cap))
+            frames.append(data)
+
+    return merge_windows(frames)
+
+
+def download_trials(start_date=None, end_date=None, f_name=None):
+    """
+        Download all trials that are updated in the given period. The period
+        is downloaded in adaptive windows, so updates over the 10k rows cap
+        of a single download are not dropped.
+
+            - Parameters
+            ============================
+            + start_date:     String of start date of period in format MM/DD/YYYY
+            + end_date:       String of end date of period in format MM/DD/YYYY
+            + f_name:         Name of file to save the result into without .csv postfix
+    """
+    file_name = (start_date or 'NODATE') + '-' + (end_date or 'NODATE')
     file_name = file_name.replace('/', '')
     if f_name:
         file_name = f_name
 
-    download_file(url, file_name)
+    start = datetime.strptime(start_date, '%m/%d/%Y') if start_date else FIRST_UPDATE
+    end = datetime.strptime(end_date, '%m/%d/%Y') if end_date else datetime.today()
+    data = download_windows(start, end)
+
+    path = settings.BASE_DIR + '/data/' + file_name + '.csv'
+    if data.empty:
+        data = pd.DataFrame(columns=['NCT Number', 'Last Update Posted'])
+    data.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
 
 
 def download_single_trial(nct_id):
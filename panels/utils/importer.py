@@ -0,0 +1,673 @@
+"""
+    Batched import engine to load the XML dump of clinicaltrials.gov
+    (AllPublicXML) into the database. Studies are read either from the
+    extracted directory or straight from the zip archive, parsed in batches,
+    values of lookup tables are resolved in memory and every batch is
+    written with bulk inserts inside a single transaction.
+"""
+import io
+import queue
+import os
+import json
+import time
+import zipfile
+import threading
+import multiprocessing
+from django.db import connection, connections, transaction
+from tqdm import tqdm
+from datetime import datetime
+
+from panels.models import *
+from panels.utils import processor, lookup, tools, journal, results
+from panels.utils.parser import XMLFastParser
+from panels.utils.record import RecordBatch
+from panels.utils.comparator import TrialComparator
+from visual import settings
+
+
+# number of studies that are written into the database in one transaction
+BATCH_SIZE = 1000
+
+# number of studies handed to a parser process in one task
+PARSE_CHUNK = 64
+
+# maximum number of parsed chunks waiting for the writer, which keeps the
+# memory of the import flat when the writer is slower than the parsers
+QUEUE_SIZE = 32
+
+# seconds the writer waits for a parsed chunk before checking that the
+# parser processes are still alive
+WORKER_POLL = 5
+
+# progress of the last import, used to resume an interrupted import
+CHECKPOINT_FILE = os.path.join(settings.BASE_DIR, 'data', 'import', 'checkpoint.json')
+
+class DirectorySource:
+    """
+        Studies extracted from the archive into a directory tree
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+
+    def names(self) -> list:
+        """
+            Walks the directory and returns the sorted list of XML files
+            relative to the directory
+        """
+        names = []
+        for root, dirs, files in os.walk(self.path):
+            for file in files:
+                if file.split('.')[-1] == 'xml':
+                    names.append(os.path.relpath(os.path.join(root, file), self.path))
+        return sorted(names)
+
+
+    def read(self, name: str) -> bytes:
+        with open(os.path.join(self.path, name), 'rb') as xml:
+            return xml.read()
+
+
+
+class ZipSource:
+    """
+        Studies streamed out of the AllPublicXML.zip archive without
+        extracting it. The list of members is read from the central
+        directory of the archive, and every process opens its own handle
+        to the file so the source can be shared with forked parsers.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._archive = None
+        self._pid = None
+
+
+    def _open(self) -> zipfile.ZipFile:
+        if self._archive is None or self._pid != os.getpid():
+            self._archive = zipfile.ZipFile(self.path)
+            self._pid = os.getpid()
+        return self._archive
+
+
+    def names(self) -> list:
+        with zipfile.ZipFile(self.path) as archive:
+            return [info.filename for info in archive.infolist()
+                        if not info.is_dir() and info.filename.split('.')[-1] == 'xml']
+
+
+    def read(self, name: str) -> bytes:
+        return self._open().read(name)
+
+
+
+def open_source(path: str):
+    """
+        Returns the source of studies for an input path, that can be a zip
+        archive or a directory of extracted XML files
+    """
+    if os.path.isfile(path) and zipfile.is_zipfile(path):
+        return ZipSource(path)
+    return DirectorySource(path)
+
+
+def study_id(name: str) -> str:
+    """
+        Returns the NCT ID of a study given its file or member name
+    """
+    return os.path.basename(name).split('.')[0]
+
+
+def _build_rows(records: list) -> list:
+    for r in records:
+        r.fingerprint = tools.fingerprint(r)
+    return processor.build_columns(RecordBatch(records)).rows()
+
+
+def parse_batch(documents: list, with_results: bool = False) -> tuple:
+    """
+        Parses a batch of XML documents and builds the calculated columns
+        for all of them at once. Documents that fail to be parsed are
+        returned as failures instead of failing the whole batch.
+
+        - Parameters
+        ============================
+        + documents:    A list of (name, XML document as bytes) tuples
+        + with_results: Parse the results sections into the `Result` of rows
+
+        - Return
+        ============================
+        + list : A list of rows (dict) ready to be mapped to trials
+        + list : A list of (name, error) tuples of failed documents
+    """
+    parsed = []
+    failures = []
+    parsed_results = {}
+    for name, xml in documents:
+        try:
+            parser = XMLFastParser(xml)
+            if with_results:
+                parsed_results[parser.record.nct_id] = results.parsed_results(parser)
+            parsed.append((name, parser.record))
+        except Exception as e:
+            failures.append((name, repr(e)))
+
+    if not parsed:
+        return [], failures
+
+    try:
+        rows = _build_rows([d for _, d in parsed])
+    except Exception:
+        # building row by row to isolate the documents that break the batch
+        rows = []
+        for name, d in parsed:
+            try:
+                rows.extend(_build_rows([d]))
+            except Exception as e:
+                failures.append((name, repr(e)))
+
+    if with_results:
+        for r in rows:
+            r['Result'] = parsed_results.get(r['nct_id'])
+    return rows, failures
+
+
+def _read_batch(source, names: list, with_results: bool = False) -> tuple:
+    documents = []
+    failures = []
+    for name in names:
+        try:
+            documents.append((name, source.read(name)))
+        except Exception as e:
+            failures.append((name, repr(e)))
+
+    rows, failed = parse_batch(documents, with_results)
+    return rows, failures + failed
+
+
+def _parse_worker(source, tasks, results, with_results=False):
+    """
+        Parser process: reads chunks of names from the task queue and
+        puts the parsed rows into the bounded result queue
+    """
+    for start, names in iter(tasks.get, None):
+        try:
+            results.put((start, len(names)) + _read_batch(source, names, with_results))
+        except Exception as e:
+            results.put((start, len(names), e, []))
+    results.put(None)
+
+
+def serial_parse(source, names: list, chunk_size: int, offset: int = 0, with_results: bool = False):
+    """
+        Parses the studies in the current process and yields the position
+        and number of processed files with the parsed rows and failures
+        of every chunk
+    """
+    for i, chunk in enumerate(tools.chunks(names, chunk_size)):
+        yield (offset + i * chunk_size, len(chunk)) + _read_batch(source, chunk, with_results)
+
+
+def parallel_parse(source, names: list, workers: int, chunk_size: int = PARSE_CHUNK, offset: int = 0,
+                   with_results: bool = False):
+    """
+        Parses the studies in a pool of processes and streams the parsed
+        rows back to the caller, that is the single writer process. Both
+        task and result queues are bounded, and chunks are yielded in the
+        order they are parsed.
+
+        - Parameters
+        ============================
+        + source:       Directory or zip source of the studies
+        + names:        Names of XML files to parse
+        + workers:      Number of parser processes
+        + chunk_size:   Number of files parsed in each task
+        + offset:       Position of the first name in the whole source
+        + with_results: Parse the results sections of the studies as well
+
+        - Return
+        ============================
+        + generator : Yields the position and number of processed files,
+                        parsed rows and failures of every chunk
+    """
+    ctx = multiprocessing.get_context('fork')
+    tasks = ctx.Queue(maxsize=workers * 2)
+    results = ctx.Queue(maxsize=QUEUE_SIZE)
+
+    connections.close_all()         # forked processes must not share database connections
+    processes = [ctx.Process(target=_parse_worker, args=(source, tasks, results, with_results), daemon=True)
+                    for _ in range(workers)]
+    for p in processes:
+        p.start()
+
+    def feed():
+        for i, chunk in enumerate(tools.chunks(names, chunk_size)):
+            tasks.put((offset + i * chunk_size, chunk))
+        for _ in processes:
+            tasks.put(None)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    try:
+        finished = 0
+        while finished < len(processes):
+            try:
+                item = results.get(timeout=WORKER_POLL)
+            except queue.Empty:
+                crashed = [p for p in processes if p.exitcode not in (None, 0)]
+                if crashed:
+                    raise RuntimeError('Parser process {} exited with code {}'.format(crashed[0].pid, crashed[0].exitcode))
+                if not any(p.is_alive() for p in processes):
+                    raise RuntimeError('Parser processes exited without finishing their tasks')
+                continue
+
+            if item is None:
+                finished += 1
+                continue
+
+            if isinstance(item[2], Exception):
+                raise item[2]
+            yield item
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+
+
+class Checkpoint:
+    """
+        Progress of an import that is written to disk after every committed
+        batch, so an interrupted import can be resumed. The offset is the
+        number of leading studies of the source that are committed, while
+        the studies that failed to be parsed are kept as a dead-letter list.
+    """
+    def __init__(self, source: str, total: int, path: str = None):
+        self.path = path or CHECKPOINT_FILE
+        self.source = os.path.abspath(source)
+        self.total = total
+        self.offset = 0
+        self.batch = 0
+        self.imported = 0
+        self.failures = {}
+        self._done = {}
+
+
+    def load(self) -> bool:
+        """
+            Loads the stored checkpoint if it belongs to the same source
+
+            - Return
+            ============================
+            + bool : Whether the checkpoint has been loaded or not
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path) as f:
+            state = json.load(f)
+
+        if state['source'] != self.source or state['total'] != self.total:
+            return False
+
+        self.offset = state['offset']
+        self.batch = state['batch']
+        self.imported = state['imported']
+        self.failures = state['failures']
+        return True
+
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        state = {
+            'source' : self.source,
+            'total' : self.total,
+            'offset' : self.offset,
+            'batch' : self.batch,
+            'imported' : self.imported,
+            'failures' : self.failures,
+            'updated' : datetime.now().isoformat(),
+        }
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)       # never leaves a half written checkpoint
+
+
+    def fail(self, failures: list):
+        for name, error in failures:
+            self.failures[name] = error
+
+
+    def commit(self, chunks: list, imported: int):
+        """
+            Marks the chunks of a committed batch as done and moves the
+            offset forward over the chunks that are done contiguously
+        """
+        for start, count in chunks:
+            self._done[start] = count
+        while self.offset in self._done:
+            self.offset += self._done.pop(self.offset)
+
+        self.batch += 1
+        self.imported += imported
+        self.save()
+
+
+
+class BulkWriter:
+    """
+        Writes batches of parsed rows into the database. The lookup tables
+        (agents, conditions, countries and sponsors) are resolved through
+        the shared lookup cache, missing values are inserted in bulk and
+        the trials with their many-to-many relations are written by
+        `bulk_create`. With `with_results`, the parsed results of the rows
+        are stored into the results tables in the same transaction. When a
+        journal run is given, the inserted trials are marked as created by
+        the run.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, history=True, with_results=False, run=None):
+        self.batch_size = batch_size
+        self.history = history
+        self.with_results = with_results
+        self.run = run
+
+
+    def write(self, rows: list) -> int:
+        """
+            Inserts a batch of rows into the database in one transaction.
+            Trials that already exist in the database are skipped.
+
+            - Parameters
+            ============================
+            + rows:     A list of rows generated by `parse_batch`
+
+            - Return
+            ============================
+            + int : Number of inserted trials
+        """
+        rows = {r['nct_id'] : r for r in rows}
+        for chunk in tools.chunks(list(rows)):            # skipping trials that are already imported
+            for nct_id in Trial.objects.filter(nct_id__in=chunk).values_list('nct_id', flat=True):
+                del rows[nct_id]
+
+        return len(self.insert(list(rows.values())))
+
+
+    def insert(self, rows: list) -> list:
+        """
+            Inserts a batch of rows of new trials into the database in one
+            transaction without checking for existing ones
+
+            - Parameters
+            ============================
+            + rows:     A list of rows with distinct nct_ids
+
+            - Return
+            ============================
+            + list : The inserted trial objects
+        """
+        if not rows:
+            return []
+
+        trials = [processor.build_trial(r) for r in rows]
+        relations = {r['nct_id'] : processor.trial_relations(r) for r in rows}
+
+        try:
+            with transaction.atomic():
+                trials = self._insert(trials, relations)
+                if self.run:
+                    journal.record_created(self.run, trials, self.batch_size)
+                if self.with_results:
+                    results.store(trials, {r['nct_id'] : r.get('Result') for r in rows}, self.batch_size)
+        except Exception:
+            lookup.cache.clear()            # the inserted lookup values are rolled back as well
+            raise
+
+        return trials
+
+
+    def _insert(self, trials: list, relations: dict) -> list:
+        with transaction.atomic():
+            Trial.objects.bulk_create(trials, batch_size=self.batch_size)
+
+            ids = [t.nct_id for t in trials]
+            pks = {}
+            for chunk in tools.chunks(ids):
+                pks.update(Trial.objects.filter(nct_id__in=chunk).values_list('nct_id', 'pk'))
+            for t in trials:
+                t.pk = pks[t.nct_id]
+            if self.history:
+                Trial.history.bulk_history_create(trials, batch_size=self.batch_size)
+            lookup.sync_relations(trials, relations, self.batch_size, existing=False)
+        return trials
+
+
+
+class CopyWriter(BulkWriter):
+    """
+        Writes batches of parsed rows into a PostgreSQL database. Trials
+        and their links to the lookup tables are streamed with `COPY` into
+        temporary staging tables, then merged into the trial, history and
+        through tables with set-based SQL. Trials that already exist are
+        skipped by the merge itself.
+    """
+
+    def write(self, rows: list) -> int:
+        rows = {r['nct_id'] : r for r in rows}
+        return len(self.insert(list(rows.values())))
+
+
+    @staticmethod
+    def _copy(cursor, table: str, columns: list, records):
+        """
+            Streams records into a table with COPY in CSV format, where an
+            unquoted empty value is NULL
+        """
+        def value(v):
+            if v is None:
+                return ''
+            return '"' + str(v).replace('\x00', '').replace('"', '""') + '"'
+
+        data = io.StringIO()
+        for record in records:
+            data.write(','.join(value(v) for v in record))
+            data.write('\n')
+        data.seek(0)
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table, ', '.join(columns)), data)
+
+
+    def _insert(self, trials: list, relations: dict) -> list:
+        trial_table = Trial._meta.db_table
+        history_table = Trial.history.model._meta.db_table
+        fields = [f for f in Trial._meta.concrete_fields if not f.primary_key]
+        columns = [f.column for f in fields]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS stage_trial')           # left by an outer transaction
+            cursor.execute('CREATE TEMP TABLE stage_trial ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA'
+                            .format(', '.join(columns), trial_table))
+            self._copy(cursor, 'stage_trial', columns, 
+                        ([f.get_db_prep_save(getattr(t, f.attname), connection) for f in fields] for t in trials))
+
+            cursor.execute('INSERT INTO {0} ({1}) SELECT {1} FROM stage_trial ON CONFLICT (nct_id) DO NOTHING '
+                            'RETURNING id, nct_id'.format(trial_table, ', '.join(columns)))
+            pks = dict((nct_id, pk) for pk, nct_id in cursor.fetchall())
+
+            inserted = [t for t in trials if t.nct_id in pks]
+            for t in inserted:
+                t.pk = pks[t.nct_id]
+
+            if self.history and inserted:
+                cursor.execute('INSERT INTO {0} (id, {1}, history_date, history_type) '
+                                'SELECT t.id, {2}, now(), %s FROM stage_trial s JOIN {3} t ON t.nct_id = s.nct_id '
+                                'WHERE t.id = ANY(%s)'.format(history_table, ', '.join(columns), 
+                                                            ', '.join('s.' + c for c in columns), trial_table),
+                                ['+', list(pks.values())])
+
+            for name, model in lookup.RELATIONS.items():
+                links = [(t.nct_id, v) for t in trials if t.nct_id in pks for v in relations[t.nct_id][name]]
+                if not links:
+                    continue
+                mapping = lookup.cache.resolve(model, {v for _, v in links})
+
+                through = getattr(Trial, name).through._meta.db_table
+                target = model._meta.model_name + '_id'
+                cursor.execute('DROP TABLE IF EXISTS stage_{}'.format(name))
+                cursor.execute('CREATE TEMP TABLE stage_{} (nct_id varchar(11), target_id integer) ON COMMIT DROP'
+                                .format(name))
+                self._copy(cursor, 'stage_' + name, ['nct_id', 'target_id'], 
+                            ((nct_id, mapping[lookup.cache.key(v)]) for nct_id, v in links))
+                cursor.execute('INSERT INTO {0} (trial_id, {1}) SELECT DISTINCT t.id, s.target_id '
+                                'FROM stage_{2} s JOIN {3} t ON t.nct_id = s.nct_id '
+                                'ON CONFLICT DO NOTHING'.format(through, target, name, trial_table))
+
+        return inserted
+
+
+
+def get_writer(batch_size=BATCH_SIZE, history=True, with_results=False, run=None) -> BulkWriter:
+    """
+        Returns the writer of the database backend, that is `CopyWriter`
+        on PostgreSQL and `BulkWriter` otherwise
+    """
+    if connection.vendor == 'postgresql':
+        return CopyWriter(batch_size, history, with_results, run)
+    return BulkWriter(batch_size, history, with_results, run)
+
+
+
+def existing_trials(nct_ids: list) -> dict:
+    """
+        Fetches the trials of given nct_ids that exist in the database
+
+        - Parameters
+        ============================
+        + nct_ids:     A list of trials nct_id
+
+        - Return
+        ============================
+        + dict : nct_id mapped to the trial object
+    """
+    trials = {}
+    for chunk in tools.chunks(nct_ids):
+        query = Trial.objects.filter(nct_id__in=chunk)
+        trials.update((t.nct_id, t) for t in query)
+    return trials
+
+
+def build_objects(batch: RecordBatch, batch_size=processor.CHUNK_SIZE, run=None) -> tuple[list, list]:
+    """
+        Build a objects and insert them into the database if they are not exist
+        and update the existing ones. Existing trials are fetched once for the
+        whole batch, new ones are inserted by `bulk_create` and the changed
+        cells of existing ones, found by a columnar comparison, are written by
+        `bulk_update`. The many-to-many relations of existing trials are
+        synchronized by adding and removing links in bulk. The whole chunk
+        is written in a single transaction. Changes are recorded in the
+        journal instead of the history table when a run is given.
+
+        - Parameters
+        ============================
+        + batch:      A batch of records that willing to build objects from
+        + batch_size: Number of trials written in each query
+        + run:        The journal's update run (see `journal.start_run`)
+
+        - Return
+        ============================
+        + list : A list of primary keys of objects that have been created or updated
+    """
+    df = batch.frame.drop_duplicates(subset='nct_id', keep='last')
+    rows = batch.rows()
+    existing = existing_trials(list(df['nct_id']))
+    exists = df['nct_id'].isin(existing).to_numpy(dtype=bool)
+
+    updated = df[exists]
+    try:
+        with transaction.atomic():
+            objs = get_writer(batch_size, history=run is None, run=run).insert([r for r in rows if r['nct_id'] not in existing])  # build not exisiting ones
+            new_pk = [o.pk for o in objs]
+
+            objs = TrialComparator().update_trials(updated, existing, batch_size, run)     # updating exsiting ones
+            lookup.sync_relations(objs, {r['nct_id'] : processor.trial_relations(r) for r in rows if r['nct_id'] in existing}, batch_size)
+            updated_pk = [o.pk for o in objs]
+    except Exception:
+        lookup.cache.clear()            # the inserted lookup values are rolled back as well
+        raise
+
+    return new_pk, updated_pk
+
+
+
+def import_studies(input_path: str, batch_size=BATCH_SIZE, workers=1, resume=False, with_results=False) -> int:
+    """
+        Imports XML trials downloaded from ClinicalTrials.gov in batches
+        and reports the throughput of the import. The progress is stored
+        in a checkpoint after every batch to be able to resume the import.
+        When the journal is enabled, the import is an update run that the
+        imported trials are marked as created by.
+
+        - Parameters
+        ============================
+        + input_path:   AllPublicXML.zip or a directory of extracted XML files
+        + batch_size:   Number of studies written in each transaction
+        + workers:      Number of processes parsing the XML files
+        + resume:       Continue from the checkpoint of an interrupted import
+        + with_results: Store the participant flow and baseline of the
+                        posted results into the results tables
+
+        - Return
+        ============================
+        + int : Number of imported trials
+    """
+    source = open_source(input_path)
+    names = source.names()
+
+    checkpoint = Checkpoint(input_path, len(names))
+    if resume and not checkpoint.load():
+        print('No checkpoint found for {}, starting from the beginning'.format(input_path))
+    pending = names[checkpoint.offset:]
+    run = journal.start_run() if journal.enabled() else None
+    writer = get_writer(batch_size, history=run is None, with_results=with_results, run=run)
+
+    if workers > 1:
+        stream = parallel_parse(source, pending, workers, min(PARSE_CHUNK, batch_size), checkpoint.offset,
+                                with_results)
+    else:
+        stream = serial_parse(source, pending, batch_size, checkpoint.offset, with_results)
+
+    imported = 0
+    buffer = []
+    chunks = []
+    start = time.time()
+    with tqdm(total=len(names), initial=checkpoint.offset, unit='trial') as pbar:
+        for position, count, rows, failures in stream:
+            buffer.extend(rows)
+            chunks.append((position, count))
+            checkpoint.fail(failures)
+
+            if len(buffer) >= batch_size:
+                written = writer.write(buffer)
+                checkpoint.commit(chunks, written)
+                imported += written
+                buffer = []
+                chunks = []
+            pbar.update(count)
+            pbar.set_postfix(imported=imported, failed=len(checkpoint.failures))
+
+        written = writer.write(buffer)
+        checkpoint.commit(chunks, written)
+        imported += written
+
+    if run:
+        journal.finish_run(run, imported, 0)
+    if imported:
+        SyncState.bump(run)
+
+    elapsed = time.time() - start
+    print('Imported {:,} trials in {:.1f}s ({:.1f} trials/sec)'.format(
+            imported, elapsed, imported / elapsed if elapsed else 0))
+    if checkpoint.failures:
+        print('{:,} studies failed to be parsed, see {}'.format(len(checkpoint.failures), checkpoint.path))
+    return imported
@@ -0,0 +1,100 @@
+"""
+    Compact change journal of trials. When it is enabled by `history_journal`
+    in config.yml, update runs store only the fields that have changed (with
+    their old and new values) under the id of the run, instead of writing a
+    full copy of every trial into the history table. A trial can be rebuilt
+    as of any date by reverting the changes made after that date.
+"""
+from django.utils import timezone
+from panels.models import *
+from visual import settings
+
+
+# field of the change recorded for created trials
+CREATED_FIELD = 'nct_id'
+
+
+def enabled() -> bool:
+    return settings.HISTORY_JOURNAL
+
+
+def _text(value) -> str:
+    return None if value is None else str(value)
+
+
+def start_run() -> UpdateRun:
+    """
+        Starts a new update run, that the changes are recorded under when
+        the journal is enabled
+    """
+    return UpdateRun.objects.create()
+
+
+def finish_run(run: UpdateRun, created: int, updated: int):
+    run.finished = timezone.now()
+    run.created_count = created
+    run.updated_count = updated
+    run.save()
+
+
+def record_changes(run: UpdateRun, changes: list, trials: dict, batch_size=1000):
+    """
+        Stores a change set of an update run
+
+        - Parameters
+        ============================
+        + run:          The current update run
+        + changes:      Change set of (nct_id, field, old value, new value)
+        + trials:       Trial objects (nct_id : Trial) of the change set
+        + batch_size:   Number of rows written in each query
+    """
+    TrialChange.objects.bulk_create([TrialChange(run=run,
+                                                 trial_id=trials[nct_id].pk,
+                                                 field=field,
+                                                 old=_text(old),
+                                                 new=_text(new))
+                                        for nct_id, field, old, new in changes],
+                                    batch_size=batch_size)
+
+
+def record_created(run: UpdateRun, trials: list, batch_size=1000):
+    """
+        Marks the trials that have been created by an update run
+    """
+    TrialChange.objects.bulk_create([TrialChange(run=run, trial_id=t.pk, field=CREATED_FIELD, new=t.nct_id)
+                                        for t in trials],
+                                    batch_size=batch_size)
+
+
+def changes_of(trial: Trial):
+    """
+        Returns the recorded changes of a trial, latest first
+    """
+    return TrialChange.objects.filter(trial=trial).select_related('run').order_by('-run__started', '-pk')
+
+
+def trial_as_of(trial: Trial, date) -> dict:
+    """
+        Rebuilds the fields of a trial as they were at a given time by
+        reverting the changes recorded after it
+
+        - Parameters
+        ============================
+        + trial:    A trial object
+        + date:     A datetime to rebuild the trial at
+
+        - Return
+        ============================
+        + dict : Field name mapped to its value, or None if the trial
+                    did not exist at that time
+    """
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+
+    values = {f.name : getattr(trial, f.attname) for f in Trial._meta.concrete_fields}
+    for change in changes_of(trial).filter(run__started__gt=date):
+        if change.field == CREATED_FIELD and change.old is None:
+            return None
+        values[change.field] = Trial._meta.get_field(change.field).to_python(change.old)
+
+    return values
@@ -0,0 +1,157 @@
+"""
+    In-memory cache of the lookup tables (agents, conditions, countries
+    and sponsors) that maps their names to primary keys. Every table is
+    warmed with a single query on its first use, and the names that are
+    missing from the database are inserted in bulk. The cache is shared
+    by the import, update and comparator paths, which link the trials to
+    the lookup tables through `sync_relations`.
+"""
+from panels.models import *
+from panels.utils import tools
+
+
+# trial relation : lookup model
+RELATIONS = {
+    'agent' : Agent,
+    'condition' : Condition,
+    'countries' : Country,
+    'sponsor' : Sponsor,
+}
+
+# lookup model : fields identifying a row
+KEYS = {
+    Agent : ('name', 'type'),
+    Condition : ('name',),
+    Country : ('name',),
+    Sponsor : ('name',),
+}
+
+class LookupCache:
+    """
+        Maps the keys of lookup tables to their primary keys. Keys are
+        tuples of the `KEYS` fields of a model, while a plain value can be
+        used for models identified by their name only.
+    """
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self._tables = {}
+
+
+    def key(self, value) -> tuple:
+        return value if isinstance(value, tuple) else (value,)
+
+
+    def _fetch(self, model, names=None) -> dict:
+        """
+            Reads the keys of a table from the database. The oldest row is
+            kept when a key is duplicated.
+        """
+        query = model.objects.order_by('-pk')
+        if names is not None:
+            query = query.filter(name__in=names)
+        return {values[:-1] : values[-1] for values in query.values_list(*KEYS[model], 'pk')}
+
+
+    def table(self, model) -> dict:
+        """
+            Returns the cached mapping of a table, warming it on first use
+        """
+        if model not in self._tables:
+            self._tables[model] = self._fetch(model)
+        return self._tables[model]
+
+
+    def resolve(self, model, values) -> dict:
+        """
+            Returns the primary keys of the given keys of a lookup table and
+            inserts the keys that do not exist in the table yet
+
+            - Parameters
+            ============================
+            + model:    Lookup model (one of the `KEYS`)
+            + values:   Iterable of keys (or names)
+
+            - Return
+            ============================
+            + dict : Mapping of given keys to primary keys
+        """
+        table = self.table(model)
+        keys = {self.key(v) for v in values}
+
+        missing = [k for k in keys if k not in table]
+        if missing:
+            fields = KEYS[model]
+            model.objects.bulk_create([model(**dict(zip(fields, k))) for k in missing],
+                                        batch_size=self.batch_size)
+            for names in tools.chunks(list({k[0] for k in missing})):
+                for key, pk in self._fetch(model, names).items():
+                    table.setdefault(key, pk)
+
+        return {k : table[k] for k in keys}
+
+
+    def get(self, model, value) -> int:
+        """
+            Returns the primary key of a single key of a lookup table
+        """
+        return self.resolve(model, [value])[self.key(value)]
+
+
+    def clear(self):
+        """
+            Drops the cached tables, e.g. after a rolled back transaction
+        """
+        self._tables = {}
+
+
+
+# cache shared by every module of the process
+cache = LookupCache()
+
+
+def sync_relations(trials: list, relations: dict, batch_size=1000, existing=True) -> dict:
+    """
+        Synchronizes the many-to-many relations of a batch of trials with
+        the lookup tables. The add and remove sets of every relation are
+        computed against the current rows of its through table and applied
+        with bulk inserts and deletes.
+
+        - Parameters
+        ============================
+        + trials:       A list of saved trial objects
+        + relations:    Relations of the trials by nct_id (see `processor.trial_relations`)
+        + batch_size:   Number of rows written in each query
+        + existing:     Whether the trials may have relations already (False for new trials)
+
+        - Return
+        ============================
+        + dict : Relation name mapped to the number of (added, removed) links
+    """
+    counts = {}
+    pks = [t.pk for t in trials]
+
+    for name, model in RELATIONS.items():
+        values = {v for t in trials for v in relations[t.nct_id][name]}
+        mapping = cache.resolve(model, values) if values else {}
+
+        through = getattr(Trial, name).through
+        target = model._meta.model_name + '_id'
+        links = {(t.pk, mapping[cache.key(v)]) for t in trials for v in relations[t.nct_id][name]}
+
+        current = {}
+        if existing:
+            for chunk in tools.chunks(pks):
+                query = through.objects.filter(trial_id__in=chunk)
+                current.update(((t, o), pk) for pk, t, o in query.values_list('pk', 'trial_id', target))
+
+        added = [link for link in links if link not in current]
+        removed = [pk for link, pk in current.items() if link not in links]
+
+        through.objects.bulk_create([through(**{'trial_id': t, target: o}) for t, o in added],
+                                    batch_size=batch_size)
+        for chunk in tools.chunks(removed):
+            through.objects.filter(pk__in=chunk).delete()
+
+        counts[name] = (len(added), len(removed))
+
+    return counts
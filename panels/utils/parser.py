@@ -1,6 +1,6 @@
-import bs4
-from bs4 import BeautifulSoup
+from functools import partial
 from lxml import etree as etree_lxml
+from panels.utils.record import *
 
 
 ARRAY_FIELDS = [
@@ -22,17 +22,84 @@ ARRAY_FIELDS = [
 ]
 
 
+# record field : name of the API field holding it (the first one in the study)
+FULL_STUDY_FIELDS = {
+    'nct_id' : 'NCTId',
+    'status' : 'OverallStatus',
+    'allocation' : 'DesignAllocation',
+    'primary_purpose' : 'DesignPrimaryPurpose',
+    'protocol' : 'OrgStudyId',
+    'official_title' : 'OfficialTitle',
+    'brief_title' : 'BriefTitle',
+    'first_posted' : 'StudyFirstPostDate',
+    'start_date' : 'StartDate',
+    'last_update' : 'LastUpdatePostDate',
+    'primary_completion' : 'PrimaryCompletionDate',
+    'completion_date' : 'CompletionDate',
+    'brief_summary' : 'BriefSummary',
+    'description' : 'DetailedDescription',
+    'criteria' : 'EligibilityCriteria',
+    'enrollment' : 'EnrollmentCount',
+    'lead_sponsor' : 'LeadSponsorName',
+    'lead_sponsor_type' : 'LeadSponsorClass',
+    'min_age' : 'MinimumAge',
+    'max_age' : 'MaximumAge',
+    'gender' : 'Gender',
+}
+
+# (record child list, struct name, child type, API fields of the child),
+# a child is read from every struct of that name
+FULL_STUDY_LISTS = [
+    ('agents', 'Intervention', AgentRecord, 
+        ('InterventionName', 'InterventionType', 'InterventionDescription')),
+    ('outcomes', 'PrimaryOutcome', partial(OutcomeRecord, PRIMARY),
+        ('PrimaryOutcomeMeasure', 'PrimaryOutcomeTimeFrame', 'PrimaryOutcomeDescription')),
+    ('outcomes', 'SecondaryOutcome', partial(OutcomeRecord, SECONDARY),
+        ('SecondaryOutcomeMeasure', 'SecondaryOutcomeTimeFrame', 'SecondaryOutcomeDescription')),
+    ('outcomes', 'OtherOutcome', partial(OutcomeRecord, OTHER),
+        ('OtherOutcomeMeasure', 'OtherOutcomeTimeFrame', 'OtherOutcomeDescription')),
+    ('locations', 'Location', LocationRecord,
+        ('LocationFacility', 'LocationCity', 'LocationState', 'LocationCountry', 'LocationZip')),
+]
+
+
 class FullStudyParser:
     """
         A class to parse FullStudy API XML content from the Clinicaltrials.gov
         API and apply required actions on it.
+
+        The fields are read through the FULL_STUDY_FIELDS and
+        FULL_STUDY_LISTS mappings out of an index of the fields and structs
+        of the protocol section by name, built in a single walk over it.
+        Field names are unique in the API, so the first field of a name is
+        the one a `.//Field[@Name="..."]` search would find. The parsed
+        trial is a `record.TrialRecord` in `record`.
     """
+
     def __init__(self, xml):
         self.xml = xml
         self.tree = etree_lxml.fromstring(xml)
         
-        self.data = self._parse()
-        self.data['LocationsString'] = self.get_formatted_locations()
+        self.record = self._parse()
+
+
+    @classmethod
+    def from_cache(cls, cache, nct_id: str, last_update: str):
+        """
+            Replays a response stored in the raw response cache offline
+
+            - Parameters
+            ============================
+            + cache:        A rawcache.ResponseCache object
+            + nct_id:       Trials nct_id
+            + last_update:  Last update date of the cached version
+
+            - Return
+            ============================
+            + FullStudyParser : Parser of the cached response or None if it is not cached
+        """
+        content = cache.get(nct_id, last_update)
+        return cls(content) if content else None
 
 
     def _get_text(self, xpath: str) -> str:
@@ -47,120 +114,61 @@ class FullStudyParser:
             return None
 
 
-    def _parse(self):
+    @staticmethod
+    def _index(node) -> tuple:
         """
-            Parses the XML data into a dictionary
+            Indexes the fields and structs under a node by their names
 
             - Return
             ============================
-            + dict : A dictionary of parsed data
+            + tuple : (field name : [Field elements], struct name : [Struct elements])
         """
-        data = {}
+        fields, structs = {}, {}
+        for element in node.iter('Field', 'Struct'):
+            index = fields if element.tag == 'Field' else structs
+            index.setdefault(element.get('Name'), []).append(element)
+        return fields, structs
 
-        data['NCTID'] = self.tree.findtext('.//Field[@Name="NCTId"]')
-        data['Phase'] = '|'.join([p.text for p in self.tree.findall('.//Field[@Name="Phase"]')])
-        data['Status'] = self.tree.findtext('.//Field[@Name="OverallStatus"]')
 
+    @staticmethod
+    def _text(fields: dict, name: str) -> str:
+        """
+            Returns the text of the first field of a name, like `findtext`
+            ('' for an empty field and None for a missing one)
+        """
+        found = fields.get(name)
+        return (found[0].text or '') if found else None
 
-        data['StudyDesign'] = {}
-        data['StudyDesign']['Allocation'] = self.tree.findtext('.//Field[@Name="DesignAllocation"]')
-        data['StudyDesign']['PrimaryPurpose'] = self.tree.findtext('.//Field[@Name="DesignPrimaryPurpose"]')
-
-        data['Agents'] = []
-        for intervention in self.tree.findall('.//List[@Name="InterventionList"]/Struct[@Name="Intervention"]'):
-            data['Agents'].append({
-                'Name' : intervention.findtext('.//Field[@Name="InterventionName"]'),
-                'Type' : intervention.findtext('.//Field[@Name="InterventionType"]'),
-                'Description' : intervention.findtext('.//Field[@Name="InterventionDescription"]'),
-            })
-
-        data['Conditions'] = [c.text for c in self.tree.findall('.//List[@Name="ConditionList"]/Field[@Name="Condition"]')]
-        data['Protocol'] = self.tree.findtext('.//Field[@Name="OrgStudyId"]')
-        data['Title'] = self.tree.findtext('.//Field[@Name="OfficialTitle"]') or self.tree.findtext('.//Field[@Name="BriefTitle"]')
-        
-        data['Date'] = {
-            'FirstPosted' : {},
-            'Start' : {},
-            'LastUpdate' : {},
-            'PrimaryCompletion' : {},
-            'Completion' : {},
-        }
-        data['Date']['FirstPosted'] = self.tree.findtext('.//Field[@Name="StudyFirstPostDate"]')
-        data['Date']['Start'] = self.tree.findtext('.//Field[@Name="StartDate"]')
-        data['Date']['LastUpdate'] = self.tree.findtext('.//Field[@Name="LastUpdatePostDate"]')
-        data['Date']['PrimaryCompletion'] = self.tree.findtext('.//Field[@Name="PrimaryCompletionDate"]')
-        data['Date']['Completion'] = self.tree.findtext('.//Field[@Name="CompletionDate"]')
-        data['Summary'] = {
-            'Brief' : {},
-            'Detailed' : {},
-        }
-        data['Summary']['Brief'] = self.tree.findtext('.//Field[@Name="BriefSummary"]'),
-        data['Summary']['Detailed'] = self.tree.findtext('.//Field[@Name="DetailedDescription"]'),
-
-        data['Outcome'] = {
-            'Primary' : [],
-            'Secondary' : [],
-            'Other' : [],
-        }
-        for primary in self.tree.findall('.//List[@Name="PrimaryOutcomeList"]/Struct[@Name="PrimaryOutcome"]'):
-            data['Outcome']['Primary'].append({
-                'Measure' : primary.findtext('.//Field[@Name="PrimaryOutcomeMeasure"]'),
-                'TimeFrame' : primary.findtext('.//Field[@Name="PrimaryOutcomeTimeFrame"]'),
-                'Description' : primary.findtext('.//Field[@Name="PrimaryOutcomeDescription"]'),
-            })
-        
-        for secondary in self.tree.findall('.//List[@Name="SecondaryOutcomeList"]/Struct[@Name="SecondaryOutcome"]'):
-            data['Outcome']['Secondary'].append({
-                'Measure' : secondary.findtext('.//Field[@Name="SecondaryOutcomeMeasure"]'),
-                'TimeFrame' : secondary.findtext('.//Field[@Name="SecondaryOutcomeTimeFrame"]'),
-                'Description' : secondary.findtext('.//Field[@Name="SecondaryOutcomeDescription"]'),
-            })
-
-        for other in self.tree.findall('.//List[@Name="OtherOutcomeList"]/Struct[@Name="OtherOutcome"]'):
-            data['Outcome']['Other'].append({
-                'Measure' : other.findtext('.//Field[@Name="OtherOutcomeMeasure"]'),
-                'TimeFrame' : other.findtext('.//Field[@Name="OtherOutcomeTimeFrame"]'),
-                'Description' : other.findtext('.//Field[@Name="OtherOutcomeDescription"]'),
-            })
 
-        data['Criteria'] = self.tree.findtext('.//Field[@Name="EligibilityCriteria"]')
-        data['Enrollment'] = self.tree.findtext('.//Field[@Name="EnrollmentCount"]')
-        data['ArmsNumber'] = len(self.tree.findall('.//Struct[@Name="ArmGroup"]'))
-
-        data['Sponsors'] = {}
-        data['Sponsors']['Lead'] = {
-            'Name' : self.tree.findtext('.//Field[@Name="LeadSponsorName"]'),
-            'Type' : self.tree.findtext('.//Field[@Name="LeadSponsorClass"]'),
-        }
-        data['Sponsors']['All'] = [data['Sponsors']['Lead']]
-        for colab in self.tree.findall('.//List[@Name="CollaboratorList"]/Field[@Name="Collaborator"]'):
-            data['Sponsors']['All'].append({
-                'Name' : colab.findtext('.//Field[@Name="CollaboratorName"]'),
-                'Type' : colab.findtext('.//Field[@Name="CollaboratorClass"]'),
-            })
+    def _parse(self) -> TrialRecord:
+        """
+            Parses the XML data into a record
 
-        data['Age'] = {
-            'Min' : self.tree.findtext('.//Field[@Name="MinimumAge"]'),
-            'Max' : self.tree.findtext('.//Field[@Name="MaximumAge"]'),
-        }
-
-        data['Gender'] = self.tree.findtext('.//Field[@Name="Gender"]')
-
-        data['Locations'] = []
-        for loc in self.tree.findall('.//List[@Name="LocationList"]/Struct[@Name="Location"]'):
-            information = {
-                'Name'  : loc.findtext('.//Field[@Name="LocationFacility"]'),
-                'City'  : loc.findtext('.//Field[@Name="LocationCity"]'),
-                'State'  : loc.findtext('.//Field[@Name="LocationState"]'),
-                'Country'  : loc.findtext('.//Field[@Name="LocationCountry"]'),
-                'ZipCode'  : loc.findtext('.//Field[@Name="LocationZip"]'),
-            }
-            data['Locations'].append(information)
+            - Return
+            ============================
+            + TrialRecord : The parsed trial
+        """
+        section = self.tree.find('.//Struct[@Name="ProtocolSection"]')
+        fields, structs = self._index(section if section is not None else self.tree)
 
-        data['Countries'] = set([f['Country'] for f in data['Locations'] if f['Country'] != None])
+        values = {key : self._text(fields, name) for key, name in FULL_STUDY_FIELDS.items()}
+        official, brief = values.pop('official_title'), values.pop('brief_title')
+        values['title'] = official or brief
+        values['phase'] = '|'.join([p.text for p in fields.get('Phase', [])])
+        values['conditions'] = [c.text for c in fields.get('Condition', [])]
+        values['arms_number'] = len(structs.get('ArmGroup', []))
+        values['has_results'] = False
 
+        for key, struct_name, child, names in FULL_STUDY_LISTS:
+            items = values.setdefault(key, [])
+            for struct in structs.get(struct_name, []):
+                struct_fields = {}
+                for field in struct.iter('Field'):
+                    struct_fields.setdefault(field.get('Name'), field)
+                items.append(child(*[(struct_fields[name].text or '') if name in struct_fields else None
+                                        for name in names]))
 
-        return data
+        return TrialRecord(**values).finish()
 
 
     def _preprocess_data(self, data):
@@ -212,173 +220,77 @@ class FullStudyParser:
             Returns the locations in a formatted string:
                 Name, City, State, Country
         """
-        result = []
-        for l in self.data['Locations']:
-            addr = ', '.join([v for k,v in l.items() if v != None and k != 'Status'])
-            result.append(addr)
-            
-        return '\n'.join(result)
+        return self.record.location_str
 
 
 
-class XMLParser:
+class XMLFastParser:
     """
-        A class to the XML data downloaded from clinicaltrials.gov
-        and build the corresponding Trial object to insert or update
-        instances in the database
+        A class to parse the XML studies of the ClinicalTrials.gov dump
+        (AllPublicXML). The results section of a study is not parsed with
+        the rest of it, but on the first access to `results`. It is cut
+        out of the document before the tree is built, as it is often the
+        larger part of a study with posted results.
     """
+    RESULTS_TAGS = ('<clinical_results>', '</clinical_results>')
 
     def __init__(self, xml: str):
         self.xml = xml
-        self.soup = BeautifulSoup(xml, 'lxml')
-        self.data = self._parse()
-        self.data['LocationsString'] = self.get_formatted_locations()
-
-    
-    def _tag_value(self, tag: str, node: bs4.element.Tag = None) -> str:
+        self._results_node = None
+        self._results_xml = None
+        self._results = None
+        try:
+            self.tree = etree_lxml.fromstring(self._cut_results(xml))
+        except etree_lxml.XMLSyntaxError:
+            # the cut was wrong, the section is found by its handler instead
+            self._results_xml = None
+            self.tree = etree_lxml.fromstring(xml)
+        self.record = self._parse()
+
+
+    def _cut_results(self, xml):
         """
-            Retrieving value for a tag if the tag exists in the XML
+            Returns the document without its results section and keeps
+            the section in `_results_xml`. The document is returned as is
+            unless both tags are found exactly once, and the section is
+            then read by the `clinical_results` handler.
         """
-        if not node:
-            node = self.soup
-
-        if node.find(tag):
-            return node.find(tag).text
-        else:
-            return None
-
-
-    def _parse(self) -> dict:
+        start, end = self.RESULTS_TAGS
+        if isinstance(xml, bytes):
+            start, end = start.encode(), end.encode()
+        i = xml.find(start)
+        j = xml.rfind(end)
+        if i < 0 or j < i or xml.find(start, i + 1) >= 0 or xml.find(end) != j:
+            return xml
+        j += len(end)
+        self._results_xml = xml[i:j]
+        return xml[:i] + xml[j:]
+
+
+    @property
+    def results(self) -> dict:
         """
-            The main function to yield resutls from the read XML file
-        """
-        data = {}
-
-        data['NCTID'] = self.soup.nct_id.text
-        data['Phase'] = self._tag_value('phase')
-        data['Status'] = self.soup.overall_status.text
-
-        data['StudyDesign'] = {}
-        data['StudyDesign']['Allocation'] = self._tag_value('allocation')
-        data['StudyDesign']['PrimaryPurpose'] = self._tag_value('primary_purpose')
+            The participant flow and baseline of the results section, that
+            are parsed on the first access
 
-        data['Agents'] = []
-        for intervention in self.soup.find_all('intervention'):
-            data['Agents'].append({
-                'Name' : intervention.intervention_name.text,
-                'Type' : intervention.intervention_type.text,
-                'Description' : self._tag_value('description', intervention),
-            })
-
-        data['Conditions'] = [c.get_text() for c in self.soup.find_all('condition')]
-        data['Protocol'] = self._tag_value('org_study_id')
-        data['Title'] = self._tag_value('official_title') or self._tag_value('brief_title')
-        
-        data['Date'] = {
-            'FirstPosted' : {},
-            'Start' : {},
-            'LastUpdate' : {},
-            'PrimaryCompletion' : {},
-            'Completion' : {},
-        }
-        data['Date']['FirstPosted'] = self.soup.study_first_posted.text
-        data['Date']['Start'] = self._tag_value('start_date')
-        data['Date']['LastUpdate'] = self.soup.last_update_submitted.text
-        data['Date']['PrimaryCompletion'] = self._tag_value('primary_completion_date')
-        data['Date']['Completion'] = self._tag_value('completion_date')
-        data['Summary'] = {
-            'Brief' : {},
-            'Detailed' : {},
-        }
-        data['Summary']['Brief'] = self._tag_value('brief_summary'),
-        data['Summary']['Detailed'] = self._tag_value('detailed_description'),
-
-        data['Outcome'] = {
-            'Primary' : [],
-            'Secondary' : [],
-            'Other' : [],
-        }
-        for primary in self.soup.find_all('primary_outcome'):
-            data['Outcome']['Primary'].append({
-                'Measure' : self._tag_value('measure', primary),
-                'TimeFrame' : self._tag_value('time_frame', primary),
-                'Description' : self._tag_value('description', primary),
-            })
-        
-        for secondary in self.soup.find_all('secondary_outcome'):
-            data['Outcome']['Secondary'].append({
-                'Measure' : self._tag_value('measure', secondary),
-                'TimeFrame' : self._tag_value('time_frame', secondary),
-                'Description' : self._tag_value('description', secondary),
-            })
-
-        for other in self.soup.find_all('other_outcome'):
-            data['Outcome']['Other'].append({
-                'Measure' : self._tag_value('measure', other),
-                'TimeFrame' : self._tag_value('time_frame', other),
-                'Description' : self._tag_value('description', other),
-            })
-
-        data['Criteria'] = self._tag_value('textblock', self.soup.criteria) 
-        data['Enrollment'] = self._tag_value('enrollment')
-        data['ArmsNumber'] = self.soup.number_of_arms.text if self.soup.number_of_arms else None
-
-        data['Sponsors'] = { 'All' : [] }
-        for spon in self.soup.sponsors.children:
-            if spon.name:
-                data['Sponsors']['All'].append({
-                    'Name' : self._tag_value('agency', spon),
-                    'Type' : self._tag_value('agency_class', spon),
-                })
-                if spon.name == 'lead_sponsor':
-                    data['Sponsors']['Lead'] = {'Name': self._tag_value('agency', spon), 'Type': self._tag_value('agency_class', spon)}
-
-        data['Age'] = {
-            'Min' : self._tag_value('minimum_age'),
-            'Max' : self._tag_value('maximum_age'),
-        }
-
-        data['Gender'] = self._tag_value('gender')
-
-        data['Locations'] = []
-        for loc in self.soup.find_all('location'):
-            if loc.find('facility'):
-                facility = loc.facility
-                information = {
-                    'Name'  : self._tag_value('name', facility.address),
-                    'City'  : self._tag_value('city', facility.address),
-                    'State'  : self._tag_value('state', facility.address),
-                    'Country'  : self._tag_value('country', facility.address),
-                    'Status': self._tag_value('status', loc),
-                }
-                data['Locations'].append(information)
-
-        data['Countries'] = set([f['Country'] for f in data['Locations'] if f['Country'] != None])
-
-        return data
-
-
-    def get_formatted_locations(self):
-        """
-            Returns the locations in a formatted string:
-                Name, City, State, Country
+            - Return
+            ============================
+            + dict : {'Flow' : {'Groups', 'TimePeriods'}, 'Baseline' : {'Groups', 'Analyzed', 'Measure'}}
         """
-        result = []
-        for l in self.data['Locations']:
-            addr = ', '.join([v for k,v in l.items() if v != None and k != 'Status'])
-            result.append(addr)
-            
-        return '\n'.join(result)
-
-
-
-class XMLFastParser:
-    def __init__(self, xml: str):
-        self.xml = xml
-        self.tree = etree_lxml.fromstring(xml)
-        self.data = self._parse()
-        self.data['LocationsString'] = self.get_formatted_locations()
-
+        if self._results is None:
+            self._results = {
+                'Flow' : {'Groups' : {}, 'TimePeriods' : {}},
+                'Baseline' : {'Groups' : [], 'Analyzed' : [], 'Measure' : []},
+            }
+            if self._results_node is None and self._results_xml is not None:
+                self._results_node = etree_lxml.fromstring(self._results_xml)
+            if self._results_node is not None:
+                for child in self._results_node:
+                    if child.tag == 'participant_flow':
+                        self._participant_flow(self._results['Flow'], child)
+                    elif child.tag == 'baseline':
+                        self._baseline(self._results['Baseline'], child)
+        return self._results
 
 
     def _get_text(self, xpath: str) -> str:
@@ -393,209 +305,265 @@ class XMLFastParser:
             return None
 
     
-    def _parse(self):
+    def _parse(self) -> TrialRecord:
         """
-            Parses the XML data into a dictionary
+            Parses the XML data into a record. The document is walked
+            once: every top level tag is dispatched to its handler in
+            `HANDLERS`, that reads the fields out of the children of the
+            tag, instead of searching the whole tree for each field.
 
             - Return
             ============================
-            + dict : A dictionary of parsed data
+            + TrialRecord : The parsed trial
+        """
+        record = TrialRecord(arms_number=0, has_results=self._results_xml is not None)
+        # tags of the single value fields already read, as only the
+        # first occurrence of a tag in the document is kept
+        seen = set()
+        titles = {}
+
+        for element in self.tree:
+            tag = element.tag
+            handler = self.HANDLERS.get(tag)
+            if handler:
+                handler(self, record, element, seen)
+            elif tag in self.TEXT_FIELDS and tag not in seen:
+                seen.add(tag)
+                setattr(record, self.TEXT_FIELDS[tag], element.text or '')
+            elif tag in ('official_title', 'brief_title'):
+                titles.setdefault(tag, element.text or '')
+
+        record.title = titles.get('official_title') or titles.get('brief_title')
+        return record.finish()
+
+
+    @staticmethod
+    def _texts(element) -> dict:
         """
-        data = {}
+            Returns the text of the first child of each tag of the element,
+            like `findtext` ('' for an empty tag), in a single pass over
+            the children
+        """
+        texts = {}
+        for child in element:
+            tag = child.tag
+            if tag not in texts:
+                texts[tag] = child.text or ''
+        return texts
 
-        data['NCTID'] = self.tree.findtext('.//nct_id')
-        data['Phase'] = self.tree.findtext('.//phase')
-        data['Status'] = self.tree.findtext('.//overall_status')
 
+    @staticmethod
+    def _first(record: TrialRecord, field: str, texts: dict, tag: str, seen: set):
+        """
+            Sets a field to the text of a child tag, if the field has not
+            been read from an earlier tag yet
+        """
+        if tag in texts and tag not in seen:
+            seen.add(tag)
+            setattr(record, field, texts[tag])
 
-        data['StudyDesign'] = {}
-        data['StudyDesign']['Allocation'] = self.tree.findtext('.//allocation')
-        data['StudyDesign']['PrimaryPurpose'] = self.tree.findtext('.//primary_purpose')
 
-        data['StudyType'] = self.tree.findtext('.//study_type')
+    def _id_info(self, record, element, seen):
+        texts = self._texts(element)
+        self._first(record, 'nct_id', texts, 'nct_id', seen)
+        self._first(record, 'protocol', texts, 'org_study_id', seen)
 
-        data['Agents'] = []
-        for intervention in self.tree.findall('.//intervention'):
-            data['Agents'].append({
-                'Name' : intervention.findtext('.//intervention_name'),
-                'Type' : intervention.findtext('.//intervention_type'),
-                'Description' : intervention.findtext('.//description'),
-            })
 
-        data['Conditions'] = [c.text for c in self.tree.findall('.//condition')]
-        data['Protocol'] = self.tree.findtext('.//org_study_id')
-        data['Title'] = self.tree.findtext('.//official_title') or self.tree.findtext('.//brief_title')
-        
-        data['Date'] = {
-            'FirstPosted' : {},
-            'Start' : {},
-            'LastUpdate' : {},
-            'PrimaryCompletion' : {},
-            'Completion' : {},
-        }
-        data['Date']['FirstPosted'] = self.tree.findtext('.//study_first_posted')
-        data['Date']['Start'] = self.tree.findtext('.//start_date')
-        data['Date']['LastUpdate'] = self.tree.findtext('.//last_update_submitted')
-        data['Date']['PrimaryCompletion'] = self.tree.findtext('.//primary_completion_date')
-        data['Date']['Completion'] = self.tree.findtext('.//completion_date')
-
-        data['Summary'] = {
-            'Brief' : {},
-            'Detailed' : {},
-        }
-        data['Summary']['Brief'] = self.tree.findtext('.//brief_summary/textblock'),
-        data['Summary']['Detailed'] = self.tree.findtext('.//detailed_description/textblock'),
-
-        data['Outcome'] = {
-            'Primary' : [],
-            'Secondary' : [],
-            'Other' : [],
-        }
-        for primary in self.tree.findall('.//primary_outcome'):
-            data['Outcome']['Primary'].append({
-                'Measure' : primary.findtext('.//measure'),
-                'TimeFrame' : primary.findtext('.//time_frame'),
-                'Description' : primary.findtext('.//description'),
-            })
-        
-        for secondary in self.tree.findall('.//secondary_outcome'):
-            data['Outcome']['Secondary'].append({
-                'Measure' : secondary.findtext('.//measure'),
-                'TimeFrame' : secondary.findtext('.//time_frame'),
-                'Description' : secondary.findtext('.//description'),
-            })
+    def _study_design(self, record, element, seen):
+        texts = self._texts(element)
+        self._first(record, 'allocation', texts, 'allocation', seen)
+        self._first(record, 'primary_purpose', texts, 'primary_purpose', seen)
 
-        for other in self.tree.findall('.//other_outcome'):
-            data['Outcome']['Other'].append({
-                'Measure' : other.findtext('.//measure'),
-                'TimeFrame' : other.findtext('.//time_frame'),
-                'Description' : other.findtext('.//description'),
-            })
 
-        data['Criteria'] = self.tree.findtext('.//criteria/textblock')
-        data['Enrollment'] = self.tree.findtext('.//enrollment')
-        
-        data['ArmGroups'] = []
-        for arm in self.tree.findall('.//arm_group'):
-            data['ArmGroups'].append({
-                'Label' : arm.findtext('.//arm_group_label'),
-                'Type'  : arm.findtext('.//arm_group_type'),
-            })
-        data['ArmsNumber'] = len(data['ArmGroups'])
-
-        data['Sponsors'] = {}
-        data['Sponsors']['Lead'] = {
-            'Name' : self.tree.findtext('.//sponsors/lead_sponsor/agency'),
-            'Type' : self.tree.findtext('.//sponsors/lead_sponsor/agency_class'),
-        }
-        data['Sponsors']['All'] = [data['Sponsors']['Lead']]
-        for colab in self.tree.findall('.//List[@Name="CollaboratorList"]/Field[@Name="Collaborator"]'):
-            data['Sponsors']['All'].append({
-                'Name' : colab.findtext('.//Field[@Name="CollaboratorName"]'),
-                'Type' : colab.findtext('.//Field[@Name="CollaboratorClass"]'),
-            })
+    def _textblock(self, record, element, seen):
+        if element.tag not in seen:
+            seen.add(element.tag)
+            field = 'brief_summary' if element.tag == 'brief_summary' else 'description'
+            setattr(record, field, self._texts(element).get('textblock'))
 
-        data['Age'] = {
-            'Min' : self.tree.findtext('.//minimum_age'),
-            'Max' : self.tree.findtext('.//maximum_age'),
-        }
-
-        data['Gender'] = self.tree.findtext('.//gender')
-
-        data['Locations'] = []
-        for loc in self.tree.findall('.//location'):
-            information = {
-                'Name'  : loc.findtext('.//facility/name'),
-                'City'  : loc.findtext('.//facility/address/city'),
-                'State'  : loc.findtext('.//facility/address/state'),
-                'Country'  : loc.findtext('.//facility/address/country'),
-                'ZipCode'  : loc.findtext('.//facility/address/zip'),
-            }
-            data['Locations'].append(information)
 
-        data['Countries'] = set([f['Country'] for f in data['Locations'] if f['Country'] != None])
+    def _intervention(self, record, element, seen):
+        texts = self._texts(element)
+        record.agents.append(AgentRecord(texts.get('intervention_name'),
+                                         texts.get('intervention_type'),
+                                         texts.get('description')))
 
-        data['Keywords'] = [t.text for t in self.tree.findall('.//keyword')]
-        data['ConditionMesh'] = [m.text for m in self.tree.findall('.//condition_browse/mesh_term')]
-        data['InterventionMesh'] = [m.text for m in self.tree.findall('.//intervention_browse/mesh_term')]
 
-        data['HasResults'] = self.tree.find('.//clinical_results') != None
-        
-        data['Result'] = {}
-        data['Result']['Flow'] = {}
-
-        data['Result']['Flow']['Groups'] = {}
-        for group in self.tree.findall('.//participant_flow/group_list/group'):
-            data['Result']['Flow']['Groups'][group.get('group_id')] = {
-                'title' : group.findtext('.//title'),
-                'description' : group.findtext('.//description'),
-            }
+    def _condition(self, record, element, seen):
+        record.conditions.append(element.text)
 
-        
-        # Time Periods
-        data['Result']['Flow']['TimePeriods'] = {}
-        for period in self.tree.findall('.//participant_flow/period_list/period'):
-            milestones = {}
-            for milestone in period.findall('.//milestone_list/milestone'):
-                title = milestone.findtext('.//title')
-                participants = {}
-                for p in milestone.findall('.//participants_list/participants'):
-                    participants[p.get('group_id')] = p.get('count')
-                milestones[title] = participants
 
-            data['Result']['Flow']['TimePeriods'][period.findtext('.//title')] = milestones
+    def _outcome(self, record, element, seen):
+        texts = self._texts(element)
+        record.outcomes.append(OutcomeRecord(self.OUTCOMES[element.tag],
+                                             texts.get('measure'),
+                                             texts.get('time_frame'),
+                                             texts.get('description')))
 
 
-        # Baseline
-        data['Result']['Baseline'] = {}
+    def _eligibility(self, record, element, seen):
+        texts = self._texts(element)
+        self._first(record, 'gender', texts, 'gender', seen)
+        self._first(record, 'min_age', texts, 'minimum_age', seen)
+        self._first(record, 'max_age', texts, 'maximum_age', seen)
+        if 'criteria' in texts and 'criteria' not in seen:
+            seen.add('criteria')
+            record.criteria = self._texts(element.find('criteria')).get('textblock')
 
-        data['Result']['Baseline']['Groups'] = []
-        for group in self.tree.findall('.//baseline/group_list/group'):
-            gp = {
-                'id' : p.get('group_id'),
-                'title' : group.findtext('.//title'),
-                'description' : group.findtext('.//description'),
-            }
-            data['Result']['Baseline']['Groups'].append(gp)
 
+    def _arm_group(self, record, element, seen):
+        record.arms_number += 1
 
-        data['Result']['Baseline']['Analyzed'] = []
-        for analyzed in self.tree.findall('.//baseline/analyzed_list/analyzed'):
-            a = {
-                'unit' : analyzed.findtext('.//units'),
-                'scope' : analyzed.findtext('.//scope'),
-                'counts' : {c.get('group_id') : c.get('value')  for c in analyzed.findall('.//count_list/count')},
-            }
-            data['Result']['Baseline']['Analyzed'].append(a)
 
-        
-        data['Result']['Baseline']['Measure'] = []
-        for measure in self.tree.findall('.//baseline/measure_list/measure'):
-            m = {
-                'title' : measure.findtext('.//title'),
-                'units' : measure.findtext('.//units'),
-                'param' : measure.findtext('.//param'),
-                'dispersion' : measure.findtext('.//dispersion'),
+    def _sponsors(self, record, element, seen):
+        lead = element.find('lead_sponsor')
+        if lead is not None:
+            texts = self._texts(lead)
+            self._first(record, 'lead_sponsor', texts, 'agency', seen)
+            self._first(record, 'lead_sponsor_type', texts, 'agency_class', seen)
+
+
+    def _location(self, record, element, seen):
+        information = dict.fromkeys(LocationRecord._fields)
+        # the facility name and address are the only tags of a location
+        # with these names, so they are collected in one filtered walk
+        for node in element.iter(self.ADDRESS_TAGS):
+            key = self.ADDRESS[node.tag]
+            if information[key] is None:
+                information[key] = node.text or ''
+        record.locations.append(LocationRecord(**information))
+
+
+    def _keyword(self, record, element, seen):
+        record.keywords.append(element.text)
+
+
+    def _browse(self, record, element, seen):
+        mesh = record.condition_mesh if element.tag == 'condition_browse' else record.intervention_mesh
+        mesh += [m.text for m in element.iterchildren('mesh_term')]
+
+
+    def _clinical_results(self, record, element, seen):
+        record.has_results = True
+        self._results_node = element            # parsed by `results` when it is needed
+
+
+    @staticmethod
+    def _iterpath(element, *tags):
+        """
+            Yields the elements at a path of child tags under the element,
+            like `iterfind('a/b')` without evaluating the path
+        """
+        if not tags:
+            yield element
+            return
+        for child in element.iterchildren(tags[0]):
+            yield from XMLFastParser._iterpath(child, *tags[1:])
+
+
+    def _participant_flow(self, flow, element):
+        for group in self._iterpath(element, 'group_list', 'group'):
+            texts = self._texts(group)
+            flow['Groups'][group.get('group_id')] = {
+                'title' : texts.get('title'),
+                'description' : texts.get('description'),
             }
+
+        # Time Periods
+        for period in self._iterpath(element, 'period_list', 'period'):
+            milestones = {}
+            for milestone in self._iterpath(period, 'milestone_list', 'milestone'):
+                milestones[self._texts(milestone).get('title')] = {p.get('group_id') : p.get('count')
+                                    for p in self._iterpath(milestone, 'participants_list', 'participants')}
+            flow['TimePeriods'][self._texts(period).get('title')] = milestones
+
+
+    def _baseline(self, baseline, element):
+        for group in self._iterpath(element, 'group_list', 'group'):
+            texts = self._texts(group)
+            baseline['Groups'].append({
+                'id' : group.get('group_id'),
+                'title' : texts.get('title'),
+                'description' : texts.get('description'),
+            })
+
+        for analyzed in self._iterpath(element, 'analyzed_list', 'analyzed'):
+            texts = self._texts(analyzed)
+            baseline['Analyzed'].append({
+                'unit' : texts.get('units'),
+                'scope' : texts.get('scope'),
+                'counts' : {c.get('group_id') : c.get('value')
+                                for c in self._iterpath(analyzed, 'count_list', 'count')},
+            })
+
+        for measure in self._iterpath(element, 'measure_list', 'measure'):
+            texts = self._texts(measure)
             measurements = {}
-            for category in measure.findall('.//category_list/category'):
-                title = category.findtext('.//title')
-                values = []
-                for mea in category.findall('.//measurement'):
-                    values.append({
+            for category in measure.iter('category'):
+                measurements[self._texts(category).get('title')] = [{
                         'group_id' : mea.get('group_id'),
                         'value' : mea.get('value'),
                         'lower_limit' : mea.get('lower_limit'),
                         'upper_limit' : mea.get('upper_limit'),
-                    })
-                measurements[title] = values
-
-            m['Measurements'] = measurements
-
-            data['Result']['Baseline']['Measure'].append(m)
+                    } for mea in category.iter('measurement')]
+
+            baseline['Measure'].append({
+                'title' : texts.get('title'),
+                'units' : texts.get('units'),
+                'param' : texts.get('param'),
+                'dispersion' : texts.get('dispersion'),
+                'Measurements' : measurements,
+            })
 
 
-        return data
+    # top level tag : record field holding its text
+    TEXT_FIELDS = {
+        'phase' : 'phase',
+        'overall_status' : 'status',
+        'study_type' : 'study_type',
+        'enrollment' : 'enrollment',
+        'study_first_posted' : 'first_posted',
+        'start_date' : 'start_date',
+        'last_update_submitted' : 'last_update',
+        'primary_completion_date' : 'primary_completion',
+        'completion_date' : 'completion_date',
+    }
+
+    ADDRESS = {
+        'name' : 'name',
+        'city' : 'city',
+        'state' : 'state',
+        'country' : 'country',
+        'zip' : 'zip_code',
+    }
+    ADDRESS_TAGS = tuple(ADDRESS)
+
+    OUTCOMES = {
+        'primary_outcome' : PRIMARY,
+        'secondary_outcome' : SECONDARY,
+        'other_outcome' : OTHER,
+    }
+
+    # top level tag : handler reading the fields out of it
+    HANDLERS = {
+        'id_info' : _id_info,
+        'study_design_info' : _study_design,
+        'brief_summary' : _textblock,
+        'detailed_description' : _textblock,
+        'intervention' : _intervention,
+        'condition' : _condition,
+        'primary_outcome' : _outcome,
+        'secondary_outcome' : _outcome,
+        'other_outcome' : _outcome,
+        'eligibility' : _eligibility,
+        'arm_group' : _arm_group,
+        'sponsors' : _sponsors,
+        'location' : _location,
+        'keyword' : _keyword,
+        'condition_browse' : _browse,
+        'intervention_browse' : _browse,
+        'clinical_results' : _clinical_results,
+    }
 
 
     def _preprocess_data(self, data):
@@ -647,9 +615,4 @@ class XMLFastParser:
             Returns the locations in a formatted string:
                 Name, City, State, Country
         """
-        result = []
-        for l in self.data['Locations']:
-            addr = ', '.join([v for k,v in l.items() if v != None and k != 'Status'])
-            result.append(addr)
-            
-        return '\n'.join(result)
+        return self.record.location_str
@@ -27,11 +27,20 @@ class Plotter:
             self.domain = Trial.objects.all()
 
 
+    def _outdated(self, last_modified: datetime) -> bool:
+        """
+            Checks whether a cache file modified at the given (local) time
+            is older than the last change of the trials
+        """
+        changed = SyncState.objects.filter(pk=1).values_list('changed', flat=True).first()     # no write on page views
+        return changed is not None and last_modified < changed.astimezone().replace(tzinfo=None)
+
+
     def build_map(self, cache=True):
         cache_file = path.join(settings.BASE_DIR, 'data/cache/plot/map.pkl')
         if path.exists(cache_file) and cache:
             last_modified = datetime.fromtimestamp(path.getmtime(cache_file))
-            if last_modified.date() < Trial.objects.last().last_update:   # the cache file is outdated
+            if self._outdated(last_modified):   # the cache file is outdated
                 map_div, stat_countries, top_countries_div = self.build_map(cache=False)
             else:
                 with open(cache_file, 'rb') as handle:
@@ -104,7 +113,7 @@ class Plotter:
         cache_file = path.join(settings.BASE_DIR, 'data/cache/plot/phase.pkl')
         if path.exists(cache_file) and cache:
             last_modified = datetime.fromtimestamp(path.getmtime(cache_file))
-            if last_modified.date() < Trial.objects.last().last_update:   # the cache file is outdated
+            if self._outdated(last_modified):   # the cache file is outdated
                 phase_div = self.build_phases(cache=False)
             else:
                 with open(cache_file, 'rb') as handle:
@@ -155,7 +164,7 @@ class Plotter:
         cache_file = path.join(settings.BASE_DIR, 'data/cache/plot/status.pkl')
         if path.exists(cache_file) and cache:
             last_modified = datetime.fromtimestamp(path.getmtime(cache_file))
-            if last_modified.date() < Trial.objects.last().last_update:   # the cache file is outdated
+            if self._outdated(last_modified):   # the cache file is outdated
                 status_div = self.build_status(cache=False)
             else:
                 with open(cache_file, 'rb') as handle:
@@ -192,7 +201,7 @@ class Plotter:
         cache_file = path.join(settings.BASE_DIR, 'data/cache/plot/frequent_conditions.pkl')
         if path.exists(cache_file) and cache:
             last_modified = datetime.fromtimestamp(path.getmtime(cache_file))
-            if last_modified.date() < Trial.objects.last().last_update:   # the cache file is outdated
+            if self._outdated(last_modified):   # the cache file is outdated
                 frequent_div = self.build_top_conditions(cache=False)
             else:
                 with open(cache_file, 'rb') as handle:
@@ -232,7 +241,7 @@ class Plotter:
         cache_file = path.join(settings.BASE_DIR, 'data/cache/plot/updates_freq.pkl')
         if path.exists(cache_file) and cache:
             last_modified = datetime.fromtimestamp(path.getmtime(cache_file))
-            if last_modified.date() < Trial.objects.last().last_update:
+            if self._outdated(last_modified):
                 recent_div = self.build_update_chart(now, cache=False)
             else:
                 with open(cache_file, 'rb') as handle:
@@ -8,17 +8,15 @@ from posixpath import join
 from pandas.core.arrays.sparse import dtype
 from panels.utils import downloader, tools, customize
 from panels.models import *
-from panels.utils.comparator import *
+from panels.utils.record import RecordBatch, PRIMARY, SECONDARY, OTHER
 from visual import settings
 from ast import literal_eval
 import pandas as pd
 import numpy as np
 import re
-import time
-import threading
-from datetime import datetime
-
-from tqdm import tqdm
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
 
 # important columns from input (downloaded CSV from ClinicalTrials)
 # that are used for output and calculating other fields (MMSE and etc.)
@@ -47,34 +45,76 @@ DATE_COLUMNS = ['FirstPosted',
                     'LastUpdatePostDate',]
 
 
-# Threading variables
-PARALLEL_DOWNLOAD = 20
-s = threading.Semaphore(value=PARALLEL_DOWNLOAD)
+# number of CSV rows moved through the update pipeline at once
+CHUNK_SIZE = 1000
+
+
+class UpdateStats:
+    """
+        Counts the trials of an update run that skipped the pipeline
+        because their content has not changed, and keeps the last update
+        dates of the trials that failed to be downloaded
+    """
+    def __init__(self):
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = {}
+
+
+    def report(self) -> str:
+        return '{} of {} downloaded trials skipped with unchanged content'.format(self.skipped, self.downloaded)
+
+
+    def watermark(self, watermark: date) -> date:
+        """
+            Returns the date an update can move the watermark to. That is
+            the earliest last update date of the failed trials, if it is
+            before the given one, so the next update downloads them again.
+            None keeps the watermark where it is when the date of a failed
+            trial is unknown.
+        """
+        if not self.failed:
+            return watermark
+        dates = [tools.read_date(d) if isinstance(d, str) else None for d in self.failed.values()]
+        if watermark is None or None in dates:
+            return None
+        return min(min(dates).date(), watermark)
 
 
-def generate_data(csv_name):
+stats = UpdateStats()
+
+
+def generate_data(csv_name, chunk_size=CHUNK_SIZE):
     """
         Generates the data that should be inserted into the database
-        for further usage. Does the followings procedure:
+        for further usage. The CSV file is streamed in chunks and each
+        chunk goes through the followings procedure before the next one
+        is read, so memory stays bounded on large updates:
 
-            1. Load downloaded CSV file
+            1. Load a chunk of downloaded CSV file
             2. Clean data
-            3. Build other fields based on available data
+            3. Download full studies
+            4. Build other fields based on available data
 
         - Parameters
         ============================
         + csv_name :     String of downloaded csv file name
+        + chunk_size :   Number of CSV rows in each chunk
 
         - Return
         ============================
-        + pd.DataFrame : Generated data from CSV, similar to spreadsheet
+        + generator : Yields generated record.RecordBatch chunks
     """
-    data = pd.read_csv(settings.BASE_DIR + '/data/' + csv_name)
-    data = clean_data(data)
-    data = download_columns(data)
-    data = build_columns(data)
-    data = fill_null(data)
-    return data
+    for data in pd.read_csv(settings.BASE_DIR + '/data/' + csv_name, chunksize=chunk_size):
+        data = clean_data(data)
+        if data.empty:          # no update posted
+            continue
+
+        batch = download_columns(data)
+        if not batch:
+            continue
+
+        yield build_columns(batch)
 
 
 def clean_data(data):
@@ -95,71 +135,232 @@ def clean_data(data):
     return data
     
 
-def parallel_get_trial(nct_id, trials):
-    done = False
-    while not done:
-        try:
-            t = downloader.get_trial(nct_id)
-            if t:
-                trials.append(t)
-                done = True
-                s.release()
-        except Exception as e:
-            print(e)
-            print('Failed to retrieve:', nct_id)
-            time.sleep(0.5)
-
-
-def download_columns(data: pd.DataFrame) -> pd.DataFrame:
-    trials = []
-    threads = [None] * PARALLEL_DOWNLOAD
-
-    for nct_id in tqdm(data['NCT Number']):
-        s.acquire()
-        t = threading.Thread(target=parallel_get_trial, args=(nct_id, trials))
-
-        assigned = False
-        while not assigned:
-            for slot in range(PARALLEL_DOWNLOAD):           # move to find an empty slot
-                if threads[slot] is None or not threads[slot].is_alive():
-                    threads[slot] = t
-                    assigned = True
-                    break
-
-        t.start()
-    
-    for th in threads:
-        if th:
-            th.join()
+def download_columns(data: pd.DataFrame) -> RecordBatch:
+    """
+        Downloads the full study of every trial in the data and joins them
+        to the downloaded CSV columns
 
+        - Parameters
+        ============================
+        + data:         Pandas dataframe of downloaded CSV
 
-    additional = pd.DataFrame.from_dict(trials)
-    data.set_index('NCT Number', inplace=True)
-    data = additional.join(data, on='NCTID', rsuffix='_old')
-    return data
+        - Return
+        ============================
+        + RecordBatch : Full studies, with the CSV columns joined to its frame
+    """
+    nct_ids = list(data['NCT Number'])
+    last_updates = list(data['Last Update Posted']) if 'Last Update Posted' in data else [None] * len(nct_ids)
+    trials_downloader = downloader.default_downloader()
+    failed = len(trials_downloader.failed)
+    trials = trials_downloader.get_trials(nct_ids, last_updates)
+    dates = dict(zip(nct_ids, last_updates))
+    stats.failed.update((nct_id, dates.get(nct_id)) for nct_id in trials_downloader.failed[failed:])
+    trials = skip_unchanged(trials)
+    batch = RecordBatch(trials)
+    if not trials:
+        return batch
+
+    data = data.set_index('NCT Number').astype('string')
+    batch.frame = batch.frame.join(data, on='nct_id', rsuffix='_old')
+    return batch
+
+
+def skip_unchanged(trials: list) -> list:
+    """
+        Fingerprints the content of downloaded trials and drops the ones
+        whose fingerprint matches the stored one, so they skip the rest of
+        the pipeline. Only the last update date of skipped trials is
+        refreshed, without a history record.
 
+        - Parameters
+        ============================
+        + trials:       A list of parsed full studies (record.TrialRecord)
+
+        - Return
+        ============================
+        + list : Trials that are new or whose content has changed
+    """
+    for t in trials:
+        t.fingerprint = tools.fingerprint(t)
+
+    stored = {}
+    nct_ids = [t.nct_id for t in trials]
+    for chunk in tools.chunks(nct_ids):
+        query = Trial.objects.filter(nct_id__in=chunk)
+        for nct_id, pk, fingerprint in query.values_list('nct_id', 'pk', 'fingerprint'):
+            stored[nct_id] = (pk, fingerprint)
 
-def build_columns(data: pd.DataFrame) -> pd.DataFrame:
+    changed, unchanged = [], []
+    for t in trials:
+        pk, fingerprint = stored.get(t.nct_id, (None, None))
+        if fingerprint == t.fingerprint:
+            unchanged.append(Trial(pk=pk, last_update=tools.read_date(t.last_update)))
+        else:
+            changed.append(t)
+
+    # a single UPDATE ... CASE statement per chunk of skipped trials
+    Trial.objects.bulk_update(unchanged, ['last_update'], batch_size=tools.QUERY_CHUNK)
+
+    stats.downloaded += len(trials)
+    stats.skipped += len(trials) - len(changed)
+    return changed
+
+
+def build_columns(batch: RecordBatch) -> RecordBatch:
     """
         Build the columns that are not present in the clinicaltrials.gov database explicitly.
         Performing calculations that need other rows as well (such as mean, std, etc.)
     """
+    data = batch.frame
+    apply_plugins(data, customize.get_functions(), settings.PLUGIN_WORKERS)      # applying user defined fucntions
+
+    duration = tools.to_dates(data['completion_date']) - tools.to_dates(data['start_date'])
+    data['study_duration'] = pd.array(duration.dt.days, dtype='Int64')
+    valid = data['enrollment'].notna() & data['arms_number'].notna() & (data['arms_number'] != 0)
+    data['per_arm'] = (data['enrollment'] / data['arms_number']).where(valid, 0).astype('Float64')
+    data['phase'] = data['phase'].fillna('N').str.replace('N/A', 'N', regex=False).str.replace(r'\s|\||Phase|/', '', regex=True)
+
+    records = batch.records.values()
+    data['location'] = pd.array([Trial.location_of(r.countries) for r in records], dtype='string')
+    for kind in (PRIMARY, SECONDARY, OTHER):
+        data[kind.lower() + '_outcome'] = pd.array([outcome_text(r.outcomes_of(kind)) for r in records], dtype='string')
+
+    return batch
+
+
+def plugin_levels(functions: list) -> list:
+    """
+        Orders the plugins of derived columns in levels, where a plugin
+        comes after the plugins whose columns it reads. Plugins of a level
+        are independent of each other. A plugin without declared inputs
+        reads the whole row, so it comes after the plugins before it,
+        except for the ones that read its column (directly or through
+        other plugins), which come after it.
+
+        - Parameters
+        ============================
+        + functions:   Plugins (see `customize.get_functions`)
+
+        - Return
+        ============================
+        + list : A list of levels (lists of plugins)
+    """
+    producers = {f.column : f for f in functions}
+    after = {f : [producers[c] for c in f.inputs if c in producers] if getattr(f, 'inputs', None) is not None else []
+                for f in functions}
+
+    def reads(f, target) -> bool:
+        # whether f reads the column of target, directly or through other plugins
+        stack, visited = [f], set()
+        while stack:
+            p = stack.pop()
+            if p is target:
+                return True
+            if p not in visited:
+                visited.add(p)
+                stack.extend(after[p])
+        return False
+
+    for i, f in enumerate(functions):
+        if getattr(f, 'inputs', None) is None:
+            after[f] = [p for p in functions[:i] if not reads(p, f)]
+
+    levels = {}
+    def level(f, path: tuple) -> int:
+        if f in path:
+            raise ValueError('Plugins read each other\'s columns: {}'.format(
+                                ' -> '.join(p.column for p in path[path.index(f):] + (f,))))
+        if f not in levels:
+            levels[f] = max((level(p, path + (f,)) + 1 for p in after[f]), default=0)
+        return levels[f]
+
+    for f in functions:
+        level(f, ())
+
+    ordered = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+    for f in functions:
+        ordered[levels[f]].append(f)
+    return ordered
+
+
+def run_plugin(func, data: pd.DataFrame) -> pd.Series:
+    """
+        Computes the derived column of a plugin on a chunk of rows, row by
+        row or at once for batch plugins
+    """
+    inputs = getattr(func, 'inputs', None)
+    if inputs is not None:
+        missing = [c for c in inputs if c not in data]
+        if missing:
+            raise ValueError('Plugin {} reads unknown columns: {}'.format(func.__name__, ', '.join(missing)))
+        data = data[list(inputs)]
+
+    if getattr(func, 'batch', False):
+        values = func(data)
+    elif data.empty:
+        values = pd.Series(index=data.index, dtype=object)
+    else:
+        # rows of row-wise plugins hold None for missing values, as before typed columns
+        values = data.astype(object).where(data.notna(), None).apply(func, axis=1)
+
+    if len(values) != len(data):
+        raise ValueError('Plugin {} returned {} values for {} rows'.format(func.__name__, len(values), len(data)))
+    if isinstance(values, pd.Series):
+        return values.set_axis(data.index)
+    return pd.Series(values, index=data.index)
+
+
+def _plugin_worker(name: str, data: pd.DataFrame) -> pd.Series:
+    return run_plugin(getattr(customize.Functions, name), data)
 
-    for func in customize.get_functions():              # applying user defined fucntions
-        data[func.column] = data.apply(func, axis=1)
 
-    # selection = data['Date'].apply(lambda x: tools.read_date(x['Completion']) is not None and tools.read_date(x['Start']) is not None) 
-    selection = data['Date'].apply(lambda x: x['Completion'] and x['Start']).isna()
-    data.loc[selection, 'StudyDuration'] = data.loc[selection, 'Date'].apply(lambda x: (tools.read_date(x['Completion']) - tools.read_date(x['Start'])).days if x['Completion'] and x['Start'] else None)
-    valid = data[data['Enrollment'].notna() & data['ArmsNumber'].notna() & data['ArmsNumber'] != 0]
-    data['PerArm'] = (valid['Enrollment'].astype(int) / valid['ArmsNumber'].astype(int))
-    data['PerArm'] = data['PerArm'].fillna(0)
-    data['NumSites'] = data['Locations'].apply(len)
-    data['Phase'] = data['Phase'].fillna('N').apply(lambda x: re.sub(r'\s|\||Phase|/', '', x.replace('N/A', 'N')))
+def apply_plugins(data: pd.DataFrame, functions: list, workers: int = 1) -> pd.DataFrame:
+    """
+        Adds the derived columns of plugins to a chunk of rows, level by
+        level (see `plugin_levels`). Independent plugins run in a pool of
+        `workers` processes, that only get the columns the plugins read.
+        Plugins run in the current process with a single worker, or when
+        the current process is a daemon (e.g. a parser process of the
+        import) that cannot have child processes.
+
+        - Parameters
+        ============================
+        + data:         A dataframe of a chunk of trials
+        + functions:    Plugins (see `customize.get_functions`)
+        + workers:      Number of processes running plugins
 
+        - Return
+        ============================
+        + pd.DataFrame : The dataframe with the derived columns
+    """
+    levels = plugin_levels(functions)
+    parallel = workers > 1 and any(len(l) > 1 for l in levels) and not multiprocessing.current_process().daemon
+    if not parallel:
+        for level in levels:
+            for func in level:
+                data[func.column] = run_plugin(func, data)
+        return data
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        for level in levels:
+            futures = {}
+            for func in level:
+                inputs = func.inputs if func.inputs is not None else list(data.columns)
+                futures[func.column] = pool.submit(_plugin_worker, func.__name__, data[list(inputs)])
+            for column, future in futures.items():
+                data[column] = future.result()
     return data
 
 
+def outcome_text(outcomes: list) -> str:
+    """
+        Formats the outcomes of a trial the way they are stored in the
+        outcome fields of the trial
+    """
+    return str([{'Measure' : o.measure, 'TimeFrame' : o.time_frame, 'Description' : o.description}
+                    for o in outcomes])
+
+
 def text_preprocess(text):
     """
         Preprocess and normalize given text
@@ -252,16 +453,10 @@ def extract_treatment_duration(text, time_unit='d'):
     return duration / unit
 
 
-def fill_null(df):
-    """
-        Fill out every where that is null with None value
-    """
-    return df.where(pd.notnull(df), None)
-
-
-def data_mapper(row: dict) -> Trial:
+def build_trial(row: dict) -> Trial:
     """
-        Maps a row to single model object
+        Maps a row to a single model object without saving it into
+        the database, so it can be used for bulk inserts as well
 
         - Parameters
         ============================
@@ -269,90 +464,49 @@ def data_mapper(row: dict) -> Trial:
 
         - Return
         ============================
-        + models.Trial : An object of trial class from models
+        + models.Trial : An unsaved object of trial class from models
     """
     t = Trial(
-        nct_id = row['NCTID'],
-        status = row['Status'][0],
-        phase  = row['Phase'],
-        design_primary_purpose = Trial.get_char(Trial.PURPOSE_CHOICES, row['StudyDesign']['PrimaryPurpose']),
-        funder_type = row['Sponsors']['Lead']['Type'].split('_')[-1][0] if row['Sponsors']['Lead'] and row['Sponsors']['Lead']['Type'] else None,
-        protocol = row['Protocol'],
-        title = row['Title'],
-        first_posted = tools.read_date(row['Date']['FirstPosted']),
-        start_date = tools.read_date(row['Date']['Start']),
-        first_start_date =  tools.read_date(row['Date']['Start']),
-        primary_completion = tools.read_date(row['Date']['PrimaryCompletion']),
-        first_primary_completion = tools.read_date(row['Date']['PrimaryCompletion']),
-        end_date =  tools.read_date(row['Date']['Completion']),
-        first_end_date = tools.read_date(row['Date']['Completion']),
-        last_update = tools.read_date(row['Date']['LastUpdate']),
-        study_duration = row['StudyDuration'],
-        enroll_number = row['Enrollment'],
-        arms_number = row['ArmsNumber'],
-        per_arm = row['PerArm'],
-        primary_outcome = row['Outcome']['Primary'],
-        secondary_outcome = row['Outcome']['Secondary'],
-        other_outcome = row['Outcome']['Other'],
-        eligibility_criteria = row['Criteria'],
-        num_sites = len(row['Locations']),
-        brief_summary = row[ 'Summary']['Brief'],
-        description = row['Summary']['Detailed'],
-        location_str = row['LocationsString'],
-        min_age = re.search(r'\d+', row['Age']['Min']).group() if row['Age']['Min'] and re.search(r'\d+', row['Age']['Min']) else None,
-        max_age = re.search(r'\d+', row['Age']['Max']).group() if row['Age']['Max'] and re.search(r'\d+', row['Age']['Max']) else None,
+        nct_id = row['nct_id'],
+        status = row['status'][0],
+        phase  = row['phase'],
+        design_primary_purpose = Trial.get_char(Trial.PURPOSE_CHOICES, row['primary_purpose']),
+        funder_type = row['lead_sponsor_type'].split('_')[-1][0] if row['lead_sponsor_type'] else None,
+        protocol = row['protocol'],
+        title = row['title'],
+        first_posted = tools.read_date(row['first_posted']),
+        start_date = tools.read_date(row['start_date']),
+        first_start_date =  tools.read_date(row['start_date']),
+        primary_completion = tools.read_date(row['primary_completion']),
+        first_primary_completion = tools.read_date(row['primary_completion']),
+        end_date =  tools.read_date(row['completion_date']),
+        first_end_date = tools.read_date(row['completion_date']),
+        last_update = tools.read_date(row['last_update']),
+        study_duration = row['study_duration'],
+        enroll_number = row['enrollment'],
+        arms_number = row['arms_number'],
+        per_arm = row['per_arm'],
+        primary_outcome = row['primary_outcome'],
+        secondary_outcome = row['secondary_outcome'],
+        other_outcome = row['other_outcome'],
+        eligibility_criteria = row['criteria'],
+        num_sites = row['num_sites'],
+        brief_summary = row['brief_summary'],
+        description = row['description'],
+        location_str = row['location_str'],
+        fingerprint = row.get('fingerprint'),
+        min_age = re.search(r'\d+', row['min_age']).group() if row['min_age'] and re.search(r'\d+', row['min_age']) else None,
+        max_age = re.search(r'\d+', row['max_age']).group() if row['max_age'] and re.search(r'\d+', row['max_age']) else None,
+        location = row['location'],
     )
 
-    if len(row['Countries']) == 1 and 'United States' in row['Countries']:
-        t.location = Trial.US
-    elif len(row['Countries']) > 1 and 'United States' in row['Countries']:
-        t.location = Trial.BOTH
-    else:
-        t.location = Trial.NONUS
-
-    t.save()
-
-    for agent in row['Agents']:
-        if agent['Name'] and agent['Type']:
-            try:
-                ag = Agent.objects.get(name=agent['Name'], type=Agent.get_type_choice(agent['Type']))
-            except Agent.DoesNotExist:
-                ag = Agent(name=agent['Name'], type=Agent.get_type_choice(agent['Type']))
-                ag.save()
-            t.agent.add(ag)     
-
-
-    for c in row['Conditions']:
-        try:
-            c = Condition.objects.get(name=c)
-            t.condition.add(c)
-        except Condition.DoesNotExist:
-            obj = Condition(name=c)
-            obj.save()
-            t.condition.add(obj)
-    
-    for c in row['Countries']:
-        try:
-            country = Country.objects.get(name=c)
-        except Country.DoesNotExist:
-            country = Country(name=c)
-            country.save()
-        t.countries.add(country)
-
-    for s in row['Sponsors']['All']:
-        try:
-            sponsor = Sponsor.objects.get(name=s['Name'])
-        except Sponsor.DoesNotExist:
-            sponsor = Sponsor(name=s['Name'])
-            sponsor.save()
-        t.sponsor.add(sponsor)
-
     return t
 
 
-def data_updater(row: dict) -> Trial:
+def trial_relations(row: dict) -> dict:
     """
-        Updating existing data
+        Extracts the values of a row that are stored in lookup tables and
+        linked to the trial through many-to-many relations
 
         - Parameters
         ============================
@@ -360,49 +514,16 @@ def data_updater(row: dict) -> Trial:
 
         - Return
         ============================
-        + models.Trial : An object of trial class from models
+        + dict : Trial relation name mapped to the list of lookup keys
     """
-
-    comp = TrialComparator()
-    t = comp.update_database(row)
-
-    t.save()
-
-    return t
-
-
-def build_objects(df: pd.DataFrame) -> tuple[list, list]:
-    """
-        Build a objects and insert them into the database if they are not exist
-        and update the existing ones
-
-        - Parameters
-        ============================
-        + df:         A dataframe that willing to build objects from
-
-        - Return
-        ============================
-        + list : A list of primary keys of objects that have been created or updated
-    """
-    updated_pk = []
-    new_pk = []
-
-    exists = df['NCTID'].apply(lambda x: Trial.objects.filter(nct_id=x).exists())
-
-    objs = df[~exists].apply(data_mapper, axis=1)       # build not exisiting ones
-    if len(objs) > 0:
-        for o in objs:
-            new_pk.append(o.pk)
-
-    objs = df[exists].apply(data_updater, axis=1)       # updating exsiting ones
-    if len(objs) > 0:
-        for o in objs:
-            updated_pk.append(o.pk)
-
-    return new_pk, updated_pk
-
-    
-    
-
-
-    
\ No newline at end of file
+    agents = []
+    for agent in row['agents']:
+        if agent.name and Agent.get_type_choice(agent.type):
+            agents.append((agent.name, Agent.get_type_choice(agent.type)))
+
+    return {
+        'agent' : agents,
+        'condition' : [c for c in row['conditions'] if c],
+        'countries' : [c for c in row['countries'] if c],
+        'sponsor' : [s.name for s in row['sponsors'] if s.name],
+    }
@@ -0,0 +1,145 @@
+"""
+    On-disk cache of the raw full study XML downloaded from the
+    clinicaltrials.gov API. Entries are addressed by a hash of the NCT ID
+    and the last update date of the study, so a study is downloaded again
+    only when it has been updated. Responses are stored gzip compressed
+    and the least recently used entries are evicted once the cache grows
+    over its size limit.
+"""
+import os
+import gzip
+import hashlib
+import threading
+from visual import settings
+from panels.utils.parser import FullStudyParser
+
+
+CACHE_DIR = os.path.join(settings.BASE_DIR, 'data', 'cache', 'studies')
+CACHE_SIZE = 2048           # MB
+
+
+class ResponseCache:
+    """
+        Content addressed cache of raw full study responses
+
+        - Parameters
+        ============================
+        + directory:    Directory to store the cache in
+        + max_size:     Maximum size of the cache in MB (0 disables the cache)
+    """
+    def __init__(self, directory=None, max_size=None):
+        conf = settings.DOWNLOADER
+        self.directory = directory or conf.get('cache_dir', CACHE_DIR)
+        self.max_size = (max_size if max_size is not None else conf.get('cache_size', CACHE_SIZE)) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+
+    @staticmethod
+    def cacheable(nct_id: str, last_update: str) -> bool:
+        """
+            Checks the NCT ID and last update date of a study can address
+            an entry (the last update date of a CSV row may be NaN)
+        """
+        return isinstance(nct_id, str) and isinstance(last_update, str) and bool(last_update.strip())
+
+
+    @staticmethod
+    def key(nct_id: str, last_update: str) -> str:
+        return hashlib.sha1('{}|{}'.format(nct_id.strip(), last_update.strip()).encode()).hexdigest()
+
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.xml.gz')
+
+
+    def _files(self):
+        for root, dirs, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith('.xml.gz'):
+                    yield os.path.join(root, file)
+
+
+    def get(self, nct_id: str, last_update: str) -> bytes:
+        """
+            Returns the cached response of a study version or None
+        """
+        if not self.enabled or not self.cacheable(nct_id, last_update):
+            return None
+
+        path = self._path(self.key(nct_id, last_update))
+        try:
+            with gzip.open(path, 'rb') as f:
+                content = f.read()
+        except (FileNotFoundError, OSError, EOFError):
+            self.misses += 1
+            return None
+
+        os.utime(path)              # keeping recently used entries from eviction
+        self.hits += 1
+        return content
+
+
+    def put(self, nct_id: str, last_update: str, content: bytes):
+        """
+            Stores the response of a study version and evicts the least
+            recently used entries if the cache is over its size limit
+        """
+        if not self.enabled or not self.cacheable(nct_id, last_update):
+            return
+
+        path = self._path(self.key(nct_id, last_update))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with gzip.open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(os.path.getsize(f) for f in self._files())
+            else:
+                self._size += os.path.getsize(path)
+
+            if self._size > self.max_size:
+                self.evict()
+
+
+    def evict(self):
+        """
+            Removes the least recently used entries until the cache is
+            below 90% of its size limit
+        """
+        entries = []
+        for path in self._files():
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        size = sum(e[1] for e in entries)
+        for mtime, file_size, path in entries:
+            if size <= self.max_size * 0.9:
+                break
+            os.remove(path)
+            size -= file_size
+        self._size = size
+
+
+    def replay(self):
+        """
+            Parses every cached response offline
+
+            - Return
+            ============================
+            + generator : Yields FullStudyParser objects
+        """
+        for path in self._files():
+            with gzip.open(path, 'rb') as f:
+                yield FullStudyParser(f.read())
@@ -0,0 +1,191 @@
+"""
+    Flat records of parsed trials. Parsers fill a TrialRecord with typed
+    scalar fields and separate child lists (agents, outcomes, locations,
+    sponsors, ...), instead of nested dicts. A batch of records converts
+    to a columnar DataFrame of the scalar fields, with a typed column per
+    field, while the child lists stay on the records.
+"""
+import pandas as pd
+from collections import namedtuple
+
+
+AgentRecord = namedtuple('AgentRecord', ['name', 'type', 'description'])
+OutcomeRecord = namedtuple('OutcomeRecord', ['kind', 'measure', 'time_frame', 'description'])
+LocationRecord = namedtuple('LocationRecord', ['name', 'city', 'state', 'country', 'zip_code'])
+SponsorRecord = namedtuple('SponsorRecord', ['name', 'type'])
+
+# kinds of outcomes
+PRIMARY = 'Primary'
+SECONDARY = 'Secondary'
+OTHER = 'Other'
+
+
+# scalar field : dtype of its column in the batch DataFrame
+SCALARS = {
+    'nct_id' : 'string',
+    'phase' : 'string',
+    'status' : 'string',
+    'allocation' : 'string',
+    'primary_purpose' : 'string',
+    'study_type' : 'string',
+    'protocol' : 'string',
+    'title' : 'string',
+    'first_posted' : 'string',
+    'start_date' : 'string',
+    'last_update' : 'string',
+    'primary_completion' : 'string',
+    'completion_date' : 'string',
+    'brief_summary' : 'string',
+    'description' : 'string',
+    'criteria' : 'string',
+    'enrollment' : 'Int64',
+    'arms_number' : 'Int64',
+    'lead_sponsor' : 'string',
+    'lead_sponsor_type' : 'string',
+    'min_age' : 'string',
+    'max_age' : 'string',
+    'gender' : 'string',
+    'location_str' : 'string',
+    'has_results' : 'boolean',
+    'fingerprint' : 'string',
+}
+
+# child lists of a record
+CHILDREN = (
+    'agents',
+    'conditions',
+    'outcomes',
+    'locations',
+    'countries',
+    'sponsors',
+    'keywords',
+    'condition_mesh',
+    'intervention_mesh',
+)
+
+class TrialRecord:
+    """
+        A parsed trial
+    """
+    __slots__ = tuple(SCALARS) + CHILDREN
+
+    def __init__(self, **values):
+        for name in SCALARS:
+            setattr(self, name, values.get(name))
+        for name in CHILDREN:
+            setattr(self, name, list(values.get(name) or []))
+
+
+    def __eq__(self, other):
+        return isinstance(other, TrialRecord) and self.as_dict() == other.as_dict()
+
+
+    def __repr__(self):
+        return '<TrialRecord {}>'.format(self.nct_id)
+
+
+    def __getstate__(self):
+        return self.as_dict()
+
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+    def as_dict(self) -> dict:
+        return {name : getattr(self, name) for name in self.__slots__}
+
+
+    def finish(self):
+        """
+            Sets the fields derived from the child lists once the record
+            has been parsed
+        """
+        countries = [l.country for l in self.locations if l.country is not None]
+        self.countries = list(dict.fromkeys(countries))
+        self.location_str = '\n'.join(', '.join(v for v in l if v is not None) for l in self.locations)
+        if self.lead_sponsor is not None or self.lead_sponsor_type is not None:
+            self.sponsors.insert(0, SponsorRecord(self.lead_sponsor, self.lead_sponsor_type))
+        try:
+            self.enrollment = int(self.enrollment) if self.enrollment else None
+        except ValueError:
+            self.enrollment = None
+        return self
+
+
+    def outcomes_of(self, kind: str) -> list:
+        return [o for o in self.outcomes if o.kind == kind]
+
+
+
+def to_frame(records) -> pd.DataFrame:
+    """
+        Converts records to a DataFrame with a typed column per scalar field
+
+        - Parameters
+        ============================
+        + records:  An iterable of TrialRecord objects
+
+        - Return
+        ============================
+        + pd.DataFrame : Scalar fields of the records, plus the number of
+                            sites of each trial
+    """
+    records = list(records)
+    columns = {name : pd.array([getattr(r, name) for r in records], dtype=dtype)
+                for name, dtype in SCALARS.items()}
+    columns['num_sites'] = pd.array([len(r.locations) for r in records], dtype='Int64')
+    return pd.DataFrame(columns)
+
+
+def children_frame(records, name: str) -> pd.DataFrame:
+    """
+        Converts a child list of records to a long DataFrame with a row
+        per child and the nct_id of its trial
+    """
+    rows = [(r.nct_id,) + (tuple(c) if isinstance(c, tuple) else (c,))
+                for r in records for c in getattr(r, name)]
+    fields = {
+        'agents' : AgentRecord._fields,
+        'outcomes' : OutcomeRecord._fields,
+        'locations' : LocationRecord._fields,
+        'sponsors' : SponsorRecord._fields,
+    }.get(name, (name,))
+    return pd.DataFrame(rows, columns=('nct_id',) + tuple(fields)).astype('string')
+
+
+
+class RecordBatch:
+    """
+        A batch of records moved through the pipeline together. The scalar
+        fields and the calculated columns are in `frame`, the child lists
+        on the records themselves.
+
+        - Parameters
+        ============================
+        + records:  An iterable of TrialRecord objects, only the last
+                    record of an nct_id is kept
+        + frame:    A DataFrame of the records (`to_frame` by default)
+    """
+    def __init__(self, records, frame: pd.DataFrame = None):
+        self.records = {r.nct_id : r for r in records}
+        self.frame = frame if frame is not None else to_frame(self.records.values())
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    def rows(self) -> list:
+        """
+            Returns a row (dict) per trial of the frame, with the child
+            lists of its record and None for missing values
+        """
+        frame = self.frame.drop_duplicates(subset='nct_id', keep='last')
+        frame = frame.astype(object).where(frame.notna(), None)
+        rows = frame.to_dict(orient='records')
+        for row in rows:
+            record = self.records[row['nct_id']]
+            for name in CHILDREN:
+                row[name] = getattr(record, name)
+        return rows
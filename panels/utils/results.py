@@ -0,0 +1,91 @@
+"""
+    Results ingest mode of the import. The participant flow and baseline
+    of the posted results, that are parsed only on demand by XMLFastParser,
+    are stored in their own tables when the import is run with `--results`.
+"""
+from panels.models import *
+
+
+def parsed_results(parser) -> dict:
+    """
+        Returns the parsed results of a study, or None if the study has
+        no posted results
+    """
+    return parser.results if parser.record.has_results else None
+
+
+def build_objects(trial: Trial, result: dict) -> dict:
+    """
+        Builds the rows of the results tables of a trial
+
+        - Parameters
+        ============================
+        + trial:    A saved trial object
+        + result:   The parsed results of the trial (XMLFastParser.results)
+
+        - Return
+        ============================
+        + dict : Model mapped to a list of its unsaved objects
+    """
+    objects = {
+        ResultGroup : [],
+        FlowMilestone : [],
+        BaselineAnalyzed : [],
+        BaselineMeasurement : [],
+    }
+
+    flow, baseline = result['Flow'], result['Baseline']
+    for group_id, group in flow['Groups'].items():
+        objects[ResultGroup].append(ResultGroup(trial=trial, section=ResultGroup.FLOW, group_id=group_id,
+                                                title=group['title'], description=group['description']))
+
+    for period, milestones in flow['TimePeriods'].items():
+        for milestone, counts in milestones.items():
+            for group_id, count in counts.items():
+                objects[FlowMilestone].append(FlowMilestone(trial=trial, period=period, milestone=milestone,
+                                                            group_id=group_id, count=count))
+
+    for group in baseline['Groups']:
+        objects[ResultGroup].append(ResultGroup(trial=trial, section=ResultGroup.BASELINE, group_id=group['id'],
+                                                title=group['title'], description=group['description']))
+
+    for analyzed in baseline['Analyzed']:
+        for group_id, count in analyzed['counts'].items():
+            objects[BaselineAnalyzed].append(BaselineAnalyzed(trial=trial, units=analyzed['unit'],
+                                                              scope=analyzed['scope'], group_id=group_id,
+                                                              count=count))
+
+    for measure in baseline['Measure']:
+        for category, values in measure['Measurements'].items():
+            for v in values:
+                objects[BaselineMeasurement].append(BaselineMeasurement(trial=trial,
+                                                                        measure=measure['title'],
+                                                                        units=measure['units'],
+                                                                        param=measure['param'],
+                                                                        dispersion=measure['dispersion'],
+                                                                        category=category or None,
+                                                                        group_id=v['group_id'],
+                                                                        value=v['value'],
+                                                                        lower_limit=v['lower_limit'],
+                                                                        upper_limit=v['upper_limit']))
+    return objects
+
+
+def store(trials: list, results: dict, batch_size=1000):
+    """
+        Writes the results of inserted trials into the results tables
+
+        - Parameters
+        ============================
+        + trials:       Saved trial objects
+        + results:      Parsed results of trials (nct_id : results)
+        + batch_size:   Number of rows written in each query
+    """
+    objects = {}
+    for t in trials:
+        if results.get(t.nct_id):
+            for model, rows in build_objects(t, results[t.nct_id]).items():
+                objects.setdefault(model, []).extend(rows)
+
+    for model, rows in objects.items():
+        model.objects.bulk_create(rows, batch_size=batch_size)
@@ -0,0 +1,40 @@
+"""
+    Tuning of SQLite connections. The pragmas are applied to every new
+    connection, so the dashboard and the API keep reading while the data
+    manager is writing: WAL journal lets readers run next to a writer,
+    the busy timeout makes a blocked connection wait instead of failing,
+    and the mmap and page cache sizes keep hot pages in memory. Every
+    pragma can be overridden by the `sqlite` section of config.yml.
+"""
+from visual import settings
+
+
+# pragma : default value
+PRAGMAS = {
+    'journal_mode' : 'wal',
+    'synchronous' : 'normal',           # safe with WAL, syncs on checkpoints only
+    'mmap_size' : 268435456,            # 256 MB
+    'cache_size' : -65536,              # negative values are in KB (64 MB)
+    'busy_timeout' : 10000,             # ms
+    'temp_store' : 'memory',
+}
+
+
+def pragmas() -> dict:
+    """
+        Returns the pragmas of the config file merged over the defaults
+    """
+    return {**PRAGMAS, **settings.SQLITE}
+
+
+def configure(sender, connection, **kwargs):
+    """
+        Applies the pragmas on a new database connection, connected to
+        the `connection_created` signal
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in pragmas().items():
+            cursor.execute('PRAGMA {} = {}'.format(pragma, value))
@@ -0,0 +1,178 @@
+"""
+    A local stub of the clinicaltrials.gov endpoints used by the downloader,
+    to run the update pipeline offline (e.g. for tests). Full studies are
+    served from `<directory>/<NCT ID>.xml` in the format of the FullStudy
+    API. The CSV downloads of updated trials are served from the rows of
+    `<directory>/studies.csv` whose "Last Update Posted" falls in the
+    requested dates, capped at `down_count` rows like the real endpoint.
+    The server can inject failures and latency to exercise the retry
+    and rate limiting logic of the downloader.
+
+    Usage:
+        with StubServer('data/stub') as server:
+            downloader.TrialDownloader(api_url=server.api_url).get_trials(ids)
+
+    or standalone:
+        python -m panels.utils.stubserver data/stub --port 8765
+"""
+import io
+import os
+import csv
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+EMPTY_STUDY = b'<?xml version="1.0" encoding="UTF-8"?><FullStudiesResponse><NStudiesFound>0</NStudiesFound><FullStudyList/></FullStudiesResponse>'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'           # keep-alive connections like the real API
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def _send(self, status: int, content: bytes, content_type='text/xml'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def _csv(self, query: dict) -> bytes:
+        """
+            Returns the rows of studies.csv updated between lupd_s and
+            lupd_e (inclusive), capped at down_count rows
+        """
+        path = os.path.join(self.server.directory, 'studies.csv')
+        if not os.path.exists(path):
+            return b''
+
+        start = query.get('lupd_s', [None])[0]
+        end = query.get('lupd_e', [None])[0]
+        start = datetime.strptime(start, '%m/%d/%Y') if start else datetime.min
+        end = datetime.strptime(end, '%m/%d/%Y') if end else datetime.max
+        cap = int(query.get('down_count', [10000])[0])
+
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            rows = [r for r in reader 
+                        if start <= datetime.strptime(r['Last Update Posted'], '%B %d, %Y') <= end]
+
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        writer.writerows(rows[:cap])
+        return out.getvalue().encode()
+
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail_rate and random.random() < server.fail_rate:
+            return self._send(503, b'Service Unavailable', 'text/plain')
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/api/query/full_studies':
+            nct_id = query.get('expr', [''])[0]
+            path = os.path.join(server.directory, os.path.basename(nct_id) + '.xml')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return self._send(200, f.read())
+            return self._send(200, EMPTY_STUDY)
+
+        if url.path == '/ct2/results/download_fields':
+            return self._send(200, self._csv(query), 'text/csv')
+
+        self._send(404, b'Not Found', 'text/plain')
+
+
+
+class StubServer:
+    """
+        Runs the stub endpoints on a local port in a background thread
+
+        - Parameters
+        ============================
+        + directory:    Directory of the canned responses
+        + port:         Port to listen on (0 picks a free port)
+        + fail_rate:    Fraction of requests answered with HTTP 503
+        + latency:      Seconds to wait before answering each request
+    """
+    def __init__(self, directory: str, port: int = 0, fail_rate: float = 0, latency: float = 0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.directory = directory
+        self.httpd.fail_rate = fail_rate
+        self.httpd.latency = latency
+        self.httpd.requests = 0
+        self._thread = None
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address
+        return 'http://{}:{}'.format(host, port)
+
+
+    @property
+    def api_url(self) -> str:
+        return self.url + '/api/query/full_studies?expr={}&max_rnk=1&fmt=xml'
+
+
+    @property
+    def csv_url(self) -> str:
+        return self.url + '/ct2/results/download_fields?down_count=10000&down_flds=all&down_fmt=csv&flds=a&flds=b&flds=y'
+
+
+    @property
+    def requests(self) -> int:
+        return self.httpd.requests
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.stop()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves canned clinicaltrials.gov responses locally.')
+    parser.add_argument('directory', help='Directory of the canned responses.')
+    parser.add_argument('--port', '-p', type=int, default=8765)
+    parser.add_argument('--fail-rate', type=float, default=0, help='Fraction of requests failing with HTTP 503.')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before each response.')
+    args = parser.parse_args()
+
+    server = StubServer(args.directory, args.port, args.fail_rate, args.latency)
+    print('Serving {} on {}'.format(args.directory, server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,73 +1,87 @@
-import re
+import json
+import hashlib
+import numpy as np
 import pandas as pd
-from panels.models import *
+from panels.utils.record import TrialRecord
 from datetime import datetime
+from functools import lru_cache
 
 
+# formats of dates in clinicaltrials.gov data
+DATE_FORMATS = ('%B %d, %Y', '%B %Y')
+
+# number of date strings `read_date` keeps parsed, trials share a few
+# thousand distinct dates
+DATE_CACHE = 16384
+
+# maximum number of values passed to a single `__in` lookup, to stay under
+# the limit of query variables of SQLite
+QUERY_CHUNK = 500
+
+
+def chunks(items: list, size: int = QUERY_CHUNK):
+    """
+        Yields consecutive slices of a list of at most `size` items
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+@lru_cache(maxsize=DATE_CACHE)
 def read_date(date_str: str) -> datetime:
     """
         Converts date in string format to datetime object in order to use it or
-        insert it into the database.
+        insert it into the database. Parsed dates are memoized.
     """
     if not date_str:
         return None
 
     if ',' in date_str:
-        date_format = '%B %d, %Y'
+        date_format = DATE_FORMATS[0]
     else:
-        date_format = '%B %Y'
+        date_format = DATE_FORMATS[1]
     
     return datetime.strptime(date_str, date_format)
 
 
-def trial_to_dataframe(trial: dict) -> pd.DataFrame:
+def to_dates(values: pd.Series) -> pd.Series:
     """
-        Transform a single trials as dictionary to a single row dataframe
-        to pass it to the processor module. 
+        Vectorized `read_date` of a column of date strings. Every distinct
+        string is parsed once, by `pd.to_datetime` with the format of its
+        kind of date.
+
+        - Parameters
+        ============================
+        + values:   A series of date strings
+
+        - Return
+        ============================
+        + pd.Series : datetime64 series with NaT for missing or invalid dates
     """
-    pass
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques.astype(object))
+    full = np.array([',' in u for u in uniques], dtype=bool)
+
+    parsed = np.full(len(uniques) + 1, np.datetime64('NaT'), dtype='datetime64[ns]')      # the last one for missing values (code -1)
+    parsed[:-1][full] = pd.to_datetime(uniques[full], format=DATE_FORMATS[0], errors='coerce').to_numpy()
+    parsed[:-1][~full] = pd.to_datetime(uniques[~full], format=DATE_FORMATS[1], errors='coerce').to_numpy()
+    return pd.Series(parsed[codes], index=values.index)
 
 
-def create_object(data: dict) -> Trial:
+def fingerprint(record: TrialRecord) -> str:
     """
-        Returns an instance of Trial class using the parsed data from the 
-        XML file. To use this function there is no need to call parse function
-        since it will be called in the constructor.
+        Computes a stable hash of the content of a parsed trial. The last
+        update date is left out, since clinicaltrials.gov bumps it even when
+        nothing else has changed.
     """
-    t = Trial()
+    content = {k : v for k, v in record.as_dict().items() if k not in ('fingerprint', 'last_update')}
+    content = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
 
-    if len(data['Countries']) == 1 and 'United States' in data['Countries']:
-        t.location = Trial.US
-    elif len(data['Countries']) > 1 and 'United States' in data['Countries']:
-        t.location = Trial.BOTH
-    else:
-        t.location = Trial.NONUS
-
-    t.save()
-
-    for agent in data['Agents']:
-        try:
-            ag = Agent.objects.get(name=agent['Name'], type=Agent.get_type_choice(agent['Type']))
-        except Agent.DoesNotExist:
-            ag = Agent(name=agent['Name'], type=Agent.get_type_choice(agent['Type']))
-            ag.save()
-        t.agent.add(ag) 
-
-    for c in data['Countries']:
-        try:
-            country = Country.objects.get(name=c)
-        except Country.DoesNotExist:
-            country = Country(name=c)
-            country.save()
-        t.countries.add(country)
-
-    for s in data['Sponsors']['All']:
-        try:
-            sponsor = Sponsor.objects.get(name=s['Name'])
-        except Sponsor.DoesNotExist:
-            sponsor = Sponsor(name=s['Name'])
-            sponsor.save()
-        t.sponsor.add(sponsor)
 
-    
-    return t
\ No newline at end of file
+def trial_to_dataframe(trial: dict) -> pd.DataFrame:
+    """
+        Transform a single trials as dictionary to a single row dataframe
+        to pass it to the processor module. 
+    """
+    pass
@@ -85,12 +85,29 @@ WSGI_APPLICATION = 'visual.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+DATABASE = config.get('database') or {}
+
+if DATABASE.get('engine') in ('postgresql', 'postgres'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': DATABASE.get('name', 'trial'),
+            'USER': DATABASE.get('user', 'postgres'),
+            'PASSWORD': DATABASE.get('password', ''),
+            'HOST': DATABASE.get('host', 'localhost'),
+            'PORT': DATABASE.get('port', 5432),
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': DATABASE.get('name', os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+
+# Pragmas applied on SQLite connections (see panels/utils/sqlite.py)
+SQLITE = config.get('sqlite') or {}
 
 
 # Password validation
@@ -162,4 +179,16 @@ EMAIL_APP_PASSWORD  =   config['email']['password']
 
 UPDATE_RECIPIENTS = config['update_recipients'] + ADMINS_EMAIL
 
-LOG_RECIPIENTS = config['log_recipients'] + ADMINS_EMAIL
\ No newline at end of file
+LOG_RECIPIENTS = config['log_recipients'] + ADMINS_EMAIL
+
+
+# Settings of downloading trials from clinicaltrials.gov
+DOWNLOADER = config.get('downloader') or {}
+
+
+# Storing only the changed fields of update runs instead of full history copies
+HISTORY_JOURNAL = bool(config.get('history_journal', False))
+
+
+# Processes running the derived column plugins of customize.Functions
+PLUGIN_WORKERS = int(config.get('plugin_workers', 1))